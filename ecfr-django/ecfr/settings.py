@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 
 from pathlib import Path
 import os
+from corsheaders.defaults import default_headers
 from dotenv import load_dotenv
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,6 +42,7 @@ INSTALLED_APPS = [
     "django.contrib.auth",
     "django.contrib.contenttypes",
     "django.contrib.messages",
+    "django.contrib.postgres",
     "django.contrib.sessions",
     "django.contrib.staticfiles",
     # dependencies
@@ -54,15 +56,16 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     # builtin
     "django.middleware.security.SecurityMiddleware",
-    "whitenoise.middleware.WhiteNoiseMiddleware",
+    # ecfr: CORS headers have to be added to the responses WhiteNoise answers from the API snapshot
+    "corsheaders.middleware.CorsMiddleware",
+    "regulations.middleware.SnapshotWhiteNoiseMiddleware",
+    # builtin
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
-    # ecfr
-    "corsheaders.middleware.CorsMiddleware",
 ]
 
 ROOT_URLCONF = "ecfr.urls"
@@ -137,12 +140,63 @@ STATIC_URL = "static/"
 STATIC_ROOT = BASE_DIR / "staticfiles"
 STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
 
+# API responses pre-rendered by export_api_snapshot, served by WhiteNoise in front of the views.
+# The export is resolved when the server starts, so restart to serve a newer one
+ECFR_SNAPSHOT_DIR = Path(os.getenv("ECFR_SNAPSHOT_DIR", BASE_DIR / "snapshot"))
+if (ECFR_SNAPSHOT_DIR / "current").is_dir():
+    WHITENOISE_ROOT = os.path.realpath(ECFR_SNAPSHOT_DIR / "current")
+WHITENOISE_INDEX_FILE = "index.json"
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# On-disk cache of eCFR API responses (regulations/http_cache.py), set ECFR_CACHE_DIR="" to disable
+ECFR_CACHE_DIR = os.getenv("ECFR_CACHE_DIR", os.path.expanduser("~/.ecfr/cache"))
+ECFR_CACHE_MAX_BYTES = int(os.getenv("ECFR_CACHE_MAX_BYTES") or 10 * 1024**3)
+# replay eCFR API calls from the cache only, without touching the network
+ECFR_OFFLINE = os.getenv("ECFR_OFFLINE", "False").lower() == "true"
+
+# CFRReference.full_text is stored zlib-compressed (regulations/fields.py). Preset dictionaries
+# from build_text_dictionary are listed separated by ":"; the first compresses new text, and
+# every dictionary that was ever used has to stay listed to decompress older text
+ECFR_TEXT_DICTIONARIES = [
+    path for path in os.getenv("ECFR_TEXT_DICTIONARIES", "").split(os.pathsep) if path
+]
+ECFR_TEXT_COMPRESSION_LEVEL = int(os.getenv("ECFR_TEXT_COMPRESSION_LEVEL") or 6)
+
+# Rendered API responses (regulations/response_cache.py), kept in each process unless
+# REDIS_URL points every worker and management command at one shared cache
+if os.getenv("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.getenv("REDIS_URL"),
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "OPTIONS": {"MAX_ENTRIES": 1000},
+        }
+    }
+ECFR_RESPONSE_CACHE_SECONDS = int(
+    os.getenv("ECFR_RESPONSE_CACHE_SECONDS") or 7 * 24 * 3600
+)
+# how long an in-process cache can serve responses of a generation that a command replaced
+ECFR_GENERATION_CACHE_SECONDS = int(os.getenv("ECFR_GENERATION_CACHE_SECONDS") or 5)
+
+# Full-text search (regulations/search.py): "postgres" (tsvector), "postings" (an inverted
+# index in ordinary tables) or "auto" to use tsvector on Postgres only
+ECFR_SEARCH_BACKEND = os.getenv("ECFR_SEARCH_BACKEND", "auto")
+ECFR_SEARCH_CONFIG = os.getenv("ECFR_SEARCH_CONFIG", "english")
+
 CORS_ALLOWED_ORIGINS = []
 if debug:
     CORS_ALLOWED_ORIGINS.append("http://localhost:3000")
 else:
     CORS_ALLOWED_ORIGINS.append(os.getenv("VERCEL_DOMAIN"))
+# ranged and conditional requests for /api/reference/<id>/text/
+CORS_ALLOW_HEADERS = (*default_headers, "range", "if-range", "if-none-match")
+CORS_EXPOSE_HEADERS = ["Content-Range", "Accept-Ranges", "ETag"]
@@ -0,0 +1,110 @@
+"""
+Restrictive term, sentence, section and n-gram analytics of reference text
+
+The counts are TextStatistics columns of each CFRReference, from
+extraction.text_statistics, and its most frequent n-grams are ReferenceNgram
+rows, from extraction.top_ngrams. Both are computed where the text is
+extracted (see extraction.text_analytics), so only they are sent back to the
+process that saves them. update_analytics() sums them over the distinct
+divisions referenced by each agency and its sub-agencies (see rollup.py) into
+AgencyStatistics and AgencyNgram, which /api/analytics/ serves without
+reading any reference text.
+
+Agency n-grams are summed from the top TOP_NGRAMS of each reference, so an
+n-gram's count leaves out the references where it is not among them.
+"""
+
+from django.db import transaction
+from django.db.models import Sum
+
+from .extraction import NGRAM_SIZES, TEXT_STATISTICS, TOP_NGRAMS
+from .models import AgencyNgram, AgencyStatistics, CFRReference, ReferenceNgram
+from .rollup import rollup_nodes
+from .search import index_references
+
+STATISTICS = TEXT_STATISTICS
+
+
+def index_ngrams(references):
+    """
+    Replaces the stored n-grams of each (reference, ngrams), with ngrams as
+    returned by top_ngrams, in bulk: one delete and one insert
+    """
+    references = list(references)
+    with transaction.atomic():
+        ReferenceNgram.objects.filter(
+            reference__in=[reference for reference, _ in references]
+        ).delete()
+        ReferenceNgram.objects.bulk_create(
+            (
+                ReferenceNgram(reference=reference, n=n, ngram=ngram, count=count)
+                for reference, ngrams in references
+                for n, top in ngrams.items()
+                for ngram, count in top
+            ),
+            batch_size=1000,
+        )
+
+
+def index_texts(texts):
+    """
+    Writes the search index and the n-grams of each (reference, (text,
+    ngrams)) in bulk; the on_batch of the BulkWriter that saves scraped text
+    """
+    texts = list(texts)
+    index_references((reference, text) for reference, (text, _) in texts)
+    index_ngrams((reference, ngrams) for reference, (_, ngrams) in texts)
+
+
+def rollup_statistics(nodes):
+    """{agency id: {statistic: total}} over the distinct nodes of each agency"""
+    statistics = {
+        row[0]: row[1:]
+        for row in CFRReference.objects.values_list("id", *STATISTICS).iterator()
+    }
+    totals = {}
+    for agency_id, agency_nodes in nodes.items():
+        total = dict.fromkeys(STATISTICS, 0)
+        for node in agency_nodes:
+            for statistic, value in zip(
+                STATISTICS, statistics.get(node.reference_id, ())
+            ):
+                total[statistic] += value or 0
+        totals[agency_id] = total
+    return totals
+
+
+def rollup_ngrams(nodes, limit=TOP_NGRAMS):
+    """Yields (agency id, n, n-gram, count) of the most frequent n-grams of each agency"""
+    for agency_id, agency_nodes in nodes.items():
+        reference_ids = [node.reference_id for node in agency_nodes]
+        if not reference_ids:
+            continue
+        for n in NGRAM_SIZES:
+            ngrams = (
+                ReferenceNgram.objects.filter(reference_id__in=reference_ids, n=n)
+                .values("ngram")
+                .annotate(total=Sum("count"))
+                .order_by("-total", "ngram")
+                .values_list("ngram", "total")[:limit]
+            )
+            for ngram, count in ngrams:
+                yield agency_id, n, ngram, count
+
+
+def update_analytics(batch_size=500):
+    """Replaces every AgencyStatistics and AgencyNgram with the current rollups"""
+    nodes = rollup_nodes()
+    statistics = [
+        AgencyStatistics(agency_id=agency_id, **total)
+        for agency_id, total in rollup_statistics(nodes).items()
+    ]
+    ngrams = [
+        AgencyNgram(agency_id=agency_id, n=n, ngram=ngram, count=count)
+        for agency_id, n, ngram, count in rollup_ngrams(nodes)
+    ]
+    with transaction.atomic():
+        AgencyStatistics.objects.all().delete()
+        AgencyStatistics.objects.bulk_create(statistics, batch_size=batch_size)
+        AgencyNgram.objects.all().delete()
+        AgencyNgram.objects.bulk_create(ngrams, batch_size=batch_size)
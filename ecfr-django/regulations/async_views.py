@@ -0,0 +1,92 @@
+"""
+Async versions of the agency, title and references endpoints for ASGI servers
+
+A references response can take minutes to stream for a large agency. Here it
+waits on the database and the client without holding a thread, so a few
+processes can serve many of them at once. The sync DRF viewsets in views.py
+stay the ones routed under /api/; these are under /api/async/ with the same
+parameters and output.
+"""
+
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+
+from .models import Agency, Title
+from .serializers import AgencyWordCountSerializer, TitleSerializer
+from .streaming import achain, aiter_json_object, dumps
+from .views import next_page_url, reference_listing, reference_values, text_missing
+
+
+async def values_response(queryset, fields):
+    return JsonResponse([row async for row in queryset.values(*fields)], safe=False)
+
+
+@require_GET
+async def agency_list(request):
+    # as AgencyResource
+    agencies = Agency.objects.order_by("-cfr_word_count").distinct("cfr_word_count")
+    return await values_response(agencies, AgencyWordCountSerializer.Meta.fields)
+
+
+@require_GET
+async def agency_name_list(request):
+    agencies = Agency.objects.order_by("name")
+    return await values_response(agencies, AgencyWordCountSerializer.Meta.fields)
+
+
+@require_GET
+async def title_list(request):
+    return await values_response(Title.objects.all(), TitleSerializer.Meta.fields)
+
+
+@require_GET
+async def agency_references(request, slug):
+    """AgencyResource.get_references, reading the references with the async ORM"""
+    try:
+        agency = await Agency.objects.aget(slug=slug)
+    except Agency.DoesNotExist:
+        return JsonResponse({"error": "Agency not found"}, status=404)
+    try:
+        references, fields, page_size = reference_listing(agency, request.GET)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    return StreamingHttpResponse(
+        stream_references(request, agency, references, fields, page_size),
+        content_type="application/json",
+    )
+
+
+async def stream_references(request, agency, references, fields, page_size):
+    yield f'{{"agency_word_count": {dumps(agency.cfr_word_count)}, "references": ['
+    next_url = previous = None
+    chunk_size = 20 if "full_text" in fields else 500
+    i = 0
+    async for ref in references.aiterator(chunk_size=chunk_size):
+        if i == page_size:
+            # there is another page, starting after the last reference written
+            next_url = next_page_url(request, previous)
+            break
+        if i:
+            yield ", "
+        async for chunk in aiter_reference(ref, fields):
+            yield chunk
+        previous = ref
+        i += 1
+    yield "]"
+    if page_size:
+        yield f', "next": {dumps(next_url)}'
+    yield "}"
+
+
+async def aiter_reference(ref, fields):
+    streamed = ()
+    if "full_text" in fields:
+        chunks = ref.aiter_full_text()
+        first = await anext(chunks, None)
+        if first is None:
+            streamed = [("full_text", None if text_missing(ref) else achain())]
+        else:
+            streamed = [("full_text", achain([first], chunks))]
+    async for chunk in aiter_json_object(reference_values(ref, fields), streamed):
+        yield chunk
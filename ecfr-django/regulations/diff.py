@@ -0,0 +1,208 @@
+"""
+Differences between two stored versions of the divisions of references
+
+Versions are the Section rows of titles scraped with --store-sections, each
+title as of the latest version stored on or before a date. The divisions
+within a reference are matched across the versions by tag, type, part and
+identifier (a section is a DIV8), and compared by heading and the content
+hashes of their text and tail (the text of the division above that follows).
+Only the text of divisions that differ is read and diffed word by word, so a
+diff costs reading the hashes of a span plus the text of what changed.
+"""
+
+import difflib
+from collections import defaultdict, namedtuple
+
+from django.db.models import Q
+
+from .extraction import HIERARCHY
+from .models import Section, SectionText, keyed_sections
+
+ROW_FIELDS = [
+    "ordinal",
+    "tag",
+    "type",
+    "part",
+    "identifier",
+    "heading",
+    "text_id",
+    "tail_id",
+]
+Row = namedtuple("Row", ROW_FIELDS)
+
+
+def version_on(title_id, date):
+    """The latest version date of the title stored on or before date, or None"""
+    return (
+        Section.objects.filter(title_id=title_id, version_date__lte=date)
+        .order_by("-version_date")
+        .values_list("version_date", flat=True)
+        .first()
+    )
+
+
+def division_range(sections, ref):
+    """
+    (first, last) ordinals of the lowest division specified by the reference
+    among `sections`, the rows of one version of a title, with last None for
+    the end of the title; None if the version does not have the division
+    """
+    first, last = 0, None
+    for div_tag, div_type, ref_attr in HIERARCHY[1:]:
+        value = getattr(ref, ref_attr)
+        if not value:
+            continue
+        within = sections.filter(ordinal__gte=first)
+        if last is not None:
+            within = within.filter(ordinal__lte=last)
+        first = (
+            within.filter(tag=div_tag, type=div_type, identifier=str(value).strip())
+            .order_by("ordinal")
+            .values_list("ordinal", flat=True)
+            .first()
+        )
+        if first is None:
+            return None
+        # a division ends before the next division at its level or above
+        level = int(div_tag[len("DIV") :])
+        following = (
+            within.filter(
+                ordinal__gt=first, tag__in=[f"DIV{i}" for i in range(1, level + 1)]
+            )
+            .order_by("ordinal")
+            .values_list("ordinal", flat=True)
+            .first()
+        )
+        if following is not None:
+            last = following - 1
+    return first, last
+
+
+def version_rows(title_id, version_date, refs):
+    """The Rows of the divisions within any of the references in a version of a title"""
+    sections = Section.objects.filter(title_id=title_id, version_date=version_date)
+    spans = Q()
+    for ref in refs:
+        span = division_range(sections, ref)
+        if span is None:
+            continue
+        first, last = span
+        if last is None:
+            spans |= Q(ordinal__gte=first)
+        else:
+            spans |= Q(ordinal__range=(first, last))
+    if not spans:
+        return []
+    return [
+        Row(*row)
+        for row in sections.filter(spans).order_by("ordinal").values_list(*ROW_FIELDS)
+    ]
+
+
+def word_diff(old, new):
+    """
+    The runs of words that differ between two texts, each as the position of
+    the run in the old words with the words removed and added there
+    """
+    a, b = old.split(), new.split()
+    matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    return [
+        {"at": i1, "removed": " ".join(a[i1:i2]), "added": " ".join(b[j1:j2])}
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+        if tag != "equal"
+    ]
+
+
+def row_text(row, texts):
+    tail = texts[row.tail_id].text if row.tail_id else ""
+    return f"{row.heading.strip()}\n{texts[row.text_id].text}{tail}"
+
+
+def diff_title(title_id, from_date, to_date, refs, words=True):
+    """
+    The changes to the divisions of the references (of one title) between the
+    versions of from_date and to_date. Raises Section.DoesNotExist if the
+    title has no version stored on or before either date.
+    """
+    versions = []
+    for date in (from_date, to_date):
+        version = version_on(title_id, date)
+        if version is None:
+            raise Section.DoesNotExist(
+                f"No sections of Title {title_id} are stored on or before {date}"
+            )
+        versions.append(version)
+    old = dict(keyed_sections(version_rows(title_id, versions[0], refs)))
+    new = dict(keyed_sections(version_rows(title_id, versions[1], refs)))
+
+    # (change, old row, new row), added and modified ones in the new order
+    changed = []
+    for key, row in new.items():
+        before = old.get(key)
+        if before is None:
+            changed.append(("added", None, row))
+        elif (before.text_id, before.tail_id, before.heading) != (
+            row.text_id,
+            row.tail_id,
+            row.heading,
+        ):
+            changed.append(("modified", before, row))
+    changed += [("removed", row, None) for key, row in old.items() if key not in new]
+
+    texts = SectionText.objects.in_bulk(
+        {
+            content_hash
+            for _, before, after in changed
+            for row in (before, after)
+            if row
+            for content_hash in (row.text_id, row.tail_id)
+            if content_hash
+        }
+    )
+    changes = []
+    for change, before, after in changed:
+        row = after or before
+        runs = word_diff(
+            row_text(before, texts) if before else "",
+            row_text(after, texts) if after else "",
+        )
+        result = {
+            "change": change,
+            "type": row.type,
+            "part": row.part,
+            "identifier": row.identifier,
+            "heading": row.heading.strip(),
+            "words_removed": sum(len(run["removed"].split()) for run in runs),
+            "words_added": sum(len(run["added"].split()) for run in runs),
+        }
+        if words:
+            result["diff"] = runs
+        changes.append(result)
+
+    return {
+        "title": title_id,
+        "from": versions[0],
+        "to": versions[1],
+        "unchanged": len(new)
+        - sum(1 for change, _, _ in changed if change != "removed"),
+        "changes": changes,
+    }
+
+
+def diff_references(refs, from_date, to_date, words=True):
+    """
+    diff_title of each title of the references, in title order, skipping the
+    titles without a version stored on or before either date. Returns the
+    diffs and the numbers of the titles skipped.
+    """
+    by_title = defaultdict(list)
+    for ref in refs:
+        by_title[ref.title_id].append(ref)
+    titles = []
+    unavailable = []
+    for title_id, title_refs in sorted(by_title.items()):
+        try:
+            titles.append(diff_title(title_id, from_date, to_date, title_refs, words))
+        except Section.DoesNotExist:
+            unavailable.append(title_id)
+    return titles, unavailable
@@ -0,0 +1,643 @@
+"""
+Text extraction from eCFR title XML
+
+https://github.com/usgpo/bulk-data/blob/main/ECFR-XML-User-Guide.md
+"""
+
+import re
+import sys
+import xml.etree.ElementTree as ET
+from collections import Counter, defaultdict, namedtuple
+
+# (division tag, division TYPE, CFRReference attribute), from the title down to the section
+HIERARCHY = [
+    ("DIV1", "TITLE", "title_id"),
+    ("DIV2", "SUBTITLE", "subtitle"),
+    ("DIV3", "CHAPTER", "chapter"),
+    ("DIV4", "SUBCHAP", "subchapter"),
+    ("DIV5", "PART", "part"),
+    ("DIV6", "SUBPART", "subpart"),
+    ("DIV8", "SECTION", "section"),
+]
+
+# division tag -> HIERARCHY index
+LEVELS = {div_tag: i for i, (div_tag, _, _) in enumerate(HIERARCHY)}
+
+# the parts of a CFRReference that extraction needs, cheap to send to another process
+ReferenceSpec = namedtuple("ReferenceSpec", [ref_attr for _, _, ref_attr in HIERARCHY])
+
+
+def reference_spec(ref):
+    return ReferenceSpec(*(getattr(ref, ref_attr) for _, _, ref_attr in HIERARCHY))
+
+
+# text of a reference, and the (first, last) preorder positions among the title's
+# divisions of its division and everything below it, or None if the document
+# was not a whole title; nested references have nested spans
+Extraction = namedtuple("Extraction", ["text", "span"])
+
+
+def target_index(ref):
+    """Returns the HIERARCHY index of the lowest division specified by the reference, or None"""
+    for i in reversed(range(len(HIERARCHY))):
+        if getattr(ref, HIERARCHY[i][2]):
+            return i
+    return None
+
+
+def document_level(xml_root):
+    """
+    HIERARCHY index of the highest division of a parsed document: 0 for a
+    whole title, 4 for the DIV5 returned for a ?part= request. The divisions
+    above it are not in the document, so references cannot be matched on them.
+    """
+    for elem in xml_root.iter():
+        if elem.tag.startswith("DIV"):
+            return LEVELS.get(elem.tag, 0)
+    return 0
+
+
+class DivisionIndex:
+    """
+    One-pass index of the divisions of a parsed title, so that finding the
+    division of each reference is a dictionary lookup instead of a rescan of
+    the document from the root
+    """
+
+    def __init__(self, xml_root):
+        # (TYPE, N) -> [(element, (TYPE, N) of every enclosing division)]
+        self.divisions = defaultdict(list)
+        # element -> Extraction.span, only for a whole title
+        self.spans = {}
+        self.top_level = document_level(xml_root)
+
+        self.title = next(
+            (elem for elem in xml_root.iter("DIV1") if elem.get("TYPE") == "TITLE"),
+            None,
+        )
+        self._position = 1
+        if self.title is not None:
+            self._add_children(self.title, ())
+            self.spans[self.title] = (0, self._position - 1)
+        else:
+            # e.g. the DIV5 of a ?part= request, indexed along with what is below it
+            top = next(
+                (elem for elem in xml_root.iter() if elem.tag.startswith("DIV")), None
+            )
+            if top is not None:
+                key = (top.get("TYPE"), (top.get("N") or "").strip())
+                self.divisions[key].append((top, ()))
+                self._add_children(top, (key,))
+                # positions within part of a title are not positions in the title
+                self.spans = {}
+
+    def _add_children(self, div, ancestors):
+        # divisions nest directly inside one another, so only children of divisions are visited
+        for child in div:
+            if child.tag.startswith("DIV"):
+                key = (child.get("TYPE"), (child.get("N") or "").strip())
+                self.divisions[key].append((child, ancestors))
+                start = self._position
+                self._position += 1
+                self._add_children(child, ancestors + (key,))
+                self.spans[child] = (start, self._position - 1)
+
+    def find(self, ref):
+        """Returns the element of the lowest division specified by the reference, or None"""
+        index = target_index(ref)
+        if index is None:
+            return None
+        if index == 0:
+            return self.title
+
+        # levels above the highest division of the document cannot be checked
+        path = [
+            (div_type, str(getattr(ref, ref_attr)).strip())
+            for level, (_, div_type, ref_attr) in enumerate(HIERARCHY[: index + 1])
+            if level >= max(self.top_level, 1) and getattr(ref, ref_attr)
+        ]
+        if not path:
+            return None
+        for element, ancestors in self.divisions.get(path[-1], ()):
+            if all(level in ancestors for level in path[:-1]):
+                return element
+        return None
+
+    def extract(self, ref, include_headers=True):
+        """
+        Returns the Extraction of the reference: the text of its lowest
+        division and everything below it, with the headers of the lower
+        divisions, and its span within a whole title
+        """
+        division = self.find(ref)
+        if division is None:
+            return Extraction("", None)
+        return Extraction(
+            render_division(division, target_index(ref)), self.spans.get(division)
+        )
+
+
+def extract_response(response, refs, stream=False, include_headers=True):
+    """
+    Extracts each reference from an eCFR XML response, either incrementally
+    while the body downloads or from the fully parsed document, returning an
+    Extraction per reference
+    """
+    if stream:
+        # decode gzip transfer encoding on the fly, then stop reading once done
+        response.raw.decode_content = True
+        try:
+            return stream_extract(response.raw, refs)
+        finally:
+            response.close()
+    division_index = DivisionIndex(ET.fromstring(response.content))
+    return [division_index.extract(ref, include_headers) for ref in refs]
+
+
+def render_division(division, division_index):
+    """
+    Renders the headers, authority/source notes, paragraphs and citations of a
+    division element and everything below it
+    """
+    text_parts = []
+
+    for elem in division.iter():
+        if elem is division:
+            # Add the division header
+            render_head(elem, text_parts)
+
+        elif elem.tag.startswith("DIV") and elem.get("TYPE"):
+            # Only process lower-level divisions
+            if LEVELS.get(elem.tag, -1) > division_index:
+                render_head(elem, text_parts)
+
+        render_content(elem, text_parts)
+
+    return "".join(text_parts).strip()
+
+
+def render_head(div, text_parts, head=None):
+    if head is None:
+        head = div.find("HEAD")
+    if head is not None and head.text:
+        text_parts.append(f"\n{head.text.strip()}\n")
+
+
+def render_content(elem, text_parts):
+    if elem.tag == "AUTH" or elem.tag == "SOURCE":
+        pspace = elem.find("PSPACE")
+        if pspace is not None and pspace.text:
+            label = "Authority" if elem.tag == "AUTH" else "Source"
+            text_parts.append(f"\n{label}: {pspace.text.strip()}\n")
+
+    elif elem.tag == "P":
+        text = "".join(elem.itertext()).strip()
+        if text:
+            text_parts.append(text + "\n")
+
+    elif elem.tag == "CITA":
+        if elem.get("TYPE") == "N":
+            cita_text = "".join(elem.itertext()).strip()
+            if cita_text:
+                text_parts.append(f"\n{cita_text}\n")
+
+
+def read_title(source):
+    """
+    Returns the (number, name) of the title in an XML file or file-like
+    object, reading only as far as its heading
+    """
+    number = None
+    events = ET.iterparse(source, events=("start", "end"))
+    for event, elem in events:
+        if event == "start" and elem.tag == "DIV1" and elem.get("TYPE") == "TITLE":
+            number = int(elem.get("N"))
+        elif event == "end" and elem.tag == "HEAD" and number is not None:
+            events.close()
+            # e.g. "Title 31—Money and Finance: Treasury"
+            return number, (elem.text or "").strip().split("—", 1)[-1].strip()
+    return number, None
+
+
+class _StreamTarget:
+    """Progress of one reference through a streaming pass"""
+
+    def __init__(self, ref):
+        self.index = target_index(ref)
+        self.path = []
+        if self.index is not None:
+            self.path = [
+                (div_tag, div_type, str(getattr(ref, ref_attr)).strip())
+                for div_tag, div_type, ref_attr in HIERARCHY[1 : self.index + 1]
+                if getattr(ref, ref_attr)
+            ]
+        self.element = None
+        self.text_parts = []
+        self.start = None
+        self.end = None
+        self.done = self.index is None
+
+    def extraction(self):
+        span = (self.start, self.end) if self.start is not None else None
+        return Extraction("".join(self.text_parts).strip(), span)
+
+    def skip_levels_above(self, level):
+        """Stops checking the levels of the path above `level`, see document_level"""
+        self.path = [step for step in self.path if LEVELS[step[0]] >= level]
+
+    def matches(self, elem, open_divs):
+        div_tag, div_type = HIERARCHY[self.index][:2]
+        if elem.tag != div_tag or elem.get("TYPE") != div_type:
+            return False
+        if self.path and (elem.get("N") or "").strip() != self.path[-1][2]:
+            return False
+        return all(ancestor in open_divs for ancestor in self.path[:-1])
+
+
+def stream_extract(source, refs):
+    """
+    Extracts each reference from an XML file or file-like object in a single
+    incremental pass, producing the same output as DivisionIndex.extract.
+
+    Elements are rendered and discarded as soon as they are complete, so memory
+    stays bounded by the largest paragraph or table rather than the size of the
+    title, and reading stops as soon as every matched division has closed.
+
+    Returns the Extractions in the same order as `refs`.
+    """
+    targets = [_StreamTarget(ref) for ref in refs]
+    pending = [target for target in targets if not target.done]
+
+    # open elements, and the (tag, TYPE, N) of the open divisions
+    stack = []
+    open_divs = []
+    # whether each open element is a division numbered like DivisionIndex does:
+    # the title, and divisions directly inside numbered divisions
+    numbered = []
+    position = None
+
+    events = ET.iterparse(source, events=("start", "end"))
+    for event, elem in events:
+        if not pending:
+            events.close()
+            break
+
+        if event == "start":
+            is_numbered = False
+            if elem.tag.startswith("DIV"):
+                if not open_divs:
+                    # levels above the highest division of the document cannot be checked
+                    for target in pending:
+                        target.skip_levels_above(LEVELS.get(elem.tag, 0))
+                if elem.tag == "DIV1" and elem.get("TYPE") == "TITLE":
+                    is_numbered, position = True, 0
+                elif numbered and numbered[-1]:
+                    is_numbered, position = True, position + 1
+                for target in pending:
+                    if target.element is None and target.matches(elem, open_divs):
+                        target.element = elem
+                        target.start = position if is_numbered else None
+                open_divs.append(
+                    (elem.tag, elem.get("TYPE"), (elem.get("N") or "").strip())
+                )
+            stack.append(elem)
+            numbered.append(is_numbered)
+            continue
+
+        stack.pop()
+        numbered.pop()
+        parent = stack[-1] if stack else None
+        active = [target for target in pending if target.element is not None]
+
+        if elem.tag.startswith("DIV"):
+            open_divs.pop()
+            for target in active:
+                if target.element is elem:
+                    target.end = position
+                    target.done = True
+            pending = [target for target in pending if not target.done]
+
+        elif parent is not None and parent.tag.startswith("DIV"):
+            # a complete child of a division: a header, or a block of content
+            for target in active:
+                if elem.tag == "HEAD":
+                    if parent is target.element or (
+                        parent.get("TYPE") and LEVELS.get(parent.tag, -1) > target.index
+                    ):
+                        render_head(parent, target.text_parts, head=elem)
+                else:
+                    for child in elem.iter():
+                        render_content(child, target.text_parts)
+
+        else:
+            # still needed by its parent
+            continue
+
+        elem.clear()
+        if parent is not None:
+            parent.remove(elem)
+
+    return [target.extraction() for target in targets]
+
+
+# a division of a title with the heading and rendered content that belong to it
+# and not to a lower division; `position` is the same numbering as Extraction.span,
+# `depth` the number of divisions it is nested in, and `tail` the content of the
+# division above it that follows this one and everything below it
+Division = namedtuple(
+    "Division",
+    [
+        "position",
+        "tag",
+        "type",
+        "identifier",
+        "part",
+        "heading",
+        "body",
+        "depth",
+        "tail",
+    ],
+)
+
+
+class _OpenDivision:
+    def __init__(self, position, depth, elem, part):
+        self.position = position
+        self.depth = depth
+        # read when the division starts, its element is cleared once it closes
+        self.tag = elem.tag
+        self.type = elem.get("TYPE") or ""
+        self.identifier = (elem.get("N") or "").strip()
+        self.part = part
+        self.heading = None
+        self.parts = []
+        self.tail_parts = []
+        # the last subdivision that closed, held back until its tail is complete
+        self.last_child = None
+
+    def division(self):
+        return Division(
+            self.position,
+            self.tag,
+            self.type,
+            self.identifier,
+            self.part,
+            self.heading or "",
+            "".join(self.parts),
+            self.depth,
+            "".join(self.tail_parts),
+        )
+
+
+def stream_divisions(source):
+    """
+    Yields a Division for every division of a title XML file or file-like
+    object in a single incremental pass, each as soon as its tail is complete.
+
+    Joining the divisions within a span in position order (see
+    join_divisions) reproduces the text extracted for that span.
+    """
+    # open elements, whether each is a numbered division (see stream_extract),
+    # and the numbered divisions being collected
+    stack = []
+    numbered = []
+    open_divisions = []
+    position = None
+
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            is_numbered = False
+            if elem.tag.startswith("DIV"):
+                if elem.tag == "DIV1" and elem.get("TYPE") == "TITLE":
+                    is_numbered, position = True, 0
+                elif numbered and numbered[-1]:
+                    is_numbered, position = True, position + 1
+            if is_numbered:
+                part = ""
+                if open_divisions:
+                    parent_division = open_divisions[-1]
+                    part = parent_division.part
+                    # nothing more can follow the previous subdivision
+                    if parent_division.last_child is not None:
+                        yield parent_division.last_child.division()
+                        parent_division.last_child = None
+                if elem.get("TYPE") == "PART":
+                    part = (elem.get("N") or "").strip()
+                open_divisions.append(
+                    _OpenDivision(position, len(open_divisions), elem, part)
+                )
+            stack.append(elem)
+            numbered.append(is_numbered)
+            continue
+
+        stack.pop()
+        parent = stack[-1] if stack else None
+        closed = []
+
+        if numbered.pop():
+            current = open_divisions.pop()
+            if current.last_child is not None:
+                closed.append(current.last_child.division())
+            if open_divisions:
+                open_divisions[-1].last_child = current
+            else:
+                closed.append(current.division())
+        elif numbered and numbered[-1]:
+            # a complete child of a division: its header, or a block of content
+            current = open_divisions[-1]
+            if elem.tag == "HEAD":
+                if current.heading is None:
+                    current.heading = elem.text or ""
+            else:
+                # content after a subdivision is the tail of that subdivision
+                parts = current.parts
+                if current.last_child is not None:
+                    parts = current.last_child.tail_parts
+                for child in elem.iter():
+                    render_content(child, parts)
+        else:
+            # still needed by its parent
+            continue
+
+        elem.clear()
+        if parent is not None:
+            parent.remove(elem)
+        yield from closed
+
+
+def join_divisions(divisions, index):
+    """
+    Joins the headings, bodies and tails of the divisions of a span, given in
+    position order, for a reference at HIERARCHY index `index`
+    """
+    return "".join(iter_join_divisions(divisions, index))
+
+
+def iter_join_divisions(divisions, index):
+    """Same as join_divisions, yielding the text a division at a time"""
+    joiner = DivisionJoiner(index)
+    for division in divisions:
+        text = joiner.add(division)
+        if text:
+            yield text
+    text = joiner.finish()
+    if text:
+        yield text
+
+
+class DivisionJoiner:
+    """
+    join_divisions one division at a time, for callers that cannot hand over
+    an iterator (async iteration over the database)
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.count = 0
+        self.started = False
+        self.whitespace = ""
+        # (depth, tail) of the divisions added whose tail is still to come, innermost last
+        self.tails = []
+
+    def add(self, division):
+        """Returns the text that division adds to the joined text so far"""
+        _, tag, div_type, _, _, heading, body, depth, tail = division
+        # a division at the same depth or above follows everything below the
+        # divisions held back at its depth, so their tails come first
+        text = ""
+        while self.tails and self.tails[-1][0] >= depth:
+            text += self.tails.pop()[1]
+        # the first division is the referenced one, below it only lower levels have headers
+        if heading and (
+            self.count == 0 or (div_type and LEVELS.get(tag, -1) > self.index)
+        ):
+            text += f"\n{heading.strip()}\n"
+        text += body
+        # the tail of the referenced division belongs to the division above it
+        if self.count and tail:
+            self.tails.append((depth, tail))
+        self.count += 1
+        return self._join(text)
+
+    def finish(self):
+        """Returns the text of the tails still to come once every division is added"""
+        text = "".join(tail for _, tail in reversed(self.tails))
+        self.tails = []
+        return self._join(text)
+
+    def _join(self, text):
+        # strip the whole text, not each piece: hold back whitespace until more text follows
+        if not self.started:
+            text = text.lstrip()
+            self.started = bool(text)
+        stripped = text.rstrip()
+        if stripped:
+            joined = self.whitespace + stripped
+            self.whitespace = text[len(stripped) :]
+            return joined
+        self.whitespace += text
+        return ""
+
+
+# restrictive terms counted by text_statistics, as (statistic, pattern)
+RESTRICTIONS = [
+    ("shall_count", r"shall"),
+    ("must_count", r"must"),
+    ("may_not_count", r"may\s+not"),
+    ("required_count", r"required"),
+    ("prohibited_count", r"prohibited"),
+]
+# every token text_statistics counts in one alternation, so the text is scanned
+# once for all of them; the name of the matching group is the statistic
+COUNTED_TOKENS = re.compile(
+    "|".join(
+        rf"(?P<{statistic}>(?i:\b{pattern}\b))" for statistic, pattern in RESTRICTIONS
+    )
+    # section headings, e.g. "§ 1.1 Definitions."
+    + r"|(?P<section_count>^§)"
+    # a sentence ends before a capital, a paragraph label or the end of a line
+    + r"|(?P<sentence_count>[.!?](?=[\"')\]]*(?:[ \t]+[A-Z(§\"]|[ \t]*$)))",
+    re.MULTILINE,
+)
+
+
+def text_statistics(text):
+    """Cheap statistics of extracted text, stored next to it so nothing has to re-read it"""
+    counts = Counter(match.lastgroup for match in COUNTED_TOKENS.finditer(text))
+    restrictions = {statistic: counts[statistic] for statistic, _ in RESTRICTIONS}
+    return {
+        "word_count": len(text.split()),
+        "character_count": len(text),
+        # the length of the text served, which byte ranges are counted in
+        "byte_count": len(text.encode()),
+        "paragraph_count": sum(1 for line in text.splitlines() if line.strip()),
+        "sentence_count": counts["sentence_count"],
+        "section_count": counts["section_count"],
+        "restriction_count": sum(restrictions.values()),
+        **restrictions,
+    }
+
+
+# the names of the statistics text_statistics returns
+TEXT_STATISTICS = list(text_statistics(""))
+
+
+# words left out of search terms and n-grams
+STOP_WORDS = frozenset(
+    {
+        *("a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "is"),
+        *(
+            "it",
+            "of",
+            "on",
+            "or",
+            "that",
+            "the",
+            "this",
+            "to",
+            "was",
+            "were",
+            "which",
+            "with",
+        ),
+    }
+)
+
+# lengths of the n-grams counted, and how many of each length are kept
+NGRAM_SIZES = (1, 2, 3)
+TOP_NGRAMS = 50
+NGRAM_WORD = re.compile(r"[a-z]+(?:'[a-z]+)?", re.ASCII | re.IGNORECASE)
+
+
+def top_ngrams(text, limit=TOP_NGRAMS):
+    """
+    {n: [(n-gram, count)]} of the most frequent n-grams of text, most frequent
+    first. Words are matched one at a time and n-grams counted as tuples of the
+    same interned words, so no lowercased copy or word list of the text is built.
+    """
+    counts = {n: Counter() for n in NGRAM_SIZES}
+    keep = 1 - max(NGRAM_SIZES)
+    window = ()
+    for match in NGRAM_WORD.finditer(text):
+        word = match.group().lower()
+        # leaves out stop words and labels like (a)
+        if len(word) < 2 or word in STOP_WORDS:
+            continue
+        window = window[keep:] + (sys.intern(word),)
+        for n, counter in counts.items():
+            if len(window) >= n:
+                counter[window[-n:]] += 1
+    return {
+        n: [(" ".join(ngram), count) for ngram, count in counter.most_common(limit)]
+        for n, counter in counts.items()
+    }
+
+
+# what is stored about the text of a reference besides the text itself, small
+# enough to send back from a worker process
+TextAnalytics = namedtuple("TextAnalytics", ["statistics", "ngrams"])
+
+
+def text_analytics(text):
+    """text_statistics and top_ngrams of extracted text"""
+    return TextAnalytics(text_statistics(text), top_ngrams(text))
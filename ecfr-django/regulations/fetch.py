@@ -0,0 +1,172 @@
+"""
+Shared HTTP plumbing for talking to the eCFR API
+"""
+
+import logging
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import FIRST_COMPLETED, wait
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .http_cache import OfflineCacheMiss, ResponseCache
+
+BASE_URL = "https://www.ecfr.gov/api"
+
+# responses worth retrying: rate limiting and transient server errors
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# the errors a fetch-and-extract job is expected to fail with: downloads,
+# reading files and parsing XML; map_bounded logs the traceback of any other
+JOB_ERRORS = (requests.RequestException, OSError, ET.ParseError)
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """
+    Spaces out requests so that at most `rate` of them start per second for any one host
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._next_slot = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next_slot.get(host, now), now)
+            self._next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class ECFRSession(requests.Session):
+    """
+    requests.Session with a connection pool sized for `pool_size` concurrent
+    requests, an optional per-host rate limit (requests per second), `retries`
+    retries of transient errors with exponential backoff and jitter, and an
+    optional on-disk ResponseCache.
+
+    With a cache, GET requests are revalidated with ETag/If-Modified-Since and a
+    304 is answered from disk, while a 200 body is cached as the caller reads
+    it; in offline mode the network is never used and uncached urls raise
+    OfflineCacheMiss.
+    """
+
+    def __init__(
+        self, pool_size=10, rate_limit=None, retries=0, cache=None, offline=False
+    ):
+        super().__init__()
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=Retry(
+                total=retries,
+                backoff_factor=1,
+                backoff_jitter=1,
+                status_forcelist=RETRY_STATUSES,
+                respect_retry_after_header=True,
+            )
+            if retries
+            else 0,
+        )
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+        self.rate_limiter = RateLimiter(rate_limit) if rate_limit else None
+        self.cache = cache
+        self.offline = offline
+
+    def request(self, method, url, *args, **kwargs):
+        if self.cache is None or method.upper() != "GET":
+            if self.rate_limiter:
+                self.rate_limiter.wait(url)
+            return super().request(method, url, *args, **kwargs)
+
+        url = (
+            requests.Request(method, url, params=kwargs.pop("params", None))
+            .prepare()
+            .url
+        )
+        entry = self.cache.lookup(url)
+        if self.offline:
+            if entry is None:
+                raise OfflineCacheMiss(f"{url} is not cached (offline mode)")
+            return self.cache.response(url, entry)
+
+        if entry:
+            kwargs["headers"] = {
+                **(kwargs.get("headers") or {}),
+                **self.cache.conditional_headers(entry),
+            }
+        kwargs["stream"] = True
+
+        if self.rate_limiter:
+            self.rate_limiter.wait(url)
+        response = super().request(method, url, *args, **kwargs)
+
+        if response.status_code == 304 and entry:
+            response.close()
+            return self.cache.response(url, entry)
+        if response.status_code == 200:
+            return self.cache.tee(url, response)
+        return response
+
+
+def get_session(pool_size=10, rate_limit=None, retries=0):
+    """Returns an ECFRSession using the response cache configured in settings"""
+    cache = None
+    if settings.ECFR_CACHE_DIR:
+        cache = ResponseCache(settings.ECFR_CACHE_DIR, settings.ECFR_CACHE_MAX_BYTES)
+    return ECFRSession(
+        pool_size=pool_size,
+        rate_limit=rate_limit,
+        retries=retries,
+        cache=cache,
+        offline=settings.ECFR_OFFLINE,
+    )
+
+
+def map_bounded(executor, fn, jobs, window):
+    """
+    Runs fn(*args) on the executor for each (key, args) job and yields
+    (key, result, error) in the order the calls finish, where error is the
+    exception the call raised, so one failed job does not end the run.
+    Errors other than JOB_ERRORS are unexpected and logged with their traceback.
+
+    At most `window` calls are in flight or waiting to be consumed, so a slow
+    consumer (DB writes) throttles the producers instead of the whole result
+    set piling up in memory.
+    """
+    jobs = iter(jobs)
+    pending = {}
+
+    def submit_next():
+        job = next(jobs, None)
+        if job is not None:
+            key, args = job
+            pending[executor.submit(fn, *args)] = key
+
+    for _ in range(window):
+        submit_next()
+
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            key = pending.pop(future)
+            submit_next()
+            try:
+                result = future.result()
+            except Exception as e:
+                if not isinstance(e, JOB_ERRORS):
+                    logger.error("Unexpected error in job %s", key, exc_info=e)
+                yield key, None, e
+                continue
+            yield key, result, None
@@ -0,0 +1,150 @@
+"""
+Model field for large texts stored zlib-compressed
+"""
+
+import codecs
+import zlib
+from functools import cache
+
+from django.conf import settings
+from django.db import models
+from django.db.models.query_utils import DeferredAttribute
+
+CHUNK_SIZE = 64 * 1024
+
+
+@cache
+def dictionaries():
+    """Returns {Adler-32: dictionary} of the preset dictionaries in ECFR_TEXT_DICTIONARIES"""
+    loaded = {}
+    for path in settings.ECFR_TEXT_DICTIONARIES:
+        with open(path, "rb") as f:
+            zdict = f.read()
+        loaded[zlib.adler32(zdict)] = zdict
+    return loaded
+
+
+def compress(text):
+    """Compresses text with the first of ECFR_TEXT_DICTIONARIES, if any"""
+    level = settings.ECFR_TEXT_COMPRESSION_LEVEL
+    if settings.ECFR_TEXT_DICTIONARIES:
+        zdict = next(iter(dictionaries().values()))
+        compressor = zlib.compressobj(level, zdict=zdict)
+    else:
+        compressor = zlib.compressobj(level)
+    return compressor.compress(text.encode()) + compressor.flush()
+
+
+def _decompressor(data):
+    # a stream compressed with a preset dictionary names it by Adler-32 in its header
+    if len(data) >= 6 and data[1] & 0x20:
+        dict_id = int.from_bytes(data[2:6], "big")
+        zdict = dictionaries().get(dict_id)
+        if zdict is None:
+            raise ValueError(
+                f"Text was compressed with dictionary {dict_id:08x}, which is not in ECFR_TEXT_DICTIONARIES"
+            )
+        return zlib.decompressobj(zdict=zdict)
+    return zlib.decompressobj()
+
+
+def decompress(data):
+    decompressor = _decompressor(data)
+    return (decompressor.decompress(data) + decompressor.flush()).decode()
+
+
+def iter_decompressed(data, chunk_size=CHUNK_SIZE):
+    """
+    Yields the text of compressed data in pieces of about `chunk_size`
+    characters, without ever decompressing all of it at once
+    """
+    decompressor = _decompressor(data)
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = data
+    while not decompressor.eof:
+        chunk = decompressor.decompress(pending, chunk_size)
+        pending = decompressor.unconsumed_tail
+        if not chunk and not pending:
+            break
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    text = decoder.decode(decompressor.flush(), final=True)
+    if text:
+        yield text
+
+
+class CompressedTextDescriptor(DeferredAttribute):
+    """Loads the field like any deferred field, then decompresses it the first time it is read"""
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        value = super().__get__(instance, cls)
+        if isinstance(value, bytes):
+            value = decompress(value)
+            instance.__dict__[self.field.attname] = value
+        return value
+
+    def __set__(self, instance, value):
+        # a data descriptor, so that reads go through __get__ once the value is loaded
+        instance.__dict__[self.field.attname] = value
+
+
+class CompressedTextField(models.BinaryField):
+    """
+    Text stored zlib-compressed, optionally with a preset dictionary shared by
+    every value (ECFR_TEXT_DICTIONARIES).
+
+    Instances hold the compressed bytes until the attribute is first read, and
+    iter_text() streams the text without building the whole string. Assign a
+    str to store new text; values()/values_list() return the compressed bytes.
+    """
+
+    descriptor_class = CompressedTextDescriptor
+
+    def from_db_value(self, value, expression, connection):
+        return None if value is None else bytes(value)
+
+    def to_python(self, value):
+        return value
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if isinstance(value, str):
+            value = compress(value)
+        return super().get_db_prep_value(value, connection, prepared)
+
+    def value_to_string(self, obj):
+        """The text, for serializers (dumpdata); loading it compresses it again"""
+        value = self.value_from_object(obj)
+        return decompress(value) if isinstance(value, bytes) else value
+
+    def iter_text(self, instance, chunk_size=CHUNK_SIZE):
+        """Yields the text of the field on `instance` in chunks, loading it compressed if deferred"""
+        if self.attname not in instance.__dict__:
+            instance.__dict__[self.attname] = (
+                type(instance)
+                ._base_manager.filter(pk=instance.pk)
+                .values_list(self.attname, flat=True)
+                .get()
+            )
+        value = instance.__dict__[self.attname]
+        if value is None:
+            return
+        if isinstance(value, str):
+            for i in range(0, len(value), chunk_size):
+                yield value[i : i + chunk_size]
+        else:
+            yield from iter_decompressed(value, chunk_size)
+
+    async def aiter_text(self, instance, chunk_size=CHUNK_SIZE):
+        """iter_text for async code, loading a deferred value with the async ORM"""
+        if self.attname not in instance.__dict__:
+            instance.__dict__[self.attname] = await (
+                type(instance)
+                ._base_manager.filter(pk=instance.pk)
+                .values_list(self.attname, flat=True)
+                .aget()
+            )
+        for chunk in self.iter_text(instance, chunk_size):
+            yield chunk
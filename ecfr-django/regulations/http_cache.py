@@ -0,0 +1,233 @@
+"""
+Persistent on-disk cache of eCFR API responses
+
+Layout under the cache directory:
+    entries/<sha256 of url>.json  url, validators and content type of a cached response
+    objects/<sha256 of body>.gz   gzip-compressed body, shared by every url that returned it
+
+Versioned endpoints carry their date in the url (/full/{date}/title-N.xml), so
+each version date gets its own entry, while identical bodies (e.g. the whole
+title returned for every ?chapter= query) are only stored once.
+
+A downloaded body is written to the cache as the caller reads it, and stored
+once it has been read to the end, so a caller that stops early (a streaming
+parser that found everything it needed) is not held up by the cache.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+# bodies and entries being written are .tmp files until they are stored; ones
+# this old were left behind by a process that died while writing them
+STALE_TMP_SECONDS = 60 * 60
+
+
+class OfflineCacheMiss(requests.ConnectionError):
+    """Raised in offline mode for a url that has not been cached"""
+
+
+class ResponseCache:
+    def __init__(self, root, max_bytes=None):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.entries = self.root / "entries"
+        self.objects = self.root / "objects"
+        self.entries.mkdir(parents=True, exist_ok=True)
+        self.objects.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._size = sum(
+            entry.stat().st_size
+            for entry in os.scandir(self.objects)
+            if entry.name.endswith(".gz")
+        )
+        self.evict()
+
+    def _entry_path(self, url):
+        return self.entries / f"{hashlib.sha256(url.encode()).hexdigest()}.json"
+
+    def _object_path(self, digest):
+        return self.objects / f"{digest}.gz"
+
+    def lookup(self, url):
+        """Returns the metadata stored for the url, or None if it is missing or evicted"""
+        try:
+            entry = json.loads(self._entry_path(url).read_text())
+        except (OSError, ValueError):
+            return None
+        if not self._object_path(entry["digest"]).exists():
+            return None
+        return entry
+
+    def conditional_headers(self, entry):
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def tee(self, url, response):
+        """
+        Returns a 200 response whose body is written into the cache while the
+        caller reads it, see CachingReader
+        """
+        response.raw = CachingReader(self, url, response)
+        return response
+
+    def commit(self, url, tmp_path, digest, headers):
+        """
+        Moves a gzip-compressed body written to tmp_path into the cache and
+        stores the url's entry for it, returning the entry
+        """
+        object_path = self._object_path(digest)
+        try:
+            size = os.path.getsize(tmp_path)
+            with self._lock:
+                if object_path.exists():
+                    os.unlink(tmp_path)
+                else:
+                    os.replace(tmp_path, object_path)
+                    self._size += size
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+        entry = {
+            "url": url,
+            "digest": digest,
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "content_type": headers.get("Content-Type"),
+        }
+        self._write_entry(url, entry)
+        self.evict(keep=digest)
+        return entry
+
+    def _write_entry(self, url, entry):
+        fd, tmp_path = tempfile.mkstemp(dir=self.entries, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, self._entry_path(url))
+
+    def touch(self, entry):
+        # access time drives eviction, independent of the filesystem's atime setting
+        os.utime(self._object_path(entry["digest"]))
+
+    def response(self, url, entry):
+        """Builds a requests.Response that reads the cached body from disk"""
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response.reason = "OK"
+        response.headers = CaseInsensitiveDict(
+            {"Content-Type": entry["content_type"]} if entry["content_type"] else {}
+        )
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        # closed with the response
+        response.raw = gzip.open(self._object_path(entry["digest"]), "rb")  # noqa: SIM115
+        response.from_cache = True
+        self.touch(entry)
+        return response
+
+    def evict(self, keep=None):
+        """
+        Removes stale .tmp files, then least recently used bodies until the
+        cache fits in max_bytes, except for the `keep` digest that is about to
+        be served
+        """
+        stale = time.time() - STALE_TMP_SECONDS
+        for directory in (self.objects, self.entries):
+            for entry in os.scandir(directory):
+                if entry.name.endswith(".tmp") and entry.stat().st_mtime < stale:
+                    try:
+                        os.unlink(entry.path)
+                    except FileNotFoundError:
+                        pass
+        if not self.max_bytes or self._size <= self.max_bytes:
+            return
+        with self._lock:
+            objects = sorted(
+                (
+                    entry
+                    for entry in os.scandir(self.objects)
+                    if entry.name.endswith(".gz")
+                ),
+                key=lambda entry: entry.stat().st_mtime,
+            )
+            for entry in objects:
+                if self._size <= self.max_bytes:
+                    break
+                if entry.name == f"{keep}.gz":
+                    continue
+                size = entry.stat().st_size
+                os.unlink(entry.path)
+                self._size -= size
+            # entries whose body was evicted are treated as misses by lookup()
+
+
+class CachingReader:
+    """
+    The raw body of a response, decoded, that is written to a ResponseCache as
+    it is read. It is committed to the cache when read to the end, and
+    discarded if the response is closed before that or reading it fails.
+    """
+
+    def __init__(self, cache, url, response):
+        self.cache = cache
+        self.url = url
+        self.headers = response.headers
+        self.raw = response.raw
+        # content encodings are always decoded, as the cache stores decoded bodies
+        self.decode_content = True
+        self.digest = hashlib.sha256()
+        fd, self.tmp_path = tempfile.mkstemp(dir=cache.objects, suffix=".tmp")
+        self._tmp_file = os.fdopen(fd, "wb")
+        self._gzip = gzip.GzipFile(fileobj=self._tmp_file, mode="wb")
+
+    def read(self, amt=None, decode_content=True):
+        try:
+            chunk = self.raw.read(amt, decode_content=True)
+        except BaseException:
+            self.close()
+            raise
+        if self._gzip is not None:
+            if chunk:
+                self.digest.update(chunk)
+                self._gzip.write(chunk)
+            elif amt != 0:
+                self._finish(commit=True)
+        return chunk
+
+    def _finish(self, commit):
+        if self._gzip is None:
+            return
+        self._gzip.close()
+        self._tmp_file.close()
+        self._gzip = None
+        if commit:
+            self.cache.commit(
+                self.url, self.tmp_path, self.digest.hexdigest(), self.headers
+            )
+        else:
+            os.unlink(self.tmp_path)
+
+    def close(self):
+        self._finish(commit=False)
+        self.raw.close()
+
+    def release_conn(self):
+        self.raw.release_conn()
+
+    @property
+    def closed(self):
+        return self.raw.closed
@@ -0,0 +1,315 @@
+import bisect
+import xml.etree.ElementTree as ET
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import requests
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils.dateparse import parse_date
+
+# ecfr
+from regulations.extraction import text_statistics
+from regulations.fetch import BASE_URL, get_session, map_bounded
+from regulations.models import (
+    AgencySnapshot,
+    CFRReference,
+    ReferenceSnapshot,
+    Title,
+    TitleSnapshot,
+)
+from regulations.response_cache import bump_generation
+from regulations.rollup import rollup_word_counts, snapshot_values
+from regulations.workers import fetch_and_extract
+
+# the versioner has no history before this date
+FIRST_DATE = date(2017, 1, 3)
+
+
+class Command(BaseCommand):
+    help = "Computes word count snapshots of references and agencies for past versioner dates"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--start",
+            type=str,
+            help="First date in YYYY-MM-DD format (default: 2017-01-03, the start of the versioner history)",
+        )
+        parser.add_argument(
+            "--end",
+            type=str,
+            help="Last date in YYYY-MM-DD format (default: the latest date every title is up to date as of)",
+        )
+        parser.add_argument(
+            "--every",
+            choices=["year", "month", "amendment"],
+            default="month",
+            help="Take a snapshot on the first day of every year or month, or on every date any title was amended",
+        )
+        parser.add_argument(
+            "--title", type=int, help="Specific title number to process"
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Download and extract every date again, including dates that already have snapshots",
+            default=False,
+        )
+        parser.add_argument(
+            "--stream",
+            action="store_true",
+            help="Parse responses incrementally as they download instead of building the whole tree",
+            default=False,
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=1,
+            help="Number of XML downloads to run in parallel over a shared connection pool",
+        )
+        parser.add_argument(
+            "--retries",
+            type=int,
+            default=5,
+            help="Retries of transient HTTP errors, with exponential backoff and jitter",
+        )
+        parser.add_argument(
+            "--rate-limit",
+            type=float,
+            default=None,
+            help="Maximum number of requests started per second against the eCFR host",
+        )
+
+    def get_amendment_dates(self, number):
+        """Returns the sorted dates on which the title was amended"""
+        response = self.session.get(
+            f"{BASE_URL}/versioner/v1/versions/title-{number}.json"
+        )
+        response.raise_for_status()
+        return sorted(
+            {
+                parse_date(version["amendment_date"])
+                for version in response.json()["content_versions"]
+                if version.get("amendment_date")
+            }
+        )
+
+    def snapshot_dates(self, start, end, every, amendments):
+        if every == "amendment":
+            return sorted(
+                {
+                    day
+                    for days in amendments.values()
+                    for day in days
+                    if start <= day <= end
+                }
+            )
+        dates = []
+        day = start
+        while day <= end:
+            dates.append(day)
+            if every == "year":
+                day = date(day.year + 1, 1, 1)
+            else:
+                day = (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+        return dates
+
+    def handle(self, *args, **options):
+        self.session = get_session(
+            pool_size=options["concurrency"],
+            rate_limit=options["rate_limit"],
+            retries=options["retries"],
+        )
+
+        references = CFRReference.objects.select_related("title").order_by(
+            "title__number", "chapter", "section"
+        )
+        if options["title"]:
+            references = references.filter(title__number=options["title"])
+        refs_by_title = defaultdict(list)
+        for ref in references:
+            refs_by_title[ref.title.number].append(ref)
+        titles = Title.objects.in_bulk(list(refs_by_title))
+
+        amendments = {}
+        for number in refs_by_title:
+            try:
+                amendments[number] = self.get_amendment_dates(number)
+            except (requests.RequestException, KeyError, ValueError) as e:
+                self.stdout.write(
+                    self.style.ERROR(
+                        f"Error fetching versions of Title {number}: {str(e)}"
+                    )
+                )
+
+        start = parse_date(options["start"] or "") or FIRST_DATE
+        end = parse_date(options["end"] or "") or max(
+            (
+                title.up_to_date_as_of
+                for title in titles.values()
+                if title.up_to_date_as_of
+            ),
+            default=date.today(),
+        )
+        dates = self.snapshot_dates(start, end, options["every"], amendments)
+        if not dates:
+            self.stdout.write(self.style.ERROR("No dates to snapshot"))
+            return
+
+        fetches, copies = self.plan(dates, amendments, titles, options["force"])
+        self.stdout.write(
+            f"{len(dates)} dates: {len(fetches)} title versions to extract, "
+            f"{len(copies)} unchanged since the previous snapshot"
+        )
+
+        changed_dates = set()
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as executor:
+            jobs = (
+                (
+                    (number, day, amended_on),
+                    (
+                        f"{BASE_URL}/versioner/v1/full/{day}/title-{number}.xml",
+                        refs_by_title[number],
+                        options["stream"],
+                        True,
+                        self.session,
+                    ),
+                )
+                for number, day, amended_on in fetches
+            )
+            window = options["concurrency"] * 2
+            for (number, day, amended_on), result, error in map_bounded(
+                executor, fetch_and_extract, jobs, window
+            ):
+                if error:
+                    if isinstance(error, requests.RequestException):
+                        message = "Error fetching"
+                    elif isinstance(error, ET.ParseError):
+                        message = "Error parsing XML for"
+                    else:
+                        message = "Unexpected error processing"
+                    self.stdout.write(
+                        self.style.ERROR(
+                            f"{message} Title {number} on {day}: {str(error)}"
+                        )
+                    )
+                    continue
+                self.save_extracted(
+                    number, day, amended_on, refs_by_title[number], result
+                )
+                changed_dates.add(day)
+                self.stdout.write(f"Extracted Title {number} on {day}")
+
+        # in date order, so that each copies a snapshot that already exists
+        for number, day, previous, amended_on in copies:
+            if self.copy_previous(number, day, previous, amended_on):
+                changed_dates.add(day)
+
+        for day in sorted(changed_dates):
+            self.snapshot_agencies(day)
+        if changed_dates:
+            bump_generation()
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Saved agency snapshots for {len(changed_dates)} dates")
+        )
+
+    def plan(self, dates, amendments, titles, force):
+        """
+        Decides for every (title, date) whether the title has to be downloaded,
+        or whether it was not amended since the previous snapshot and that
+        snapshot can be copied. Returns (fetches, copies).
+        """
+        existing = defaultdict(dict)
+        for snapshot in TitleSnapshot.objects.filter(title_id__in=list(amendments)):
+            existing[snapshot.title_id][snapshot.date] = snapshot.amended_on
+
+        fetches = []
+        copies = []
+        for number, amendment_dates in amendments.items():
+            up_to_date_as_of = titles[number].up_to_date_as_of
+            stored = existing[number]
+            stored_dates = sorted(stored)
+            # (date, amended_on) of the latest snapshot so far, stored or planned
+            previous = None
+            for day in dates:
+                if up_to_date_as_of and day > up_to_date_as_of:
+                    break
+                i = bisect.bisect_right(amendment_dates, day)
+                if i == 0:
+                    # the title has no version yet
+                    continue
+                amended_on = amendment_dates[i - 1]
+
+                j = bisect.bisect_left(stored_dates, day)
+                if j and (previous is None or stored_dates[j - 1] > previous[0]):
+                    previous = (stored_dates[j - 1], stored[stored_dates[j - 1]])
+                if day in stored and not force:
+                    previous = (day, stored[day])
+                    continue
+
+                if previous and previous[1] == amended_on and not force:
+                    copies.append((number, day, previous[0], amended_on))
+                else:
+                    fetches.append((number, day, amended_on))
+                previous = (day, amended_on)
+        copies.sort(key=lambda copy: copy[1])
+        return fetches, copies
+
+    def save_extracted(self, number, day, amended_on, refs, result):
+        snapshots = [
+            ReferenceSnapshot(
+                reference=ref,
+                date=day,
+                word_count=text_statistics(text)["word_count"],
+                node_start=span[0] if span else None,
+                node_end=span[1] if span else None,
+            )
+            for ref, (text, span) in zip(refs, result.extractions)
+            if text
+        ]
+        with transaction.atomic():
+            self.replace_snapshots(number, day, amended_on, snapshots)
+
+    def copy_previous(self, number, day, previous, amended_on):
+        """Copies the reference snapshots of the title from the previous date, if it has them"""
+        previous_snapshots = ReferenceSnapshot.objects.filter(
+            reference__title_id=number, date=previous
+        )
+        snapshots = [
+            ReferenceSnapshot(
+                reference_id=snapshot.reference_id,
+                date=day,
+                word_count=snapshot.word_count,
+                node_start=snapshot.node_start,
+                node_end=snapshot.node_end,
+            )
+            for snapshot in previous_snapshots
+        ]
+        if not snapshots:
+            return False
+        with transaction.atomic():
+            self.replace_snapshots(number, day, amended_on, snapshots)
+        return True
+
+    def replace_snapshots(self, number, day, amended_on, snapshots):
+        ReferenceSnapshot.objects.filter(reference__title_id=number, date=day).delete()
+        ReferenceSnapshot.objects.bulk_create(snapshots, batch_size=500)
+        TitleSnapshot.objects.update_or_create(
+            title_id=number, date=day, defaults={"amended_on": amended_on}
+        )
+
+    def snapshot_agencies(self, day):
+        totals = rollup_word_counts(
+            snapshot_values(ReferenceSnapshot.objects.filter(date=day))
+        )
+        with transaction.atomic():
+            AgencySnapshot.objects.filter(date=day).delete()
+            AgencySnapshot.objects.bulk_create(
+                (
+                    AgencySnapshot(agency_id=agency_id, date=day, word_count=words)
+                    for agency_id, words in totals.items()
+                ),
+                batch_size=500,
+            )
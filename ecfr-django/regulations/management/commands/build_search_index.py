@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+
+# ecfr
+from regulations.models import CFRReference, SearchChunk
+from regulations.response_cache import bump_generation
+from regulations.search import index_reference, use_postgres
+
+
+class Command(BaseCommand):
+    help = "Indexes reference text for search; scrape_cfr_text keeps the index up to date afterwards"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--title", type=int, help="Specific title number to process"
+        )
+        parser.add_argument(
+            "--missing",
+            action="store_true",
+            help="Only index references that have no indexed chunks yet",
+            default=False,
+        )
+
+    def handle(self, *args, **options):
+        references = CFRReference.objects.filter(content_hash__isnull=False).order_by(
+            "id"
+        )
+        if options["title"]:
+            references = references.filter(title__number=options["title"])
+        if options["missing"]:
+            indexed = SearchChunk.objects.values("reference_id")
+            references = references.exclude(id__in=indexed)
+
+        backend = "tsvector" if use_postgres() else "inverted index"
+        count = 0
+        chunks = 0
+        for ref in references.iterator(chunk_size=20):
+            chunks += index_reference(ref, "".join(ref.iter_full_text()))
+            count += 1
+            if count % 100 == 0:
+                self.stdout.write(f"Indexed {count} references")
+        bump_generation()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Indexed {count} references in {chunks} chunks ({backend})"
+            )
+        )
@@ -0,0 +1,57 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+
+# ecfr
+from regulations.models import CFRReference
+
+# zlib only looks back 32 KiB, so a longer dictionary is never used
+MAX_SIZE = 32 * 1024
+
+
+class Command(BaseCommand):
+    help = "Builds a preset compression dictionary for CFR reference text from the lines most references share"
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="File to write the dictionary to")
+        parser.add_argument(
+            "--sample",
+            type=int,
+            default=200,
+            help="Number of references to sample",
+        )
+        parser.add_argument(
+            "--sample-chars",
+            type=int,
+            default=200_000,
+            help="Characters read from the start of each sampled reference",
+        )
+
+    def handle(self, *args, **options):
+        references = CFRReference.objects.filter(word_count__isnull=False).order_by("?")
+        counts = Counter()
+        sampled = 0
+        for ref in references[: options["sample"]]:
+            text_parts = []
+            size = 0
+            for chunk in ref.iter_full_text():
+                text_parts.append(chunk)
+                size += len(chunk)
+                if size >= options["sample_chars"]:
+                    break
+            text = "".join(text_parts)
+            counts.update({line.strip() for line in text.splitlines() if line.strip()})
+            sampled += 1
+
+        # most common last: zlib finds the closest match first and encodes it cheapest
+        lines = [line for line, count in reversed(counts.most_common()) if count > 1]
+        dictionary = "\n".join(lines).encode()[-MAX_SIZE:]
+
+        with open(options["output"], "wb") as f:
+            f.write(dictionary)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Wrote a {len(dictionary):,} byte dictionary from {sampled} references "
+                f"to {options['output']}; add it to the front of ECFR_TEXT_DICTIONARIES"
+            )
+        )
@@ -0,0 +1,95 @@
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_date
+
+# ecfr
+from regulations.diff import diff_references
+from regulations.extraction import HIERARCHY, ReferenceSpec
+from regulations.models import Agency, CFRReference
+
+SYMBOLS = {"added": "+", "removed": "-", "modified": "~"}
+
+
+class Command(BaseCommand):
+    help = "Shows what changed in an agency's references, or in a title or a division of it, between the stored section versions of two dates"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--from",
+            dest="from_date",
+            type=str,
+            required=True,
+            help="Date in YYYY-MM-DD format",
+        )
+        parser.add_argument(
+            "--to",
+            dest="to_date",
+            type=str,
+            required=True,
+            help="Date in YYYY-MM-DD format",
+        )
+        parser.add_argument("--agency", type=str, help="Slug of the agency to compare")
+        parser.add_argument("--title", type=int, help="Title number to compare")
+        for _, _, ref_attr in HIERARCHY[1:]:
+            parser.add_argument(
+                f"--{ref_attr}",
+                type=str,
+                help=f"With --title, only compare this {ref_attr}",
+            )
+        parser.add_argument(
+            "--words",
+            action="store_true",
+            help="Print the changed words of every changed division",
+            default=False,
+        )
+
+    def handle(self, *args, **options):
+        from_date = parse_date(options["from_date"])
+        to_date = parse_date(options["to_date"])
+        if from_date is None or to_date is None:
+            self.stdout.write(self.style.ERROR("Dates must be in YYYY-MM-DD format"))
+            return
+
+        if options["agency"]:
+            try:
+                agency = Agency.objects.get(slug=options["agency"])
+            except Agency.DoesNotExist:
+                self.stdout.write(self.style.ERROR(f"No agency {options['agency']}"))
+                return
+            references = CFRReference.objects.for_agency(agency).only(
+                *(ref_attr for _, _, ref_attr in HIERARCHY)
+            )
+        elif options["title"]:
+            references = [
+                ReferenceSpec(
+                    options["title"],
+                    *(options[ref_attr] for _, _, ref_attr in HIERARCHY[1:]),
+                )
+            ]
+        else:
+            self.stdout.write(self.style.ERROR("--agency or --title is required"))
+            return
+
+        titles, unavailable = diff_references(
+            references, from_date, to_date, options["words"]
+        )
+        for number in unavailable:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"No sections of Title {number} are stored on or before both dates"
+                )
+            )
+
+        for title in titles:
+            self.stdout.write(
+                f"Title {title['title']}, {title['from']} to {title['to']}: "
+                f"{len(title['changes'])} changed, {title['unchanged']} unchanged"
+            )
+            for change in title["changes"]:
+                self.stdout.write(
+                    f"{SYMBOLS[change['change']]} {change['type']} {change['identifier']} "
+                    f"{change['heading']} (+{change['words_added']} -{change['words_removed']} words)"
+                )
+                for run in change.get("diff", ()):
+                    removed = f"[-{run['removed']}-]" if run["removed"] else ""
+                    added = f"{{+{run['added']}+}}" if run["added"] else ""
+                    self.stdout.write(f"    at word {run['at']}: {removed}{added}")
@@ -0,0 +1,144 @@
+import hashlib
+import os
+import shutil
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from django.urls import resolve
+from django.utils import timezone
+
+# ecfr
+from regulations.models import Agency, DataGeneration
+from regulations.streaming import ENCODINGS, dumps, iter_encoded
+
+# file suffixes of the precompressed variants that WhiteNoise looks for
+SUFFIXES = {"br": ".br", "gzip": ".gz"}
+READ_SIZE = 64 * 1024
+
+
+class Command(BaseCommand):
+    help = "Renders the read-only API responses to precompressed files that WhiteNoise or a CDN can serve"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--output",
+            type=str,
+            help="Directory of the exports (default: ECFR_SNAPSHOT_DIR)",
+        )
+        parser.add_argument(
+            "--keep",
+            type=int,
+            default=2,
+            help="Number of exports to keep, including the new one, for servers still serving an older one",
+        )
+
+    def handle(self, *args, **options):
+        root = Path(options["output"] or settings.ECFR_SNAPSHOT_DIR)
+        generation = DataGeneration.objects.current()
+        name = f"{timezone.now():%Y%m%d%H%M%S%f}-{generation}"
+        target = root / name
+        target.mkdir(parents=True)
+
+        self.factory = RequestFactory()
+        slugs = list(Agency.objects.order_by("slug").values_list("slug", flat=True))
+        paths = [
+            "/api/agency/",
+            "/api/agency-name/",
+            "/api/title/",
+            "/api/word-counts/",
+            "/api/analytics/",
+        ]
+        paths += [f"/api/agency/{slug}/references/" for slug in slugs]
+        paths += [f"/api/analytics/{slug}/" for slug in slugs]
+        files = {}
+        for path in paths:
+            body = self.render(path)
+            if body is None:
+                continue
+            files[path] = self.write(target, path, body)
+
+        manifest = {
+            "generation": generation,
+            "exported_at": timezone.now().isoformat(),
+            "files": files,
+        }
+        (target / "manifest.json").write_text(dumps(manifest))
+
+        # replacing the link is atomic, so servers starting now see either export in full
+        link = root / "current.tmp"
+        link.unlink(missing_ok=True)
+        link.symlink_to(name, target_is_directory=True)
+        os.replace(link, root / "current")
+        self.prune(root, options["keep"])
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Exported {len(files)} responses of generation {generation} to {target}"
+            )
+        )
+
+    def render(self, path):
+        """Returns the body chunks of the view's response to a plain GET of path, or None"""
+        match = resolve(path)
+        request = self.factory.get(path, HTTP_ACCEPT="application/json")
+        response = match.func(request, *match.args, **match.kwargs)
+        if response.status_code != 200:
+            self.stdout.write(
+                self.style.ERROR(f"Skipping {path}: status {response.status_code}")
+            )
+            return None
+        if response.streaming:
+            return response.streaming_content
+        if hasattr(response, "render"):
+            # a DRF response, rather than one from the response cache
+            response.render()
+        return [response.content]
+
+    def write(self, target, path, body):
+        """
+        Writes body as <path>/index.json and under a content-hashed name, each
+        with its compressed variants, and returns the hashed url
+        """
+        directory = target / path.strip("/")
+        directory.mkdir(parents=True, exist_ok=True)
+        plain = directory / "index.json"
+        digest = hashlib.sha256()
+        with open(plain, "wb") as f:
+            for chunk in body:
+                digest.update(chunk)
+                f.write(chunk)
+
+        variants = [plain]
+        for encoding in ENCODINGS:
+            compressed = directory / f"index.json{SUFFIXES[encoding]}"
+            with open(compressed, "wb") as f:
+                for chunk in iter_encoded(self.iter_file(plain), encoding):
+                    f.write(chunk)
+            variants.append(compressed)
+
+        # the hashed copies are links to the same files, not a second copy
+        hashed = f"index.{digest.hexdigest()[:12]}.json"
+        for variant in variants:
+            os.link(variant, directory / variant.name.replace("index.json", hashed))
+        return f"{path}{hashed}"
+
+    def iter_file(self, path):
+        with open(path, "rb") as f:
+            while chunk := f.read(READ_SIZE):
+                yield chunk
+
+    def prune(self, root, keep):
+        current = (root / "current").resolve().name
+        exports = sorted(
+            (
+                path
+                for path in root.iterdir()
+                if path.is_dir() and not path.is_symlink()
+            ),
+            key=lambda path: path.name,
+        )
+        for path in exports[: max(len(exports) - max(keep, 1), 0)]:
+            if path.name != current:
+                shutil.rmtree(path)
@@ -0,0 +1,173 @@
+import multiprocessing
+import re
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+# ecfr
+from regulations.analytics import index_texts, update_analytics
+from regulations.extraction import reference_spec
+from regulations.fetch import map_bounded
+from regulations.models import CFRReference, Section, Title
+from regulations.response_cache import bump_generation
+from regulations.rollup import update_word_count_matrix
+from regulations.workers import extract_file
+from regulations.writer import BulkWriter
+
+FILE_PATTERN = re.compile(r"ECFR-title(\d+)\.xml")
+
+
+class Command(BaseCommand):
+    help = "Loads titles and CFR reference full text from local GovInfo eCFR bulk XML files"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "directory",
+            help="Directory of ECFR-title*.xml files from https://www.govinfo.gov/bulkdata/ECFR",
+        )
+        parser.add_argument(
+            "--title", type=int, help="Specific title number to process"
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=0,
+            help="Parse this many title files at once on a process pool",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Number of references saved per bulk update",
+        )
+        parser.add_argument(
+            "--store-sections",
+            action="store_true",
+            help="Store each title's text once per section and assemble full_text from it",
+            default=False,
+        )
+        parser.add_argument(
+            "--date",
+            type=str,
+            help="Version date of the files in YYYY-MM-DD format, for --store-sections (default: today)",
+        )
+
+    def handle(self, *args, **options):
+        files = {}
+        for path in sorted(Path(options["directory"]).glob("ECFR-title*.xml")):
+            match = FILE_PATTERN.fullmatch(path.name)
+            if match and options["title"] in (None, int(match.group(1))):
+                files[int(match.group(1))] = path
+
+        if not files:
+            self.stdout.write(self.style.ERROR("No ECFR-title*.xml files found"))
+            return
+
+        references = CFRReference.objects.filter(title_id__in=files).order_by(
+            "title_id", "chapter", "section"
+        )
+        refs_by_title = {number: [] for number in files}
+        for ref in references:
+            refs_by_title[ref.title_id].append(ref)
+
+        sections_version = None
+        if options["store_sections"]:
+            sections_version = parse_date(options["date"] or "") or timezone.localdate()
+
+        jobs = (
+            (
+                refs,
+                (
+                    str(files[number]),
+                    [reference_spec(ref) for ref in refs],
+                    options["store_sections"],
+                ),
+            )
+            for number, refs in refs_by_title.items()
+        )
+
+        if options["workers"]:
+            executor = ProcessPoolExecutor(
+                max_workers=options["workers"],
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        else:
+            # one file at a time, still overlapped with the DB writes
+            executor = ThreadPoolExecutor(max_workers=1)
+
+        writer = BulkWriter(
+            CFRReference, batch_size=options["batch_size"], on_batch=index_texts
+        )
+        with executor:
+            window = max(options["workers"], 1) * 2
+            for refs, result, error in map_bounded(
+                executor, extract_file, jobs, window
+            ):
+                if error:
+                    if isinstance(error, ET.ParseError):
+                        message = "Error parsing XML for"
+                    elif isinstance(error, OSError):
+                        message = "Error reading"
+                    else:
+                        message = "Unexpected error processing"
+                    for ref in refs:
+                        self.stdout.write(
+                            self.style.ERROR(f"{message} {ref}: {str(error)}")
+                        )
+                    continue
+
+                number, name, extractions, divisions, analytics = result
+                if number is not None and name:
+                    Title.objects.update_or_create(
+                        number=number, defaults={"name": name}
+                    )
+                if divisions is not None and number is not None:
+                    created, updated, moved, deleted = Section.objects.store(
+                        number, sections_version, divisions
+                    )
+                    self.stdout.write(
+                        f"Stored sections of Title {number}: "
+                        f"{created} new, {updated} changed, {moved} moved, {deleted} removed"
+                    )
+
+                for ref, (text, span), text_analytics in zip(
+                    refs, extractions, analytics
+                ):
+                    if text:
+                        fields = ref.set_full_text(
+                            text, span, sections_version, text_analytics.statistics
+                        )
+                        changed = "content_hash" in fields
+                        writer.add(
+                            ref,
+                            fields,
+                            (text, text_analytics.ngrams) if changed else None,
+                        )
+                    else:
+                        self.stdout.write(
+                            self.style.WARNING(f"No text found for {ref}")
+                        )
+                self.stdout.write(f"Extracted Title {number}: {len(refs)} references")
+                self.report(writer.completed())
+
+        self.report(writer.close())
+        # reference statistics changed, so the agency rollups of them did too
+        update_word_count_matrix()
+        update_analytics()
+        bump_generation()
+
+    def report(self, results):
+        for result in results:
+            if result.ok:
+                self.stdout.write(
+                    self.style.SUCCESS(f"Saved {len(result.objects)} references")
+                )
+            else:
+                for ref in result.objects:
+                    self.stdout.write(
+                        self.style.ERROR(f"Error saving {ref}: {str(result.error)}")
+                    )
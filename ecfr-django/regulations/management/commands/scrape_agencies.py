@@ -1,29 +1,31 @@
-import requests
 from django.core.management.base import BaseCommand
 from django.utils.dateparse import parse_date
+from regulations.fetch import BASE_URL, get_session
 from regulations.models import Agency, CFRReference, Title
-
-BASE_URL = "https://www.ecfr.gov/api"
+from regulations.response_cache import bump_generation
 
 
 class Command(BaseCommand):
     help = "Import agencies data from eCFR API"
 
     def handle(self, *args, **options):
+        self.session = get_session()
+
         # First process titles
         self.process_titles()
 
         # Then process agencies
-        response = requests.get(f"{BASE_URL}/admin/v1/agencies.json")
+        response = self.session.get(f"{BASE_URL}/admin/v1/agencies.json")
         data = response.json()
         self.process_agencies(data["agencies"])
+        bump_generation()
 
         self.stdout.write(
             self.style.SUCCESS("Successfully imported agencies and titles data")
         )
 
     def process_titles(self):
-        response = requests.get(f"{BASE_URL}/versioner/v1/titles.json")
+        response = self.session.get(f"{BASE_URL}/versioner/v1/titles.json")
         data = response.json()
 
         titles_to_create = []
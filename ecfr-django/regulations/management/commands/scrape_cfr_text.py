@@ -1,29 +1,45 @@
-import requests
+import multiprocessing
 import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
+from itertools import groupby
+
+import requests
 from django.core.management.base import BaseCommand
+from django.db.models import F, Q
 from django.utils import timezone
-from django.db import transaction
+from django.utils.dateparse import parse_date
 
 # ecfr
-from regulations.models import CFRReference
+from regulations.analytics import index_texts, update_analytics
+from regulations.extraction import reference_spec
+from regulations.fetch import BASE_URL, get_session, map_bounded
+from regulations.models import CFRReference, ScrapeJob, ScrapeJobItem, Section, Title
+from regulations.response_cache import bump_generation
+from regulations.rollup import update_word_count_matrix
+from regulations.workers import fetch_and_extract, init_worker
+from regulations.writer import BulkWriter
+
+# options that shape a scrape job's results, stored with it and reused by --resume
+JOB_OPTIONS = ["title", "incremental", "by_title", "store_sections", "include_headers"]
 
 
 class Command(BaseCommand):
     help = "Fetches full text for CFR references"
 
-    def get_latest_date(self):
-        url = "https://www.ecfr.gov/api/versioner/v1/titles"
+    def get_titles(self):
+        response = get_session().get(f"{BASE_URL}/versioner/v1/titles")
+        response.raise_for_status()
+        return response.json()["titles"]
 
+    def get_latest_date(self):
         try:
-            response = requests.get(url)
-            response.raise_for_status()
-            data = response.json()
+            titles = self.get_titles()
 
             # Get all unique up_to_date_as_of values, excluding None
             dates = {
                 title["up_to_date_as_of"]
-                for title in data["titles"]
+                for title in titles
                 if title["up_to_date_as_of"]
             }
 
@@ -60,6 +76,78 @@ class Command(BaseCommand):
         parser.add_argument(
             "--title", type=int, help="Specific title number to process"
         )
+        parser.add_argument(
+            "--by-title",
+            action="store_true",
+            help="Download and parse each title once and extract all of its references from it",
+            default=False,
+        )
+        parser.add_argument(
+            "--stream",
+            action="store_true",
+            help="Parse responses incrementally as they download instead of building the whole tree",
+            default=False,
+        )
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            help="Only fetch references whose title was amended since they were last scraped",
+            default=False,
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Number of references saved per bulk update",
+        )
+        parser.add_argument(
+            "--print-text",
+            action="store_true",
+            help="Print the extracted text to stdout",
+            default=False,
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=1,
+            help="Number of XML downloads to run in parallel over a shared connection pool",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=0,
+            help="Fetch, parse and extract on a pool of this many processes",
+        )
+        parser.add_argument(
+            "--retries",
+            type=int,
+            default=5,
+            help="Retries of transient HTTP errors, with exponential backoff and jitter",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Continue the most recent scrape job with the options it was started with, skipping references it already saved",
+            default=False,
+        )
+        parser.add_argument(
+            "--max-attempts",
+            type=int,
+            default=3,
+            help="With --resume, give up on references whose fetch already failed this many times",
+        )
+        parser.add_argument(
+            "--store-sections",
+            action="store_true",
+            help="With --by-title, store each title's text once per section and assemble full_text from it",
+            default=False,
+        )
+        parser.add_argument(
+            "--rate-limit",
+            type=float,
+            default=None,
+            help="Maximum number of requests started per second against the eCFR host",
+        )
 
     def build_url(self, base_url, ref):
         """Builds URL with appropriate query parameters based on CFRReference"""
@@ -81,142 +169,267 @@ class Command(BaseCommand):
         query_string = "&".join(params)
         return f"{base_url}/title-{ref.title.number}.xml{f'?{query_string}' if query_string else ''}"
 
-    def extract_text(self, xml_root, ref, include_headers=True):
-        """
-        Extracts text content from XML at the most specific/lowest division specified in the reference.
-        Includes hierarchical metadata starting from the requested division.
-
-        Args:
-            xml_root: XML root element
-            ref: CFRReference object containing title, chapter, subchapter, etc.
-            include_headers: Whether to include section headers
-        """
-
-        # https://github.com/usgpo/bulk-data/blob/main/ECFR-XML-User-Guide.md
-        hierarchy = [
-            ("DIV1", "TITLE", "title_id", lambda x: str(x.number)),
-            ("DIV2", "SUBTITLE", "subtitle", str),
-            ("DIV3", "CHAPTER", "chapter", str),
-            ("DIV4", "SUBCHAP", "subchapter", str),
-            ("DIV5", "PART", "part", str),
-            ("DIV6", "SUBPART", "subpart", str),
-            ("DIV8", "SECTION", "section", str),
-        ]
-
-        # Find the lowest specified division in our reference
-        target_level = None
-        target_value = None
-        target_index = 0
-
-        for i, (div_tag, div_type, ref_attr, converter) in enumerate(
-            reversed(hierarchy)
-        ):
-            ref_value = getattr(ref, ref_attr)
-            if ref_value:
-                target_level = (div_tag, div_type)
-                target_value = converter(ref_value)
-                target_index = len(hierarchy) - 1 - i
-                break
-
-        if not target_level:
-            return ""
-
-        text_parts = []
-        in_target_division = False
-
-        for elem in xml_root.iter():
-            # Check if we've hit the next division at our target level
-            if (
-                elem.tag == target_level[0]
-                and elem.get("TYPE") == target_level[1]
-                and elem.get("N")
-            ):
-                if elem.get("N").strip() == target_value.strip():
-                    in_target_division = True
-                    # Add the division header
-                    head = elem.find("HEAD")
-                    if head is not None and head.text:
-                        text_parts.append(f"\n{head.text.strip()}\n")
-                elif in_target_division:
-                    # We've hit the next division at our level, stop processing
-                    break
-
-            # Process other divisions only if we're in our target division
-            elif in_target_division and elem.tag.startswith("DIV") and elem.get("TYPE"):
-                div_index = next(
-                    (i for i, h in enumerate(hierarchy) if h[0] == elem.tag), -1
-                )
-                if div_index > target_index:  # Only process lower-level divisions
-                    head = elem.find("HEAD")
-                    if head is not None and head.text:
-                        text_parts.append(f"\n{head.text.strip()}\n")
-
-            if in_target_division:
-                if elem.tag == "AUTH" and elem.find("PSPACE") is not None:
-                    pspace = elem.find("PSPACE")
-                    if pspace.text:
-                        text_parts.append("\nAuthority: " + pspace.text.strip() + "\n")
-
-                elif elem.tag == "SOURCE" and elem.find("PSPACE") is not None:
-                    pspace = elem.find("PSPACE")
-                    if pspace.text:
-                        text_parts.append("\nSource: " + pspace.text.strip() + "\n")
-
-                elif elem.tag == "P":
-                    text = "".join(elem.itertext()).strip()
-                    if text:
-                        text_parts.append(text + "\n")
-
-                elif elem.tag == "CITA":
-                    if elem.get("TYPE") == "N":
-                        cita_text = "".join(elem.itertext()).strip()
-                        if cita_text:
-                            text_parts.append(f"\n{cita_text}\n")
-
-        return "".join(text_parts).strip()
-
     def handle(self, *args, **options):
-        date = options["date"]
-        base_url = f"https://www.ecfr.gov/api/versioner/v1/full/{date}"
+        if options["resume"]:
+            try:
+                self.job = ScrapeJob.objects.latest("started_at")
+            except ScrapeJob.DoesNotExist:
+                self.stdout.write(self.style.ERROR("No scrape job to resume"))
+                return
+            # the job is continued as it was started, so given options must agree with it
+            for key in JOB_OPTIONS:
+                value = self.job.options.get(key, options[key])
+                if options[key] and options[key] != value:
+                    flag = f"--{key.replace('_', '-')}"
+                    self.stdout.write(
+                        self.style.ERROR(
+                            f"{flag} conflicts with {self.job} ({key}={value})"
+                        )
+                    )
+                    return
+                options[key] = value
+
+        if options["store_sections"] and not options["by_title"]:
+            self.stdout.write(self.style.ERROR("--store-sections requires --by-title"))
+            return
+
+        if options["resume"]:
+            date = self.job.version_date.isoformat()
+            remaining = (
+                self.job.items.exclude(state=ScrapeJobItem.State.SAVED)
+                # items extracted but not saved were interrupted, not failed
+                .exclude(
+                    state=ScrapeJobItem.State.FAILED,
+                    attempts__gte=options["max_attempts"],
+                )
+                .values("reference_id")
+            )
+            references = CFRReference.objects.filter(id__in=remaining)
+            self.stdout.write(
+                f"Resuming {self.job}: {references.count()} references left"
+            )
+        else:
+            date = options["date"]
+            if not date:
+                self.stdout.write(self.style.ERROR("No version date to scrape"))
+                return
+            references = self.select_references(options)
+            self.job = ScrapeJob.objects.create(
+                version_date=date,
+                options={key: options[key] for key in JOB_OPTIONS},
+            )
+            ScrapeJobItem.objects.bulk_create(
+                ScrapeJobItem(job=self.job, reference=ref)
+                for ref in references.only("id")
+            )
+
+        base_url = f"{BASE_URL}/versioner/v1/full/{date}"
+        references = references.select_related("title").order_by(
+            "title__number", "chapter", "section"
+        )
+        if options["by_title"]:
+            jobs = (
+                (list(refs), f"{base_url}/title-{number}.xml")
+                for number, refs in groupby(
+                    references, key=lambda ref: ref.title.number
+                )
+            )
+        else:
+            jobs = (([ref], self.build_url(base_url, ref)) for ref in references)
+
+        if options["workers"]:
+            results = self.extract_in_processes(jobs, options)
+        else:
+            results = self.extract_in_threads(jobs, options)
+
+        self.print_text = options["print_text"]
+        self.sections_version = date if options["store_sections"] else None
+        self.writer = BulkWriter(
+            CFRReference, batch_size=options["batch_size"], on_batch=index_texts
+        )
 
+        # downloads and extraction keep running on the pool while results are saved
+        for refs, result, error in results:
+            if error:
+                if isinstance(error, requests.RequestException):
+                    message = "Error fetching"
+                elif isinstance(error, ET.ParseError):
+                    message = "Error parsing XML for"
+                else:
+                    message = "Unexpected error processing"
+                for ref in refs:
+                    self.stdout.write(
+                        self.style.ERROR(f"{message} {ref}: {str(error)}")
+                    )
+                self.checkpoint(
+                    refs, ScrapeJobItem.State.FAILED, fetched=True, error=str(error)
+                )
+                continue
+
+            self.checkpoint(
+                refs,
+                ScrapeJobItem.State.EXTRACTED,
+                fetched=True,
+                fetch_seconds=result.fetch_seconds,
+                extract_seconds=result.extract_seconds,
+            )
+            if result.divisions is not None:
+                # the sections have to exist before references are assembled from them
+                created, updated, moved, deleted = Section.objects.store(
+                    refs[0].title_id, date, result.divisions
+                )
+                self.stdout.write(
+                    f"Stored sections of Title {refs[0].title_id}: "
+                    f"{created} new, {updated} changed, {moved} moved, {deleted} removed"
+                )
+            for ref, (text, span), analytics in zip(
+                refs, result.extractions, result.analytics
+            ):
+                self.save_text(ref, text, span, analytics)
+            self.report(self.writer.completed())
+
+        self.report(self.writer.close())
+        self.job.finished_at = timezone.now()
+        self.job.save(update_fields=["finished_at"])
+        # reference statistics changed, so the agency rollups of them did too
+        update_word_count_matrix()
+        update_analytics()
+        bump_generation()
+
+    def select_references(self, options):
         references = CFRReference.objects.all()
         if options["title"]:
             references = references.filter(title__number=options["title"])
+        if options["incremental"]:
+            self.refresh_titles()
+            references = references.filter(
+                Q(last_updated__isnull=True)
+                | Q(title__latest_amended_on__isnull=True)
+                # an amendment on the scrape date itself may not have been published yet
+                | Q(last_updated__date__lte=F("title__latest_amended_on"))
+            )
+            self.stdout.write(f"{references.count()} references to refresh")
+        return references
+
+    def checkpoint(self, refs, state, fetched=False, **fields):
+        """
+        Records the state of references in the current job, counting an
+        attempt when they were just fetched (or failed to be)
+        """
+        if fetched:
+            fields["attempts"] = F("attempts") + 1
+        ScrapeJobItem.objects.filter(job=self.job, reference__in=refs).update(
+            state=state,
+            updated_at=timezone.now(),
+            **fields,
+        )
 
-        xml_cache = None
-
-        for ref in references.order_by("title__number", "chapter", "section"):
-            try:
-                url = self.build_url(base_url, ref)
-                self.stdout.write(f"Fetching: {url}")
-
-                response = requests.get(url)
-                response.raise_for_status()
-
-                xml_cache = ET.fromstring(response.content)
-
-                text = self.extract_text(
-                    xml_cache,
-                    ref,
-                    options["include_headers"],
-                )
-                print(text)
-                if text:
-                    with transaction.atomic():
-                        ref.full_text = text
-                        ref.last_updated = timezone.now()
-                        ref.save()
-                        self.stdout.write(self.style.SUCCESS(f"Updated text for {ref}"))
-                else:
-                    self.stdout.write(self.style.WARNING(f"No text found for {ref}"))
+    def extract_in_threads(self, jobs, options):
+        session = get_session(
+            pool_size=options["concurrency"],
+            rate_limit=options["rate_limit"],
+            retries=options["retries"],
+        )
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as executor:
+            yield from map_bounded(
+                executor,
+                fetch_and_extract,
+                (
+                    (
+                        refs,
+                        (
+                            url,
+                            refs,
+                            options["stream"],
+                            options["include_headers"],
+                            session,
+                            options["store_sections"],
+                            True,
+                        ),
+                    )
+                    for refs, url in jobs
+                ),
+                options["concurrency"] * 2,
+            )
+
+    def extract_in_processes(self, jobs, options):
+        """
+        Fetches, parses and extracts on a process pool so that extraction uses
+        every core; workers get plain ReferenceSpecs and send back only text
+        """
+        workers = options["workers"]
+        rate_limit = options["rate_limit"] / workers if options["rate_limit"] else None
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            # the parent has a DB connection and a writer thread that must not be forked
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(rate_limit, options["retries"]),
+        ) as executor:
+            yield from map_bounded(
+                executor,
+                fetch_and_extract,
+                (
+                    (
+                        refs,
+                        (
+                            url,
+                            [reference_spec(ref) for ref in refs],
+                            options["stream"],
+                            options["include_headers"],
+                            None,
+                            options["store_sections"],
+                            True,
+                        ),
+                    )
+                    for refs, url in jobs
+                ),
+                workers * 2,
+            )
+
+    def refresh_titles(self):
+        """Updates the amendment dates of every Title from the versioner API"""
+        titles = {title.number: title for title in Title.objects.all()}
+        for title_data in self.get_titles():
+            title = titles.get(title_data["number"])
+            if title:
+                for field in [
+                    "latest_amended_on",
+                    "latest_issue_date",
+                    "up_to_date_as_of",
+                ]:
+                    setattr(title, field, parse_date(title_data[field] or ""))
+        Title.objects.bulk_update(
+            titles.values(),
+            ["latest_amended_on", "latest_issue_date", "up_to_date_as_of"],
+        )
 
-            except requests.RequestException as e:
-                self.stdout.write(self.style.ERROR(f"Error fetching {ref}: {str(e)}"))
-            except ET.ParseError as e:
+    def save_text(self, ref, text, span, analytics):
+        if self.print_text:
+            self.stdout.write(text)
+        if text:
+            fields = ref.set_full_text(
+                text, span, self.sections_version, analytics.statistics
+            )
+            changed = "content_hash" in fields
+            # the search index and n-grams of changed text are written with it, see index_texts
+            self.writer.add(ref, fields, (text, analytics.ngrams) if changed else None)
+        else:
+            self.stdout.write(self.style.WARNING(f"No text found for {ref}"))
+            self.checkpoint([ref], ScrapeJobItem.State.FAILED, error="No text found")
+
+    def report(self, results):
+        for result in results:
+            if result.ok:
                 self.stdout.write(
-                    self.style.ERROR(f"Error parsing XML for {ref}: {str(e)}")
+                    self.style.SUCCESS(f"Saved {len(result.objects)} references")
                 )
-            except Exception as e:
-                self.stdout.write(
-                    self.style.ERROR(f"Unexpected error processing {ref}: {str(e)}")
+                self.checkpoint(result.objects, ScrapeJobItem.State.SAVED, error="")
+            else:
+                for ref in result.objects:
+                    self.stdout.write(
+                        self.style.ERROR(f"Error saving {ref}: {str(result.error)}")
+                    )
+                self.checkpoint(
+                    result.objects, ScrapeJobItem.State.FAILED, error=str(result.error)
                 )
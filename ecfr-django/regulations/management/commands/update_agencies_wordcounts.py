@@ -1,37 +1,82 @@
 from django.core.management.base import BaseCommand
-from regulations.models import Agency, CFRReference
+from django.db import transaction
+from django.db.models import Q
 
-BASE_URL = "https://www.ecfr.gov/api"
+from regulations.analytics import index_ngrams, update_analytics
+from regulations.extraction import TEXT_STATISTICS, text_analytics
+from regulations.models import Agency, CFRReference
+from regulations.response_cache import bump_generation
+from regulations.rollup import update_word_count_matrix, update_word_counts
 
 
 class Command(BaseCommand):
-    help = "Update agency word_count from associated CFRReference full_text data scraped from eCFR API"
+    help = (
+        "Update agency word_count from the word counts stored on their CFR references"
+    )
 
-    def handle(self, *args, **options):
-        # For each agency, calculate total word count of related CFR references
-        for agency in Agency.objects.all():
-            # Get all related CFR references for this agency and its children
-            cfr_refs = CFRReference.objects.filter(agency=agency)
-
-            # Get all child agencies
-            child_agencies = agency.children.all()
-
-            # Add CFR references from child agencies
-            for child in child_agencies:
-                child_refs = CFRReference.objects.filter(agency=child)
-                cfr_refs = cfr_refs | child_refs
-
-            # Calculate word count by counting spaces + 1
-            total_words = sum(
-                len(ref.full_text.split()) for ref in cfr_refs if ref.full_text
-            )
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--backfill",
+            action="store_true",
+            help="First compute text statistics and n-grams for references scraped before they were stored (reads their full_text once)",
+            default=False,
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Number of references read and updated at a time by --backfill",
+        )
+        parser.add_argument(
+            "--count-overlaps",
+            action="store_true",
+            help="Sum every reference as-is, counting nested references and references shared with sub-agencies more than once",
+            default=False,
+        )
 
-            print(f"{agency}: {total_words} words")
+    def handle(self, *args, **options):
+        if options["backfill"]:
+            self.backfill(options["batch_size"])
 
-            print(total_words)
-            agency.cfr_word_count = total_words
-            agency.save()
+        if options["count_overlaps"]:
+            Agency.objects.update_word_counts()
+            update_word_count_matrix()
+        else:
+            update_word_counts()
+        update_analytics()
+        bump_generation()
 
         self.stdout.write(
             self.style.SUCCESS("Successfully updated word_count for agencies!")
         )
+
+    def backfill(self, batch_size):
+        references = (
+            CFRReference.objects.filter(
+                Q(restriction_count__isnull=True) | Q(byte_count__isnull=True),
+                full_text__isnull=False,
+            )
+            .only("id", "full_text")
+            .iterator(chunk_size=batch_size)
+        )
+        batch = []
+        count = 0
+        for ref in references:
+            count += 1
+            statistics, ngrams = text_analytics(ref.full_text)
+            for field, value in statistics.items():
+                setattr(ref, field, value)
+            ref.full_text = None  # release the text, it is not saved
+            batch.append((ref, ngrams))
+            if len(batch) >= batch_size:
+                self.save_analytics(batch)
+                batch = []
+        if batch:
+            self.save_analytics(batch)
+        self.stdout.write(f"Backfilled text statistics of {count} references")
+
+    def save_analytics(self, batch):
+        """Saves the statistics and n-grams of a batch of (reference, ngrams) in bulk"""
+        with transaction.atomic():
+            CFRReference.objects.bulk_update([ref for ref, _ in batch], TEXT_STATISTICS)
+            index_ngrams(batch)
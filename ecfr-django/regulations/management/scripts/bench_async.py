@@ -0,0 +1,107 @@
+"""
+Throughput of many simultaneous references requests, sync views under WSGI
+against the async views (/api/async/) under ASGI
+
+Serve the same settings and database both ways, for example
+
+    uv run gunicorn ecfr.wsgi --workers 2 --threads 4 --bind localhost:8000
+    uv run uvicorn ecfr.asgi:application --workers 2 --port 8001
+
+and run
+
+    uv run python regulations/management/scripts/bench_async.py \\
+        --wsgi http://localhost:8000 --asgi http://localhost:8001 \\
+        --agency environmental-protection-agency --concurrency 64 --requests 256
+
+Every request reads its whole streamed body. Requests carry a query string so
+that the API snapshot served by WhiteNoise does not answer them.
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+async def fetch(client, url):
+    """Returns the number of bytes of the response body"""
+    size = 0
+    async with client.stream("GET", url) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_raw():
+            size += len(chunk)
+    return size
+
+
+async def benchmark(url, concurrency, requests):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    sizes = []
+    errors = []
+
+    async def one(client):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                sizes.append(await fetch(client, url))
+            except httpx.HTTPError as e:
+                errors.append(e)
+                return
+            latencies.append(time.perf_counter() - start)
+
+    limits = httpx.Limits(
+        max_connections=concurrency, max_keepalive_connections=concurrency
+    )
+    async with httpx.AsyncClient(limits=limits, timeout=None) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(one(client) for _ in range(requests)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests/s": len(latencies) / elapsed,
+        "p50 ms": 1000 * statistics.median(latencies) if latencies else 0,
+        "p95 ms": 1000 * latencies[int(len(latencies) * 0.95) - 1] if latencies else 0,
+        "MB/s": sum(sizes) / elapsed / 1e6,
+        "errors": len(errors),
+    }
+
+
+async def main(options):
+    query = f"?fields={options.fields}"
+    runs = []
+    for agency in options.agency:
+        path = f"/api/agency/{agency}/references/{query}"
+        runs.append((f"{agency} WSGI", options.wsgi + path))
+        runs.append(
+            (f"{agency} ASGI", options.asgi + path.replace("/api/", "/api/async/"))
+        )
+
+    print(f"{options.requests} requests, {options.concurrency} at a time")
+    columns = ["requests/s", "p50 ms", "p95 ms", "MB/s", "errors"]
+    width = max(len(name) for name, _ in runs)
+    print(" " * width, *(f"{column:>11}" for column in columns))
+    for name, url in runs:
+        # warm up connections and caches
+        await benchmark(url, min(options.concurrency, 4), min(options.requests, 4))
+        result = await benchmark(url, options.concurrency, options.requests)
+        print(f"{name:<{width}}", *(f"{result[column]:>11.1f}" for column in columns))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--wsgi", required=True, help="Base url of the WSGI server")
+    parser.add_argument("--asgi", required=True, help="Base url of the ASGI server")
+    parser.add_argument(
+        "--agency", action="append", required=True, help="Agency slug, may be repeated"
+    )
+    parser.add_argument(
+        "--fields",
+        default="title,chapter,part,full_text",
+        help="Reference fields requested (default: with full_text)",
+    )
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=256)
+    asyncio.run(main(parser.parse_args()))
@@ -4,34 +4,27 @@ import re
 # computes total wordcount from two of the largest agencies
 # and dumps all of the truncated agency title subset(s) to a folder of the agency short_name
 for agency in Agency.objects.filter(short_name__in=["TREAS", "EPA"]):
-    cfr_refs = CFRReference.objects.filter(agency=agency)
-
-    child_agencies = agency.children.all()
-
-    for child in child_agencies:
-        child_refs = CFRReference.objects.filter(agency=child)
-        cfr_refs = cfr_refs | child_refs
+    cfr_refs = CFRReference.objects.for_agency(agency)
     text_files_dir = os.path.join(settings.BASE_DIR, agency.short_name)
     os.makedirs(text_files_dir, exist_ok=True)
 
     for ref in cfr_refs:
-        if ref.full_text:
+        full_text = ref.get_full_text()
+        if full_text:
             safe_title = re.sub(r"[^\w\s-]", "", str(ref))
             safe_agency = re.sub(r"[^\w\s-]", "", str(ref.agency))
             filename = f"{safe_title}_{safe_agency}.txt"
             filepath = os.path.join(text_files_dir, filename)
 
             with open(filepath, "w", encoding="utf-8") as f:
-                f.write(ref.full_text)
+                f.write(full_text)
 
         print(agency)
         for cfr_ref in cfr_refs:
-            print(
-                cfr_ref, f"{len(cfr_ref.full_text.split()): ,}", f"({cfr_ref.agency})"
-            )
+            print(cfr_ref, f"{cfr_ref.word_count or 0: ,}", f"({cfr_ref.agency})")
         print(
             agency,
-            f"{sum(len(ref.full_text.split()) for ref in cfr_refs if ref.full_text): ,}",
+            f"{sum(ref.word_count or 0 for ref in cfr_refs): ,}",
             "\n",
         )
 
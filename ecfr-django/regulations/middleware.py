@@ -0,0 +1,28 @@
+"""
+WhiteNoise, also serving the API snapshot written by export_api_snapshot
+"""
+
+import re
+
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+# the content-addressed copy of each response, e.g. /api/title/index.0123456789ab.json
+HASHED_SNAPSHOT = re.compile(r"/index\.[0-9a-f]{12}\.json$")
+
+
+class SnapshotWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """
+    Answers API requests from the snapshot in WHITENOISE_ROOT before they
+    reach the views. The snapshot only has the default responses, so requests
+    with a query string (fields, paging, formats) still go to the views.
+    """
+
+    def __call__(self, request):
+        if request.META.get("QUERY_STRING") and request.path_info.startswith("/api/"):
+            return self.get_response(request)
+        return super().__call__(request)
+
+    def immutable_file_test(self, path, url):
+        return bool(HASHED_SNAPSHOT.search(url)) or super().immutable_file_test(
+            path, url
+        )
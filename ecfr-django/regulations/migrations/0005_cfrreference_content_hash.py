@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('regulations', '0004_agency_cfr_word_count_alter_cfrreference_title'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cfrreference',
+            name='content_hash',
+            field=models.CharField(blank=True, help_text='SHA-256 of full_text, used to skip rewriting unchanged text', max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('regulations', '0006_scrapejob_scrapejobitem'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cfrreference',
+            name='character_count',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='cfrreference',
+            name='paragraph_count',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='cfrreference',
+            name='word_count',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
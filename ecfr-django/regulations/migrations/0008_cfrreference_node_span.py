@@ -0,0 +1,23 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('regulations', '0007_cfrreference_character_count_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cfrreference',
+            name='node_end',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='cfrreference',
+            name='node_start',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
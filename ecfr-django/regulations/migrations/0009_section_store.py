@@ -0,0 +1,47 @@
+# Generated by Django 5.1.6 on 2026-10-18 21:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('regulations', '0008_cfrreference_node_span'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SectionText',
+            fields=[
+                ('content_hash', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('text', models.TextField(blank=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='cfrreference',
+            name='sections_version',
+            field=models.DateField(blank=True, help_text='Version date of the Section rows full_text is assembled from, instead of being stored', null=True),
+        ),
+        migrations.CreateModel(
+            name='Section',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version_date', models.DateField()),
+                ('ordinal', models.IntegerField(help_text='Position among the divisions of the title version, as in CFRReference.node_start')),
+                ('tag', models.CharField(max_length=10)),
+                ('type', models.CharField(blank=True, max_length=20)),
+                ('identifier', models.CharField(blank=True, max_length=50)),
+                ('part', models.CharField(blank=True, max_length=25)),
+                ('section', models.CharField(blank=True, max_length=50)),
+                ('heading', models.TextField(blank=True)),
+                ('title', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sections', to='regulations.title')),
+                ('text', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='sections', to='regulations.sectiontext')),
+            ],
+            options={
+                'ordering': ['title', 'version_date', 'ordinal'],
+                'indexes': [models.Index(fields=['title', 'part', 'section', 'version_date'], name='regulations_title_i_c8b944_idx')],
+                'unique_together': {('title', 'version_date', 'ordinal')},
+            },
+        ),
+    ]
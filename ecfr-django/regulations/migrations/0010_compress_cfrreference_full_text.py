@@ -0,0 +1,58 @@
+# Generated by Django 5.1.6 on 2026-10-18 21:52
+
+import regulations.fields
+from django.db import migrations
+
+BATCH_SIZE = 100
+
+
+def copy_text(apps, source, target):
+    CFRReference = apps.get_model('regulations', 'CFRReference')
+    references = (
+        CFRReference.objects.filter(**{f'{source}__isnull': False})
+        .only('id', source)
+        .iterator(chunk_size=BATCH_SIZE)
+    )
+    batch = []
+    for ref in references:
+        # reading one field and assigning the other compresses or decompresses the text
+        setattr(ref, target, getattr(ref, source))
+        batch.append(ref)
+        if len(batch) >= BATCH_SIZE:
+            CFRReference.objects.bulk_update(batch, [target])
+            batch = []
+    if batch:
+        CFRReference.objects.bulk_update(batch, [target])
+
+
+def compress_text(apps, schema_editor):
+    copy_text(apps, 'full_text', 'compressed_text')
+
+
+def decompress_text(apps, schema_editor):
+    copy_text(apps, 'compressed_text', 'full_text')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('regulations', '0009_section_store'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cfrreference',
+            name='compressed_text',
+            field=regulations.fields.CompressedTextField(blank=True, null=True),
+        ),
+        migrations.RunPython(compress_text, decompress_text),
+        migrations.RemoveField(
+            model_name='cfrreference',
+            name='full_text',
+        ),
+        migrations.RenameField(
+            model_name='cfrreference',
+            old_name='compressed_text',
+            new_name='full_text',
+        ),
+    ]
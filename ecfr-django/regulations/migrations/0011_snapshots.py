@@ -0,0 +1,55 @@
+# Generated by Django 5.1.6 on 2026-10-18 22:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('regulations', '0010_compress_cfrreference_full_text'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AgencySnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('word_count', models.BigIntegerField()),
+                ('agency', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='regulations.agency')),
+            ],
+            options={
+                'ordering': ['agency', 'date'],
+                'unique_together': {('agency', 'date')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ReferenceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(db_index=True)),
+                ('word_count', models.BigIntegerField()),
+                ('node_start', models.IntegerField(blank=True, null=True)),
+                ('node_end', models.IntegerField(blank=True, null=True)),
+                ('reference', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='regulations.cfrreference')),
+            ],
+            options={
+                'ordering': ['reference', 'date'],
+                'unique_together': {('reference', 'date')},
+            },
+        ),
+        migrations.CreateModel(
+            name='TitleSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('amended_on', models.DateField(help_text='Latest amendment of the title on or before date')),
+                ('title', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='regulations.title')),
+            ],
+            options={
+                'ordering': ['title', 'date'],
+                'unique_together': {('title', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.1.6 on 2026-10-18 23:14
+
+import django.contrib.postgres.search
+import django.db.models.deletion
+import regulations.fields
+from django.db import migrations, models
+
+
+# GIN is Postgres only, so the index is not declared on the model
+def create_vector_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX regulations_searchchunk_vector_gin '
+            'ON regulations_searchchunk USING gin (vector)'
+        )
+
+
+def drop_vector_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS regulations_searchchunk_vector_gin')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('regulations', '0012_data_generation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ordinal', models.PositiveIntegerField()),
+                ('text', regulations.fields.CompressedTextField()),
+                ('vector', django.contrib.postgres.search.SearchVectorField(blank=True, null=True)),
+                ('reference', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_chunks', to='regulations.cfrreference')),
+            ],
+            options={
+                'ordering': ['reference', 'ordinal'],
+                'unique_together': {('reference', 'ordinal')},
+            },
+        ),
+        migrations.CreateModel(
+            name='SearchPosting',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('weight', models.FloatField(help_text='1 + ln(occurrences of the term in the chunk)')),
+                ('chunk', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='postings', to='regulations.searchchunk')),
+                ('reference', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='regulations.cfrreference')),
+            ],
+            options={
+                'unique_together': {('term', 'chunk')},
+            },
+        ),
+        migrations.RunPython(create_vector_index, drop_vector_index),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.6 on 2026-10-18 23:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('regulations', '0013_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AgencyWordCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chapter', models.CharField(blank=True, max_length=25, null=True)),
+                ('word_count', models.BigIntegerField()),
+                ('agency', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='title_word_counts', to='regulations.agency')),
+                ('title', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='agency_word_counts', to='regulations.title')),
+            ],
+            options={
+                'ordering': ['agency', 'title', 'chapter'],
+                'unique_together': {('agency', 'title', 'chapter')},
+            },
+        ),
+    ]
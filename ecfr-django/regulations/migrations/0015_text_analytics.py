@@ -0,0 +1,101 @@
+# Generated by Django 5.1.6 on 2026-10-18 23:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('regulations', '0014_agency_word_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AgencyStatistics',
+            fields=[
+                ('word_count', models.BigIntegerField(blank=True, null=True)),
+                ('character_count', models.BigIntegerField(blank=True, null=True)),
+                ('paragraph_count', models.IntegerField(blank=True, null=True)),
+                ('sentence_count', models.IntegerField(blank=True, null=True)),
+                ('section_count', models.IntegerField(blank=True, null=True)),
+                ('restriction_count', models.IntegerField(blank=True, null=True)),
+                ('shall_count', models.IntegerField(blank=True, null=True)),
+                ('must_count', models.IntegerField(blank=True, null=True)),
+                ('may_not_count', models.IntegerField(blank=True, null=True)),
+                ('required_count', models.IntegerField(blank=True, null=True)),
+                ('prohibited_count', models.IntegerField(blank=True, null=True)),
+                ('agency', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='statistics', serialize=False, to='regulations.agency')),
+            ],
+            options={
+                'verbose_name_plural': 'agency statistics',
+            },
+        ),
+        migrations.AddField(
+            model_name='cfrreference',
+            name='may_not_count',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='cfrreference',
+            name='must_count',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='cfrreference',
+            name='prohibited_count',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='cfrreference',
+            name='required_count',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='cfrreference',
+            name='restriction_count',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='cfrreference',
+            name='section_count',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='cfrreference',
+            name='sentence_count',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='cfrreference',
+            name='shall_count',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='AgencyNgram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('n', models.PositiveSmallIntegerField()),
+                ('ngram', models.CharField(max_length=255)),
+                ('count', models.BigIntegerField()),
+                ('agency', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ngrams', to='regulations.agency')),
+            ],
+            options={
+                'ordering': ['agency', 'n', '-count', 'ngram'],
+                'unique_together': {('agency', 'n', 'ngram')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ReferenceNgram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('n', models.PositiveSmallIntegerField()),
+                ('ngram', models.CharField(max_length=255)),
+                ('count', models.IntegerField()),
+                ('reference', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ngrams', to='regulations.cfrreference')),
+            ],
+            options={
+                'unique_together': {('reference', 'n', 'ngram')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.6 on 2026-10-18 23:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('regulations', '0015_text_analytics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='agencystatistics',
+            name='byte_count',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='cfrreference',
+            name='byte_count',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
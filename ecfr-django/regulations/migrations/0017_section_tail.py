@@ -0,0 +1,24 @@
+# Generated by Django 5.1.6 on 2026-10-18 23:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('regulations', '0016_byte_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='section',
+            name='depth',
+            field=models.PositiveSmallIntegerField(help_text='Number of divisions it is nested in, 0 for the title', null=True),
+        ),
+        migrations.AddField(
+            model_name='section',
+            name='tail',
+            field=models.ForeignKey(blank=True, help_text='Text of the division above it that follows it and everything below it', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='tail_sections', to='regulations.sectiontext'),
+        ),
+    ]
@@ -1,4 +1,97 @@
-from django.db import models
+import hashlib
+from collections import defaultdict
+
+from django.contrib.postgres.search import SearchVectorField
+from django.db import connection, models, transaction
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+
+from .extraction import (
+    TEXT_STATISTICS,
+    Division,
+    DivisionJoiner,
+    iter_join_divisions,
+    target_index,
+    text_statistics,
+)
+from .fields import CHUNK_SIZE, CompressedTextField
+
+
+class AgencyManager(models.Manager):
+    """
+    Hierarchy queries over the self-referential parent FK, each answered with a
+    single recursive CTE regardless of how deep the agency tree goes
+    """
+
+    def _tree_sql(self):
+        # every (ancestor, descendant) pair, including each agency paired with itself
+        table = self.model._meta.db_table
+        return f"""
+            WITH RECURSIVE tree(ancestor_id, descendant_id) AS (
+                SELECT id, id FROM {table}
+                UNION ALL
+                SELECT tree.ancestor_id, child.id
+                FROM {table} child JOIN tree ON child.parent_id = tree.descendant_id
+            )
+        """
+
+    def descendants(self, agency, include_self=True):
+        """Returns the agency's children, their children and so on"""
+        table = self.model._meta.db_table
+        sql = f"""
+            WITH RECURSIVE tree(id) AS (
+                SELECT id FROM {table} WHERE id = %s
+                UNION ALL
+                SELECT child.id FROM {table} child JOIN tree ON child.parent_id = tree.id
+            )
+            SELECT id FROM tree
+        """
+        descendants = self.filter(pk__in=RawSQL(sql, [agency.pk]))
+        return descendants if include_self else descendants.exclude(pk=agency.pk)
+
+    def ancestors(self, agency, include_self=True):
+        """Returns the agency's parent, its parent and so on up to the top level"""
+        table = self.model._meta.db_table
+        sql = f"""
+            WITH RECURSIVE tree(id, parent_id) AS (
+                SELECT id, parent_id FROM {table} WHERE id = %s
+                UNION ALL
+                SELECT parent.id, parent.parent_id
+                FROM {table} parent JOIN tree ON parent.id = tree.parent_id
+            )
+            SELECT id FROM tree
+        """
+        ancestors = self.filter(pk__in=RawSQL(sql, [agency.pk]))
+        return ancestors if include_self else ancestors.exclude(pk=agency.pk)
+
+    def tree_pairs(self):
+        """Returns every (ancestor id, descendant id) pair, each agency included with itself"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                self._tree_sql() + "SELECT ancestor_id, descendant_id FROM tree"
+            )
+            return cursor.fetchall()
+
+    def update_word_counts(self):
+        """
+        Sets every agency's cfr_word_count to the sum of the stored word counts
+        of the references of the agency and all of its descendants, in a single UPDATE
+        """
+        table = self.model._meta.db_table
+        references = CFRReference._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                self._tree_sql()
+                + f"""
+                UPDATE {table} SET cfr_word_count = totals.words
+                FROM (
+                    SELECT tree.ancestor_id, COALESCE(SUM(ref.word_count), 0) AS words
+                    FROM tree LEFT JOIN {references} ref ON ref.agency_id = tree.descendant_id
+                    GROUP BY tree.ancestor_id
+                ) AS totals
+                WHERE {table}.id = totals.ancestor_id
+                """
+            )
 
 
 class Agency(models.Model):
@@ -6,6 +99,8 @@ class Agency(models.Model):
     Represents a federal agency or sub-agency with CFR references
     """
 
+    objects = AgencyManager()
+
     name = models.CharField(max_length=255)
     # bug in API: Agency w/ short_name "Military Compensation and Retirement Modernization Commission"
     short_name = models.CharField(max_length=63, blank=True, null=True)
@@ -35,15 +130,47 @@ class Agency(models.Model):
     def __str__(self):
         return self.display_name
 
+    def get_descendants(self, include_self=True):
+        return Agency.objects.descendants(self, include_self)
+
+    def get_ancestors(self, include_self=True):
+        return Agency.objects.ancestors(self, include_self)
+
 
 class CFRReferenceManager(models.Manager):
     def get_queryset(self):
         return super().get_queryset().defer("full_text")
 
+    def for_agency(self, agency):
+        """Returns the references of the agency and of every agency below it"""
+        return self.filter(agency__in=Agency.objects.descendants(agency))
 
-class CFRReference(models.Model):
+
+class TextStatistics(models.Model):
+    """The statistics of extraction.text_statistics, one column each"""
+
+    word_count = models.BigIntegerField(null=True, blank=True)
+    character_count = models.BigIntegerField(null=True, blank=True)
+    byte_count = models.BigIntegerField(null=True, blank=True)
+    paragraph_count = models.IntegerField(null=True, blank=True)
+    sentence_count = models.IntegerField(null=True, blank=True)
+    section_count = models.IntegerField(null=True, blank=True)
+    # uses of restrictive terms, in total and by term
+    restriction_count = models.IntegerField(null=True, blank=True)
+    shall_count = models.IntegerField(null=True, blank=True)
+    must_count = models.IntegerField(null=True, blank=True)
+    may_not_count = models.IntegerField(null=True, blank=True)
+    required_count = models.IntegerField(null=True, blank=True)
+    prohibited_count = models.IntegerField(null=True, blank=True)
+
+    class Meta:
+        abstract = True
+
+
+class CFRReference(TextStatistics):
     """
-    Represents a Code of Federal Regulations (CFR) reference for an Agency
+    Represents a Code of Federal Regulations (CFR) reference for an Agency.
+    Its TextStatistics are of full_text, computed when it is extracted.
     """
 
     objects = CFRReferenceManager()
@@ -92,8 +219,24 @@ class CFRReference(models.Model):
     )
 
     # text to be processed for word count
-    full_text = models.TextField(blank=True, null=True)
+    full_text = CompressedTextField(blank=True, null=True)
     last_updated = models.DateTimeField(null=True)
+    content_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        null=True,
+        help_text="SHA-256 of full_text, used to skip rewriting unchanged text",
+    )
+
+    # preorder positions of the referenced division and its last descendant among
+    # the divisions of the title, so nested references have nested ranges
+    node_start = models.IntegerField(null=True, blank=True)
+    node_end = models.IntegerField(null=True, blank=True)
+    sections_version = models.DateField(
+        null=True,
+        blank=True,
+        help_text="Version date of the Section rows full_text is assembled from, instead of being stored",
+    )
 
     class Meta:
         unique_together = [
@@ -106,6 +249,98 @@ class CFRReference(models.Model):
         ]
         ordering = ["title", "chapter"]
 
+    def get_agencies(self):
+        """Returns the reference's agency and every agency above it"""
+        return Agency.objects.ancestors(self.agency)
+
+    def set_full_text(self, text, span=None, sections_version=None, statistics=None):
+        """
+        Stores newly extracted text and the span of its division, returning the
+        fields that need saving; the text is left alone when it has not changed.
+
+        With a `sections_version`, the text is not stored but assembled from the
+        Section rows of that version by get_full_text(). `statistics` are the
+        text_statistics of the text when they were computed with it.
+        """
+        self.last_updated = timezone.now()
+        fields = ["last_updated"]
+        if span is not None:
+            # positions shift with amendments elsewhere in the title, so always refresh them
+            self.node_start, self.node_end = span
+            fields += ["node_start", "node_end"]
+
+        in_sections = sections_version is not None and span is not None
+        if in_sections or self.sections_version is not None:
+            self.sections_version = sections_version if in_sections else None
+            self.full_text = None if in_sections else text
+            fields += ["sections_version", "full_text"]
+
+        content_hash = hashlib.sha256(text.encode()).hexdigest()
+        if content_hash == self.content_hash and all(
+            getattr(self, field) is not None for field in TEXT_STATISTICS
+        ):
+            return fields
+        if not in_sections and "full_text" not in fields:
+            self.full_text = text
+            fields.append("full_text")
+        self.content_hash = content_hash
+        if statistics is None:
+            statistics = text_statistics(text)
+        for field, value in statistics.items():
+            setattr(self, field, value)
+        return fields + ["content_hash", *statistics]
+
+    def get_full_text(self):
+        """Returns full_text, assembling it from the title's sections if it is stored there"""
+        if self.sections_version is None:
+            return self.full_text
+        return "".join(self.iter_full_text())
+
+    def text_hash(self):
+        """
+        A hash of the text iter_full_text() yields, for ETags: content_hash when
+        the text is stored, or else a hash of the Section rows it is assembled from
+        """
+        if self.sections_version is None:
+            return self.content_hash
+        return Section.objects.span_hash(
+            self.title_id,
+            self.sections_version,
+            (self.node_start, self.node_end),
+            target_index(self),
+        )
+
+    def iter_full_text(self, chunk_size=CHUNK_SIZE):
+        """
+        Yields the text in chunks for streaming responses, decompressing or
+        assembling it as it goes instead of building the whole string
+        """
+        if self.sections_version is None:
+            yield from self._meta.get_field("full_text").iter_text(self, chunk_size)
+            return
+        yield from Section.objects.iter_assemble(
+            self.title_id,
+            self.sections_version,
+            (self.node_start, self.node_end),
+            target_index(self),
+        )
+
+    async def aiter_full_text(self, chunk_size=CHUNK_SIZE):
+        """iter_full_text for async views"""
+        if self.sections_version is None:
+            async for chunk in self._meta.get_field("full_text").aiter_text(
+                self, chunk_size
+            ):
+                yield chunk
+            return
+        async for chunk in Section.objects.aiter_assemble(
+            self.title_id,
+            self.sections_version,
+            (self.node_start, self.node_end),
+            target_index(self),
+        ):
+            yield chunk
+
     def __str__(self):
         parts = [f"Title {self.title}"]
         if self.subtitle:
@@ -132,3 +367,536 @@ class Title(models.Model):
 
     def __str__(self):
         return f"{self.number} - {self.name}"
+
+
+class SectionText(models.Model):
+    """
+    Text of a division, stored once however many versions of it are identical
+    """
+
+    content_hash = models.CharField(max_length=64, primary_key=True)
+    text = models.TextField(blank=True)
+
+    def __str__(self):
+        return self.content_hash
+
+
+def keyed_sections(sections):
+    """
+    Yields (key, section) for Sections (or rows with the same attributes) of a
+    title version in ordinal order, with a key that identifies the division
+    across versions: its tag, type, part, identifier and occurrence
+    """
+    occurrences = defaultdict(int)
+    for section in sections:
+        key = (section.tag, section.type, section.part, section.identifier)
+        yield key + (occurrences[key],), section
+        occurrences[key] += 1
+
+
+# what iter_assemble reads of each Section, in the order of the Division fields
+ASSEMBLY_FIELDS = [
+    "ordinal",
+    "tag",
+    "type",
+    "heading",
+    "text__text",
+    "depth",
+    "tail__text",
+]
+
+
+class SectionManager(models.Manager):
+    def store(self, title_id, version_date, divisions, batch_size=500):
+        """
+        Saves the Divisions of a title version, only inserting texts that are
+        not stored yet and only writing rows that changed since the version was
+        last stored. Rows are matched by keyed_sections(), so a division inserted
+        or removed above others only rewrites the ordinals of those below it.
+        Returns the number of rows created, updated, moved and deleted.
+        """
+        rows = []
+        texts = {}
+        for division in sorted(divisions, key=lambda division: division.position):
+            content_hash = hashlib.sha256(division.body.encode()).hexdigest()
+            texts[content_hash] = division.body
+            tail_hash = None
+            if division.tail:
+                tail_hash = hashlib.sha256(division.tail.encode()).hexdigest()
+                texts[tail_hash] = division.tail
+            rows.append(
+                Section(
+                    title_id=title_id,
+                    version_date=version_date,
+                    ordinal=division.position,
+                    tag=division.tag,
+                    type=division.type,
+                    identifier=division.identifier,
+                    part=division.part,
+                    section=division.identifier if division.type == "SECTION" else "",
+                    heading=division.heading,
+                    text_id=content_hash,
+                    depth=division.depth,
+                    tail_id=tail_hash,
+                )
+            )
+        rows = dict(keyed_sections(rows))
+
+        hashes = list(texts)
+        for i in range(0, len(hashes), batch_size):
+            batch = hashes[i : i + batch_size]
+            for content_hash in SectionText.objects.filter(pk__in=batch).values_list(
+                "pk", flat=True
+            ):
+                del texts[content_hash]
+
+        fields = ["heading", "text_id", "depth", "tail_id"]
+        existing = self.filter(title_id=title_id, version_date=version_date)
+        changed = []
+        moved = []
+        removed = []
+        # rows whose ordinal changes, parked at unused negative ordinals first so
+        # that their new ordinals never collide with old ones mid-update
+        shifted = []
+        sections = (
+            existing.only("id", "ordinal", "tag", "type", "identifier", "part", *fields)
+            .order_by("ordinal")
+            .iterator()
+        )
+        for key, section in keyed_sections(sections):
+            row = rows.pop(key, None)
+            if row is None:
+                removed.append(section.id)
+                continue
+            row.id = section.id
+            if row.ordinal != section.ordinal:
+                shifted.append(section.id)
+            if any(getattr(row, f) != getattr(section, f) for f in fields):
+                changed.append(row)
+            elif row.ordinal != section.ordinal:
+                moved.append(row)
+
+        with transaction.atomic():
+            SectionText.objects.bulk_create(
+                (SectionText(content_hash=h, text=text) for h, text in texts.items()),
+                batch_size=batch_size,
+                ignore_conflicts=True,
+            )
+            for i in range(0, len(removed), batch_size):
+                self.filter(id__in=removed[i : i + batch_size]).delete()
+            for i in range(0, len(shifted), batch_size):
+                self.filter(id__in=shifted[i : i + batch_size]).update(
+                    ordinal=-models.F("ordinal") - 1
+                )
+            self.bulk_update(changed, ["ordinal", *fields], batch_size=batch_size)
+            self.bulk_update(moved, ["ordinal"], batch_size=batch_size)
+            self.bulk_create(rows.values(), batch_size=batch_size)
+        return len(rows), len(changed), len(moved), len(removed)
+
+    def span_hash(self, title_id, version_date, span, index):
+        """
+        A hash of everything iter_assemble() builds the text of a span from,
+        so it changes whenever the text does, without reading the text
+        """
+        digest = hashlib.sha256(str(index).encode())
+        rows = self.filter(
+            title_id=title_id, version_date=version_date, ordinal__range=span
+        ).order_by("ordinal")
+        for row in rows.values_list(
+            "tag", "type", "heading", "text_id", "depth", "tail_id"
+        ).iterator():
+            digest.update("\0".join(map(str, row)).encode() + b"\n")
+        return digest.hexdigest()
+
+    def iter_assemble(self, title_id, version_date, span, index):
+        """Yields the text of the divisions in a span, as extracted for a reference at `index`"""
+        sections = self.filter(
+            title_id=title_id, version_date=version_date, ordinal__range=span
+        ).order_by("ordinal")
+        yield from iter_join_divisions(
+            (
+                Division(ordinal, tag, div_type, "", "", heading, text, depth, tail)
+                for ordinal, tag, div_type, heading, text, depth, tail in sections.values_list(
+                    *ASSEMBLY_FIELDS
+                ).iterator()
+            ),
+            index,
+        )
+
+    async def aiter_assemble(self, title_id, version_date, span, index):
+        """iter_assemble for async views, reading the sections with the async ORM"""
+        sections = self.filter(
+            title_id=title_id, version_date=version_date, ordinal__range=span
+        ).order_by("ordinal")
+        joiner = DivisionJoiner(index)
+        async for (
+            ordinal,
+            tag,
+            div_type,
+            heading,
+            text,
+            depth,
+            tail,
+        ) in sections.values_list(*ASSEMBLY_FIELDS):
+            text = joiner.add(
+                Division(ordinal, tag, div_type, "", "", heading, text, depth, tail)
+            )
+            if text:
+                yield text
+        text = joiner.finish()
+        if text:
+            yield text
+
+
+class Section(models.Model):
+    """
+    A division of a title as of a version date: its heading and the text
+    directly inside it, not in a lower division. Sections hold nearly all of
+    the text; the title, chapters, parts etc. hold their headings and notes.
+    """
+
+    objects = SectionManager()
+
+    title = models.ForeignKey(
+        Title,
+        on_delete=models.CASCADE,
+        related_name="sections",
+    )
+    version_date = models.DateField()
+    ordinal = models.IntegerField(
+        help_text="Position among the divisions of the title version, as in CFRReference.node_start",
+    )
+    tag = models.CharField(max_length=10)
+    type = models.CharField(max_length=20, blank=True)
+    identifier = models.CharField(max_length=50, blank=True)
+    part = models.CharField(max_length=25, blank=True)
+    section = models.CharField(max_length=50, blank=True)
+    heading = models.TextField(blank=True)
+    text = models.ForeignKey(
+        SectionText,
+        on_delete=models.PROTECT,
+        related_name="sections",
+    )
+    depth = models.PositiveSmallIntegerField(
+        null=True,
+        help_text="Number of divisions it is nested in, 0 for the title",
+    )
+    tail = models.ForeignKey(
+        SectionText,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name="tail_sections",
+        help_text="Text of the division above it that follows it and everything below it",
+    )
+
+    class Meta:
+        unique_together = ["title", "version_date", "ordinal"]
+        indexes = [models.Index(fields=["title", "part", "section", "version_date"])]
+        ordering = ["title", "version_date", "ordinal"]
+
+    def __str__(self):
+        return f"Title {self.title_id}, {self.type} {self.identifier} ({self.version_date})"
+
+
+class TitleSnapshot(models.Model):
+    """
+    The version of a title that the snapshots of a date were computed from,
+    so later dates can tell whether the title was amended in between
+    """
+
+    title = models.ForeignKey(
+        Title,
+        on_delete=models.CASCADE,
+        related_name="snapshots",
+    )
+    date = models.DateField()
+    amended_on = models.DateField(
+        help_text="Latest amendment of the title on or before date"
+    )
+
+    class Meta:
+        unique_together = ["title", "date"]
+        ordering = ["title", "date"]
+
+    def __str__(self):
+        return f"Title {self.title_id} on {self.date} (amended {self.amended_on})"
+
+
+class ReferenceSnapshot(models.Model):
+    """
+    Word count of a CFRReference as of a date, with the span of its division
+    in that version for deduplicated rollups
+    """
+
+    reference = models.ForeignKey(
+        CFRReference,
+        on_delete=models.CASCADE,
+        related_name="snapshots",
+    )
+    date = models.DateField(db_index=True)
+    word_count = models.BigIntegerField()
+    node_start = models.IntegerField(null=True, blank=True)
+    node_end = models.IntegerField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ["reference", "date"]
+        ordering = ["reference", "date"]
+
+    def __str__(self):
+        return f"{self.reference} on {self.date}: {self.word_count}"
+
+
+class AgencySnapshot(models.Model):
+    """
+    Rolled-up word count of an agency and its sub-agencies as of a date
+    """
+
+    agency = models.ForeignKey(
+        Agency,
+        on_delete=models.CASCADE,
+        related_name="snapshots",
+    )
+    date = models.DateField()
+    word_count = models.BigIntegerField()
+
+    class Meta:
+        unique_together = ["agency", "date"]
+        ordering = ["agency", "date"]
+
+    def __str__(self):
+        return f"{self.agency} on {self.date}: {self.word_count}"
+
+
+class AgencyWordCount(models.Model):
+    """
+    Words of an agency and its sub-agencies within a title (chapter is None)
+    or within one chapter of it, precomputed by regulations/rollup.py.
+    References that span several chapters (a whole subtitle, say) count
+    under chapter "".
+    """
+
+    agency = models.ForeignKey(
+        Agency,
+        on_delete=models.CASCADE,
+        related_name="title_word_counts",
+    )
+    title = models.ForeignKey(
+        Title,
+        on_delete=models.CASCADE,
+        related_name="agency_word_counts",
+    )
+    chapter = models.CharField(max_length=25, null=True, blank=True)
+    word_count = models.BigIntegerField()
+
+    class Meta:
+        unique_together = ["agency", "title", "chapter"]
+        ordering = ["agency", "title", "chapter"]
+
+    def __str__(self):
+        where = f"Title {self.title_id}" + (
+            f", Chapter {self.chapter}" if self.chapter else ""
+        )
+        return f"{self.agency} in {where}: {self.word_count}"
+
+
+class AgencyStatistics(TextStatistics):
+    """
+    TextStatistics of an agency and its sub-agencies, summed over the distinct
+    divisions they reference, precomputed by regulations/analytics.py
+    """
+
+    agency = models.OneToOneField(
+        Agency,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="statistics",
+    )
+
+    class Meta:
+        verbose_name_plural = "agency statistics"
+
+    def __str__(self):
+        return f"{self.agency}: {self.restriction_count} restrictions"
+
+
+class ReferenceNgram(models.Model):
+    """One of the most frequent n-grams of a reference's text, stored when it is extracted"""
+
+    reference = models.ForeignKey(
+        CFRReference,
+        on_delete=models.CASCADE,
+        related_name="ngrams",
+    )
+    n = models.PositiveSmallIntegerField()
+    ngram = models.CharField(max_length=255)
+    count = models.IntegerField()
+
+    class Meta:
+        unique_together = ["reference", "n", "ngram"]
+
+    def __str__(self):
+        return f"{self.ngram} in {self.reference}: {self.count}"
+
+
+class AgencyNgram(models.Model):
+    """
+    One of the most frequent n-grams of an agency and its sub-agencies, summed
+    from the ReferenceNgrams of the distinct divisions they reference
+    """
+
+    agency = models.ForeignKey(
+        Agency,
+        on_delete=models.CASCADE,
+        related_name="ngrams",
+    )
+    n = models.PositiveSmallIntegerField()
+    ngram = models.CharField(max_length=255)
+    count = models.BigIntegerField()
+
+    class Meta:
+        unique_together = ["agency", "n", "ngram"]
+        ordering = ["agency", "n", "-count", "ngram"]
+
+    def __str__(self):
+        return f"{self.ngram} in {self.agency}: {self.count}"
+
+
+class ScrapeJob(models.Model):
+    """
+    A run of scrape_cfr_text, checkpointed per reference so that an interrupted
+    crawl can be resumed with --resume
+    """
+
+    version_date = models.DateField()
+    options = models.JSONField(default=dict, blank=True)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-started_at"]
+
+    def __str__(self):
+        return f"Scrape of {self.version_date} started {self.started_at:%Y-%m-%d %H:%M}"
+
+
+class ScrapeJobItem(models.Model):
+    """
+    Progress of one CFRReference within a ScrapeJob
+    """
+
+    class State(models.TextChoices):
+        PENDING = "pending"
+        EXTRACTED = "extracted"
+        SAVED = "saved"
+        FAILED = "failed"
+
+    job = models.ForeignKey(
+        ScrapeJob,
+        on_delete=models.CASCADE,
+        related_name="items",
+    )
+    reference = models.ForeignKey(
+        CFRReference,
+        on_delete=models.CASCADE,
+        related_name="scrape_items",
+    )
+    state = models.CharField(
+        max_length=10,
+        choices=State.choices,
+        default=State.PENDING,
+        db_index=True,
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    fetch_seconds = models.FloatField(null=True, blank=True)
+    extract_seconds = models.FloatField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ["job", "reference"]
+
+    def __str__(self):
+        return f"{self.reference} ({self.state})"
+
+
+class SearchChunk(models.Model):
+    """
+    A piece of a reference's text, indexed by regulations/search.py. Texts are
+    split so that each tsvector stays within Postgres' 1MB and 16,383 position
+    limits, and a snippet only needs its own chunk decompressed.
+    """
+
+    reference = models.ForeignKey(
+        CFRReference,
+        on_delete=models.CASCADE,
+        related_name="search_chunks",
+    )
+    ordinal = models.PositiveIntegerField()
+    text = CompressedTextField()
+    # only filled on Postgres, where migration 0013 adds its GIN index
+    vector = SearchVectorField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ["reference", "ordinal"]
+        ordering = ["reference", "ordinal"]
+
+    def __str__(self):
+        return f"{self.reference} ({self.ordinal})"
+
+
+class SearchPosting(models.Model):
+    """
+    A term of a SearchChunk, the inverted index for databases without
+    full-text search
+    """
+
+    term = models.CharField(max_length=64)
+    chunk = models.ForeignKey(
+        SearchChunk,
+        on_delete=models.CASCADE,
+        related_name="postings",
+    )
+    # denormalized so that matches group by reference without a join
+    reference = models.ForeignKey(
+        CFRReference,
+        on_delete=models.CASCADE,
+        related_name="+",
+    )
+    weight = models.FloatField(help_text="1 + ln(occurrences of the term in the chunk)")
+
+    class Meta:
+        unique_together = ["term", "chunk"]
+
+    def __str__(self):
+        return f"{self.term} in {self.chunk}"
+
+
+class DataGenerationManager(models.Manager):
+    def current(self):
+        generation = self.filter(pk=1).values_list("generation", flat=True).first()
+        return generation or 0
+
+    def bump(self):
+        """Starts a new generation, after a command changed the data the API serves"""
+        with transaction.atomic():
+            row, _ = self.select_for_update().get_or_create(pk=1)
+            row.generation = models.F("generation") + 1
+            row.save(update_fields=["generation", "updated_at"])
+            row.refresh_from_db(fields=["generation"])
+        return row.generation
+
+
+class DataGeneration(models.Model):
+    """
+    A single row counting the changes to the data the API serves, so that
+    cached responses of an older generation are never used again
+    """
+
+    generation = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = DataGenerationManager()
+
+    def __str__(self):
+        return f"Generation {self.generation} ({self.updated_at:%Y-%m-%d %H:%M})"
@@ -0,0 +1,101 @@
+"""
+Rendered API responses, cached until the data they were built from changes
+
+The data only changes when a management command runs, and every command that
+writes it calls bump_generation() when it finishes. Cached responses are keyed
+by the current generation, so a bump makes all earlier responses unreachable
+without deleting them, and they expire on their own.
+
+Responses go to Django's default cache: in-process unless REDIS_URL configures
+one shared by every worker. Commands run in their own process and cannot reach
+an in-process cache, so the generation is read again from the database every
+ECFR_GENERATION_CACHE_SECONDS; a shared cache sees a bump immediately.
+"""
+
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+
+from .models import DataGeneration
+
+GENERATION_KEY = "ecfr:generation"
+
+
+def current_generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        generation = DataGeneration.objects.current()
+        cache.set(GENERATION_KEY, generation, settings.ECFR_GENERATION_CACHE_SECONDS)
+    return generation
+
+
+def bump_generation():
+    """Makes every cached response stale, returning the new generation"""
+    generation = DataGeneration.objects.bump()
+    cache.set(GENERATION_KEY, generation, settings.ECFR_GENERATION_CACHE_SECONDS)
+    return generation
+
+
+def response_key(request, generation):
+    # the url (with ?format=) and the Accept header pick the representation
+    digest = hashlib.sha256(
+        f"{request.get_full_path()}\n{request.headers.get('Accept', '')}".encode()
+    ).hexdigest()
+    return f"ecfr:response:{generation}:{digest}"
+
+
+def etag_matches(if_none_match, etag):
+    # If-None-Match uses the weak comparison, which ignores W/
+    tags = parse_etags(if_none_match or "")
+    return "*" in tags or etag in (tag.removeprefix("W/") for tag in tags)
+
+
+class CachedResponseMixin:
+    """
+    Serves the viewset's `cached_actions` from the response cache, with a
+    strong ETag of the rendered content that If-None-Match is answered with
+    304 for. Only 200 JSON responses are cached; the browsable API renders
+    per-user pages.
+    """
+
+    cached_actions = {"list", "retrieve"}
+
+    def dispatch(self, request, *args, **kwargs):
+        action = self.action_map.get(request.method.lower())
+        if request.method not in ("GET", "HEAD") or action not in self.cached_actions:
+            return super().dispatch(request, *args, **kwargs)
+
+        key = response_key(request, current_generation())
+        entry = cache.get(key)
+        if entry is None:
+            response = super().dispatch(request, *args, **kwargs)
+            renderer = getattr(response, "accepted_renderer", None)
+            if (
+                response.status_code != 200
+                or response.streaming
+                or getattr(renderer, "format", None) != "json"
+            ):
+                return response
+            response.render()
+            entry = {
+                "content": response.content,
+                "content_type": response["Content-Type"],
+                "etag": f'"{hashlib.sha256(response.content).hexdigest()[:32]}"',
+            }
+            cache.set(key, entry, settings.ECFR_RESPONSE_CACHE_SECONDS)
+
+        if etag_matches(request.headers.get("If-None-Match"), entry["etag"]):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(
+                entry["content"], content_type=entry["content_type"]
+            )
+        response["ETag"] = entry["etag"]
+        # clients may keep the response, but have to revalidate it on every use
+        response["Cache-Control"] = "no-cache"
+        patch_vary_headers(response, ["Accept"])
+        return response
@@ -0,0 +1,255 @@
+"""
+Agency word counts that count each part of the CFR once
+
+An agency's references can overlap (Treasury lists both Title 31, Chapter II
+and Title 31, Chapter II, Subchapter A), and so can the references of an agency
+and its sub-agencies. Each agency's references are first reduced to the
+outermost divisions they cover, and only those are summed.
+
+Nesting is decided with the (node_start, node_end) span stored at extraction:
+divisions are numbered in document order, so a division contains exactly the
+divisions numbered from its own position to its last descendant's. References
+extracted before spans were stored fall back to comparing their
+subtitle/chapter/subchapter/part/subpart/section path.
+
+The same distinct divisions, grouped by title and chapter, make up the
+AgencyWordCount matrix served by /api/word-counts/. A division whose reference
+does not name its chapter is placed by span too, in the chapter of a
+reference or a stored Section that contains it.
+"""
+
+from collections import defaultdict, namedtuple
+
+from django.db import transaction
+from django.db.models import F, Max
+
+from .extraction import HIERARCHY
+from .models import Agency, AgencyWordCount, CFRReference, Section
+
+PATH_FIELDS = [ref_attr for _, _, ref_attr in HIERARCHY[1:]]
+
+# reference_id is None for nodes of ReferenceSnapshots
+Node = namedtuple(
+    "Node", ["title_id", "path", "span", "word_count", "reference_id"], defaults=[None]
+)
+
+
+def reference_node(values):
+    """Builds a Node from a CFRReference values() row"""
+    span = None
+    if values["node_start"] is not None and values["node_end"] is not None:
+        span = (values["node_start"], values["node_end"])
+    path = tuple((values[field] or "").strip() for field in PATH_FIELDS)
+    return Node(
+        values["title_id"],
+        path,
+        span,
+        values["word_count"] or 0,
+        values.get("reference_id"),
+    )
+
+
+def path_covers(outer, inner):
+    """Whether every level the outer path specifies is specified the same way by the inner one"""
+    return all(not value or value == other for value, other in zip(outer, inner))
+
+
+def covers(outer, inner):
+    """Whether the division of `outer` contains (or is) the division of `inner`"""
+    if outer.title_id != inner.title_id:
+        return False
+    if outer.span and inner.span:
+        return outer.span[0] <= inner.span[0] and inner.span[1] <= outer.span[1]
+    return path_covers(outer.path, inner.path)
+
+
+def distinct_nodes(nodes):
+    """Returns the nodes that are not inside another one, keeping one of any duplicates"""
+    by_title = defaultdict(list)
+    for node in nodes:
+        by_title[node.title_id].append(node)
+
+    kept = []
+    for title_nodes in by_title.values():
+        spanned = sorted(
+            (node for node in title_nodes if node.span),
+            key=lambda node: (node.span[0], -node.span[1]),
+        )
+        unspanned = sorted(
+            (node for node in title_nodes if not node.span),
+            key=lambda node: sum(1 for value in node.path if value),
+        )
+
+        # sorted by start with the widest first, a span is nested exactly when
+        # it starts before the last kept one ends
+        outer = []
+        for node in spanned:
+            if not outer or node.span[0] > outer[-1].span[1]:
+                outer.append(node)
+
+        # references without a span, most general first
+        for node in unspanned:
+            if not any(covers(other, node) for other in outer):
+                outer = [other for other in outer if not covers(node, other)]
+                outer.append(node)
+
+        kept.extend(outer)
+    return kept
+
+
+def reference_values():
+    """The values() of the current references that reference_node reads"""
+    return CFRReference.objects.values(
+        "agency_id",
+        "title_id",
+        "node_start",
+        "node_end",
+        "word_count",
+        *PATH_FIELDS,
+        reference_id=F("id"),
+    )
+
+
+def snapshot_values(snapshots):
+    """The values() of ReferenceSnapshots that reference_node reads"""
+    return snapshots.values(
+        "node_start",
+        "node_end",
+        "word_count",
+        agency_id=F("reference__agency_id"),
+        title_id=F("reference__title_id"),
+        **{field: F(f"reference__{field}") for field in PATH_FIELDS},
+    )
+
+
+def rollup_nodes(values=None):
+    """
+    Returns {agency id: distinct nodes} for every agency, over the references
+    of the agency and all of its descendants.
+
+    `values` are the rows to count, reference_values() by default.
+    """
+    nodes_by_agency = defaultdict(list)
+    if values is None:
+        values = reference_values()
+    for row in values.iterator():
+        nodes_by_agency[row["agency_id"]].append(reference_node(row))
+
+    subtree = defaultdict(list)
+    for ancestor_id, descendant_id in Agency.objects.tree_pairs():
+        subtree[ancestor_id].extend(nodes_by_agency.get(descendant_id, ()))
+    return {agency_id: distinct_nodes(nodes) for agency_id, nodes in subtree.items()}
+
+
+def rollup_word_counts(values=None, nodes=None):
+    """
+    Returns {agency id: words} for every agency, counting the distinct
+    divisions referenced by the agency and all of its descendants.
+    """
+    if nodes is None:
+        nodes = rollup_nodes(values)
+    return {
+        agency_id: sum(node.word_count for node in agency_nodes)
+        for agency_id, agency_nodes in nodes.items()
+    }
+
+
+def chapter_spans():
+    """
+    {title id: [(span, chapter)]} of the spans known to be within a chapter:
+    those of the current references that name one, and the chapters of the
+    Section versions that references are assembled from
+    """
+    spans = defaultdict(list)
+    references = CFRReference.objects.filter(
+        node_start__isnull=False, node_end__isnull=False, chapter__gt=""
+    ).values_list("title_id", "node_start", "node_end", "chapter")
+    for title_id, start, end, chapter in references.iterator():
+        spans[title_id].append(((start, end), chapter.strip()))
+
+    level = next(
+        i for i, (_, _, ref_attr) in enumerate(HIERARCHY) if ref_attr == "chapter"
+    )
+    div_tags = [div_tag for div_tag, _, _ in HIERARCHY[: level + 1]]
+    versions = (
+        CFRReference.objects.filter(sections_version__isnull=False)
+        .values_list("title_id", "sections_version")
+        .distinct()
+    )
+    for title_id, version in versions:
+        sections = Section.objects.filter(title_id=title_id, version_date=version)
+        end = sections.aggregate(end=Max("ordinal"))["end"]
+        # a chapter ends before the next division at its level or above
+        divisions = list(
+            sections.filter(tag__in=div_tags)
+            .order_by("ordinal")
+            .values_list("ordinal", "tag", "identifier")
+        )
+        for ordinal, div_tag, identifier in reversed(divisions):
+            if div_tag == div_tags[-1]:
+                spans[title_id].append(((ordinal, end), identifier))
+            end = ordinal - 1
+    return spans
+
+
+def rollup_word_count_matrix(values=None, nodes=None, chapters=None):
+    """
+    Returns {(agency id, title id, chapter): words}, where a chapter of None
+    is the whole title and "" collects divisions that are not within a
+    single chapter. Divisions are placed in the chapter their reference names,
+    or else in the one of `chapters` (chapter_spans() by default) whose span
+    contains theirs.
+    """
+    if nodes is None:
+        nodes = rollup_nodes(values)
+    if chapters is None:
+        chapters = chapter_spans()
+    chapter = PATH_FIELDS.index("chapter")
+
+    def node_chapter(node):
+        if node.path[chapter] or not node.span:
+            return node.path[chapter]
+        for (start, end), name in chapters.get(node.title_id, ()):
+            if start <= node.span[0] and node.span[1] <= end:
+                return name
+        return ""
+
+    matrix = defaultdict(int)
+    for agency_id, agency_nodes in nodes.items():
+        for node in agency_nodes:
+            matrix[agency_id, node.title_id, None] += node.word_count
+            matrix[agency_id, node.title_id, node_chapter(node)] += node.word_count
+    return matrix
+
+
+def store_word_count_matrix(matrix, batch_size=500):
+    """Replaces every AgencyWordCount with the cells of the matrix"""
+    with transaction.atomic():
+        AgencyWordCount.objects.all().delete()
+        AgencyWordCount.objects.bulk_create(
+            (
+                AgencyWordCount(
+                    agency_id=agency_id,
+                    title_id=title_id,
+                    chapter=chapter,
+                    word_count=words,
+                )
+                for (agency_id, title_id, chapter), words in matrix.items()
+            ),
+            batch_size=batch_size,
+        )
+
+
+def update_word_counts(batch_size=500):
+    """Stores rollup_word_counts() in Agency.cfr_word_count, and the matrix in AgencyWordCount"""
+    nodes = rollup_nodes()
+    totals = rollup_word_counts(nodes=nodes)
+    agencies = [Agency(pk=pk, cfr_word_count=words) for pk, words in totals.items()]
+    Agency.objects.bulk_update(agencies, ["cfr_word_count"], batch_size=batch_size)
+    store_word_count_matrix(rollup_word_count_matrix(nodes=nodes), batch_size)
+    return totals
+
+
+def update_word_count_matrix(batch_size=500):
+    """Refreshes AgencyWordCount alone, leaving Agency.cfr_word_count as it is"""
+    store_word_count_matrix(rollup_word_count_matrix(), batch_size)
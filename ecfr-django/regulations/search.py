@@ -0,0 +1,282 @@
+"""
+Full-text search over reference text
+
+Each reference's text is split into SearchChunks when it is written. On
+Postgres every chunk has a tsvector with a GIN index, matched with
+websearch_to_tsquery and ranked with ts_rank. Elsewhere (or with
+ECFR_SEARCH_BACKEND="postings") chunks are indexed into SearchPosting rows,
+one per stemmed term, and ranked by the sum of the terms' weights times their
+inverse document frequency. That index requires every term but not their
+order, so "quoted phrases" match their words anywhere in the reference.
+
+Either way a query only reads the index and the chunks of the references it
+returns, never the reference text.
+"""
+
+import math
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection, transaction
+from django.db.models import (
+    Case,
+    Count,
+    F,
+    FloatField,
+    Max,
+    Sum,
+    TextField,
+    Value,
+    When,
+)
+from django.utils.html import escape
+
+from .extraction import STOP_WORDS
+from .fields import CHUNK_SIZE
+from .models import CFRReference, SearchChunk, SearchPosting
+
+WORD = re.compile(r"\w+")
+# suffixes removed by stem(), longest first
+SUFFIXES = ("ations", "ation", "ings", "ing", "ies", "ied", "es", "ed", "s", "y")
+SNIPPET_CHARS = 240
+
+
+def use_postgres():
+    backend = settings.ECFR_SEARCH_BACKEND
+    if backend == "auto":
+        return connection.vendor == "postgresql"
+    return backend == "postgres"
+
+
+def stem(word):
+    """A light suffix stripper, so that e.g. "regulation" and "regulations" index alike"""
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[: -len(suffix)]
+    return word
+
+
+def tokenize(text):
+    """The stemmed, lowercased terms of `text`, without stop words"""
+    return [
+        stem(word)
+        for word in WORD.findall(text.lower())
+        if word not in STOP_WORDS and len(word) <= 64
+    ]
+
+
+def query_terms(q):
+    """Terms of a websearch-style query that results have to contain (not -excluded or OR)"""
+    words = []
+    for token in q.replace('"', " ").split():
+        if token.startswith("-") or token.lower() == "or":
+            continue
+        words.append(token)
+    return list(dict.fromkeys(tokenize(" ".join(words))))
+
+
+def split_chunks(text, size=CHUNK_SIZE):
+    """Splits text into pieces of about `size` characters, at whitespace"""
+    start = 0
+    while start < len(text):
+        end = start + size
+        if end < len(text):
+            # back up to the last line or word break, unless there is none
+            cut = max(text.rfind("\n", start, end), text.rfind(" ", start, end))
+            if cut > start:
+                end = cut + 1
+        yield text[start:end]
+        start = end
+
+
+def index_references(texts):
+    """
+    Replaces the indexed chunks of each (reference, text) with those of the
+    text, in bulk: one delete, one insert of the chunks (with their tsvectors
+    on Postgres) and elsewhere one insert of their postings
+    """
+    texts = list(texts)
+    postgres = use_postgres()
+    chunks = [
+        SearchChunk(
+            reference=reference,
+            ordinal=i,
+            text=chunk,
+            vector=(
+                SearchVector(
+                    Value(chunk, output_field=TextField()),
+                    config=settings.ECFR_SEARCH_CONFIG,
+                )
+                if postgres
+                else None
+            ),
+        )
+        for reference, text in texts
+        for i, chunk in enumerate(split_chunks(text or ""))
+    ]
+    with transaction.atomic():
+        SearchChunk.objects.filter(
+            reference__in=[reference for reference, _ in texts]
+        ).delete()
+        SearchChunk.objects.bulk_create(chunks, batch_size=100)
+        if not postgres:
+            SearchPosting.objects.bulk_create(
+                (
+                    SearchPosting(
+                        term=term,
+                        chunk=chunk,
+                        reference_id=chunk.reference_id,
+                        weight=1 + math.log(occurrences),
+                    )
+                    for chunk in chunks
+                    for term, occurrences in Counter(tokenize(chunk.text)).items()
+                ),
+                batch_size=1000,
+            )
+    return len(chunks)
+
+
+def index_reference(reference, text):
+    """Replaces the indexed chunks of the reference with those of `text`"""
+    return index_references([(reference, text)])
+
+
+def search_query(q):
+    return SearchQuery(q, search_type="websearch", config=settings.ECFR_SEARCH_CONFIG)
+
+
+def term_weights(terms):
+    """{term: inverse document frequency} over the indexed chunks"""
+    chunks = SearchChunk.objects.count()
+    frequencies = dict(
+        SearchPosting.objects.filter(term__in=terms)
+        .values("term")
+        .annotate(chunks=Count("chunk_id"))
+        .values_list("term", "chunks")
+    )
+    return {term: math.log(1 + chunks / frequencies.get(term, 1)) for term in terms}
+
+
+def ranked_references(q, references=None):
+    """
+    values() rows of (reference_id, rank) for the references matching q,
+    best first, optionally limited to the `references` queryset
+    """
+    if use_postgres():
+        query = search_query(q)
+        matches = (
+            SearchChunk.objects.filter(vector=query)
+            .values("reference_id")
+            .annotate(rank=Max(SearchRank(F("vector"), query)))
+        )
+    else:
+        terms = query_terms(q)
+        if not terms:
+            return SearchPosting.objects.none().values("reference_id")
+        weight = Case(
+            *(
+                When(term=term, then=Value(idf))
+                for term, idf in term_weights(terms).items()
+            ),
+            default=Value(0.0),
+            output_field=FloatField(),
+        )
+        # every term has to occur somewhere in the reference
+        matches = (
+            SearchPosting.objects.filter(term__in=terms)
+            .values("reference_id")
+            .annotate(
+                rank=Sum(F("weight") * weight), terms=Count("term", distinct=True)
+            )
+            .filter(terms=len(terms))
+        )
+    if references is not None:
+        matches = matches.filter(reference_id__in=references.values("id"))
+    return matches.order_by("-rank", "reference_id")
+
+
+def best_chunks(q, reference_ids):
+    """{reference id: the SearchChunk of the reference that matches q best}"""
+    if use_postgres():
+        query = search_query(q)
+        chunks = (
+            SearchChunk.objects.filter(reference_id__in=reference_ids, vector=query)
+            .defer("vector")
+            .annotate(rank=SearchRank(F("vector"), query))
+            .order_by("reference_id", "-rank")
+            .distinct("reference_id")
+        )
+        return {chunk.reference_id: chunk for chunk in chunks}
+
+    best = {}
+    scores = (
+        SearchPosting.objects.filter(
+            reference_id__in=reference_ids, term__in=query_terms(q)
+        )
+        .values("reference_id", "chunk_id")
+        .annotate(score=Sum("weight"))
+        .order_by("reference_id", "-score", "chunk_id")
+    )
+    for row in scores:
+        best.setdefault(row["reference_id"], row["chunk_id"])
+    chunks = SearchChunk.objects.in_bulk(list(best.values()))
+    return {reference_id: chunks[chunk_id] for reference_id, chunk_id in best.items()}
+
+
+def snippet(text, terms, length=SNIPPET_CHARS):
+    """
+    HTML-escaped text around the first match of any of the (stemmed) terms,
+    with the matching words wrapped in <mark>
+    """
+    text = " ".join(text.split())
+    if not terms:
+        return escape(text[:length])
+    pattern = re.compile(
+        r"\b(?:" + "|".join(re.escape(term) for term in terms) + r")\w*", re.IGNORECASE
+    )
+    match = pattern.search(text)
+    start = max(match.start() - length // 3, 0) if match else 0
+    if start:
+        # start at a word
+        start = text.find(" ", start) + 1 or start
+    window = text[start : start + length]
+
+    parts = []
+    position = 0
+    for match in pattern.finditer(window):
+        parts.append(escape(window[position : match.start()]))
+        parts.append(f"<mark>{escape(match.group())}</mark>")
+        position = match.end()
+    parts.append(escape(window[position:]))
+    prefix = "…" if start else ""
+    suffix = "…" if start + length < len(text) else ""
+    return prefix + "".join(parts) + suffix
+
+
+def facets(matches):
+    """Counts of the matching references by title and by agency"""
+    references = CFRReference.objects.filter(id__in=matches.values("reference_id"))
+    return {
+        "titles": [
+            {
+                "number": row["title_id"],
+                "name": row["title__name"],
+                "count": row["count"],
+            }
+            for row in references.values("title_id", "title__name")
+            .annotate(count=Count("id"))
+            .order_by("-count", "title_id")
+        ],
+        "agencies": [
+            {
+                "slug": row["agency__slug"],
+                "name": row["agency__name"],
+                "count": row["count"],
+            }
+            for row in references.values("agency__slug", "agency__name")
+            .annotate(count=Count("id"))
+            .order_by("-count", "agency__name")
+        ],
+    }
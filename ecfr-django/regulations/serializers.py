@@ -1,5 +1,6 @@
 from rest_framework import serializers
-from .models import Agency, Title
+
+from .models import Agency, CFRReference, Title
 
 
 class AgencyNameSerializer(serializers.ModelSerializer):
@@ -25,3 +26,32 @@ class TitleSerializer(serializers.ModelSerializer):
             "up_to_date_as_of",
             "reserved",
         ]
+
+
+class CFRReferenceSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CFRReference
+        fields = [
+            "id",
+            "agency",
+            "title",
+            "subtitle",
+            "chapter",
+            "subchapter",
+            "part",
+            "subpart",
+            "section",
+            "word_count",
+            "character_count",
+            "paragraph_count",
+            "sentence_count",
+            "section_count",
+            "restriction_count",
+            "shall_count",
+            "must_count",
+            "may_not_count",
+            "required_count",
+            "prohibited_count",
+            "content_hash",
+            "last_updated",
+        ]
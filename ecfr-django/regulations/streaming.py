@@ -0,0 +1,140 @@
+"""
+JSON written to the response as it is produced, for payloads too large to build in memory
+"""
+
+import base64
+import json
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Content-Encodings that iter_encoded can produce, in order of preference
+ENCODINGS = ["br", "gzip"] if brotli else ["gzip"]
+
+
+def dumps(value):
+    # the same encoding as DRF's JSONRenderer with UNICODE_JSON
+    return json.dumps(value, ensure_ascii=False, default=str)
+
+
+def iter_json_string(chunks):
+    """Yields a JSON string literal of the concatenated text chunks, one chunk at a time"""
+    yield '"'
+    for chunk in chunks:
+        # escaping is per character, so escaped chunks can simply be concatenated
+        yield dumps(chunk)[1:-1]
+    yield '"'
+
+
+def iter_json_object(values, streamed=()):
+    """
+    Yields a JSON object of `values`, followed by the (key, chunks or None)
+    pairs of `streamed`, whose text is written as it is read
+    """
+    head = dumps(values)
+    if not streamed:
+        yield head
+        return
+    yield head[:-1]
+    for i, (key, chunks) in enumerate(streamed):
+        yield f"{', ' if values or i else ''}{dumps(key)}: "
+        if chunks is None:
+            yield "null"
+        else:
+            yield from iter_json_string(chunks)
+    yield "}"
+
+
+async def aiter_json_object(values, streamed=()):
+    """iter_json_object for async views, whose streamed chunks are async iterables"""
+    head = dumps(values)
+    if not streamed:
+        yield head
+        return
+    yield head[:-1]
+    for i, (key, chunks) in enumerate(streamed):
+        yield f"{', ' if values or i else ''}{dumps(key)}: "
+        if chunks is None:
+            yield "null"
+        else:
+            yield '"'
+            async for chunk in chunks:
+                yield dumps(chunk)[1:-1]
+            yield '"'
+    yield "}"
+
+
+async def achain(*iterables):
+    """itertools.chain over iterables and async iterables alike"""
+    for iterable in iterables:
+        if hasattr(iterable, "__aiter__"):
+            async for item in iterable:
+                yield item
+        else:
+            for item in iterable:
+                yield item
+
+
+def encode_cursor(position):
+    return base64.urlsafe_b64encode(dumps(position).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Returns the position encoded by encode_cursor, or raises ValueError"""
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, UnicodeError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def iter_utf8(chunks):
+    for chunk in chunks:
+        yield chunk.encode()
+
+
+def iter_byte_range(chunks, start, end):
+    """Yields bytes start through end (inclusive) of the concatenated byte chunks"""
+    position = 0
+    for chunk in chunks:
+        chunk_end = position + len(chunk)
+        if chunk_end > start:
+            yield chunk[max(start - position, 0) : end + 1 - position]
+        position = chunk_end
+        if position > end:
+            return
+
+
+def iter_encoded(chunks, encoding):
+    """Compresses byte chunks on the fly with a Content-Encoding from ENCODINGS"""
+    if encoding == "br":
+        compressor = brotli.Compressor()
+        compress, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+        compress, finish = compressor.compress, compressor.flush
+    for chunk in chunks:
+        compressed = compress(chunk)
+        if compressed:
+            yield compressed
+    yield finish()
+
+
+def negotiate_encoding(accept_encoding):
+    """Returns the preferred encoding in ENCODINGS that an Accept-Encoding header allows, or None"""
+    accepted = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    for encoding in ENCODINGS:
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
@@ -0,0 +1,560 @@
+import hashlib
+import io
+import json
+import os
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core import serializers
+from django.core.cache import cache
+from django.db import DatabaseError
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPResponse
+
+from regulations.diff import diff_references, diff_title
+from regulations.extraction import (
+    DivisionIndex,
+    ReferenceSpec,
+    stream_divisions,
+    stream_extract,
+    top_ngrams,
+)
+from regulations.fetch import ECFRSession, map_bounded
+from regulations.http_cache import OfflineCacheMiss, ResponseCache
+from regulations.models import Agency, CFRReference, Section, Title
+from regulations.rollup import rollup_word_count_matrix
+from regulations.search import index_references, ranked_references, split_chunks
+from regulations.writer import BulkWriter
+
+# what the versioner API returns for a ?part= request: the part, without the
+# title and chapter around it
+PART_XML = """<DIV5 N="202" TYPE="PART"><HEAD>PART 202—DEPOSITARIES</HEAD>
+<DIV6 N="A" TYPE="SUBPART"><HEAD>Subpart A—General</HEAD>
+<DIV8 N="202.1" TYPE="SECTION"><HEAD>§ 202.1 Scope.</HEAD><P>Depositaries may not refuse.</P></DIV8>
+</DIV6>
+<DIV8 N="202.2" TYPE="SECTION"><HEAD>§ 202.2 Terms.</HEAD><P>Terms apply.</P></DIV8>
+</DIV5>"""
+
+
+# a title whose part has a note after its sections, which stored sections
+# keep as the tail of the last one
+TITLE_XML = """<DIV1 N="31" TYPE="TITLE"><HEAD>Title 31—Money and Finance: Treasury</HEAD>
+<DIV3 N="II" TYPE="CHAPTER"><HEAD>CHAPTER II—FISCAL SERVICE</HEAD>
+<DIV5 N="202" TYPE="PART"><HEAD>PART 202—DEPOSITARIES</HEAD>
+<DIV8 N="202.1" TYPE="SECTION"><HEAD>§ 202.1 Scope.</HEAD><P>Depositaries may not refuse.</P></DIV8>
+<P>Editorial note: this part follows its sections.</P>
+</DIV5>
+</DIV3>
+</DIV1>"""
+
+# a reference to the whole of Title 31, narrowed with _replace()
+TITLE_31 = ReferenceSpec(31, None, None, None, None, None, "")
+
+
+class PartDocumentTests(SimpleTestCase):
+    def extract(self, ref):
+        return DivisionIndex(ET.fromstring(PART_XML)).extract(ref)
+
+    def test_part(self):
+        ref = TITLE_31._replace(part="202")
+        extraction = self.extract(ref)
+        self.assertEqual(
+            extraction, stream_extract(io.BytesIO(PART_XML.encode()), [ref])[0]
+        )
+        self.assertIn("Depositaries may not refuse.", extraction.text)
+        self.assertIn("Terms apply.", extraction.text)
+        # positions are only meaningful within a whole title
+        self.assertIsNone(extraction.span)
+
+    def test_part_of_chapter(self):
+        # the chapter is not in the document, so it cannot rule the part out
+        extraction = self.extract(TITLE_31._replace(chapter="II", part="202"))
+        self.assertTrue(extraction.text.startswith("PART 202—DEPOSITARIES"))
+
+    def test_section(self):
+        extraction = self.extract(
+            TITLE_31._replace(chapter="II", part="202", section="202.2")
+        )
+        self.assertEqual(extraction.text, "§ 202.2 Terms.\nTerms apply.")
+
+    def test_other_part(self):
+        self.assertEqual(self.extract(TITLE_31._replace(part="203")).text, "")
+
+    def test_stream(self):
+        refs = [
+            TITLE_31._replace(part="202"),
+            TITLE_31._replace(chapter="II", part="202"),
+            TITLE_31._replace(chapter="II", part="202", section="202.1"),
+            TITLE_31._replace(part="203"),
+        ]
+        self.assertEqual(
+            stream_extract(io.BytesIO(PART_XML.encode()), refs),
+            [self.extract(ref) for ref in refs],
+        )
+
+
+class NgramTests(SimpleTestCase):
+    def test_top_ngrams(self):
+        ngrams = top_ngrams(
+            "The Agency shall report.\n(a) The agency SHALL report it.", limit=2
+        )
+        # stop words and labels are left out, and n-grams run across them
+        self.assertEqual(ngrams[1], [("agency", 2), ("shall", 2)])
+        self.assertEqual(ngrams[2], [("agency shall", 2), ("shall report", 2)])
+        self.assertEqual(
+            ngrams[3], [("agency shall report", 2), ("shall report agency", 1)]
+        )
+
+
+def create_agency(slug):
+    return Agency.objects.create(
+        name=slug, display_name=slug, sortable_name=slug, slug=slug
+    )
+
+
+class SectionsTextTests(TestCase):
+    def setUp(self):
+        agency = Agency.objects.create(
+            name="Fiscal Service",
+            display_name="Fiscal Service",
+            sortable_name="Fiscal Service",
+            slug="fiscal-service",
+        )
+        title = Title.objects.create(number=31, name="Money and Finance: Treasury")
+        self.ref = CFRReference.objects.create(agency=agency, title=title, chapter="II")
+
+    def store(self, xml):
+        """Stores the sections of xml and the reference's text in them, returning the text"""
+        ref = self.ref
+        (extraction,) = stream_extract(io.BytesIO(xml.encode()), [ref])
+        Section.objects.store(
+            31, "2025-02-06", stream_divisions(io.BytesIO(xml.encode()))
+        )
+        fields = ref.set_full_text(extraction.text, extraction.span, "2025-02-06")
+        CFRReference.objects.filter(pk=ref.pk).update(
+            **{field: getattr(ref, field) for field in fields}
+        )
+        return extraction.text
+
+    def test_stored_text_matches_hash(self):
+        ref = self.ref
+        # the editorial note of part 202 follows its section
+        text = self.store(TITLE_XML)
+        self.assertIn("Editorial note", text.split("§ 202.1")[-1])
+        ref.refresh_from_db()
+        self.assertEqual(ref.get_full_text(), text)
+        self.assertEqual("".join(ref.iter_full_text()), text)
+        self.assertEqual(ref.content_hash, hashlib.sha256(text.encode()).hexdigest())
+        self.assertEqual(ref.word_count, len(text.split()))
+        self.assertEqual(ref.byte_count, len(text.encode()))
+
+    def test_text_range_and_etag(self):
+        text = self.store(TITLE_XML).encode()
+        url = f"/api/reference/{self.ref.pk}/text/"
+        response = self.client.get(url, HTTP_RANGE="bytes=-10")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b"".join(response.streaming_content), text[-10:])
+        self.assertEqual(
+            response["Content-Range"],
+            f"bytes {len(text) - 10}-{len(text) - 1}/{len(text)}",
+        )
+        etag = response["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # sections of the same version stored again serve other bytes, under another ETag
+        amended = TITLE_XML.replace("may not refuse", "must not refuse")
+        Section.objects.store(
+            31, "2025-02-06", stream_divisions(io.BytesIO(amended.encode()))
+        )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+
+class SectionStoreTests(TestCase):
+    def store(self, xml):
+        return Section.objects.store(
+            31, "2025-02-06", stream_divisions(io.BytesIO(xml.encode()))
+        )
+
+    def stored(self):
+        return list(
+            Section.objects.order_by("ordinal").values_list(
+                "ordinal", "identifier", "text_id"
+            )
+        )
+
+    def test_insert_only_moves_later_rows(self):
+        Title.objects.create(number=31, name="Money and Finance: Treasury")
+        self.assertEqual(self.store(TITLE_XML), (4, 0, 0, 0))
+        before = self.stored()
+
+        inserted = TITLE_XML.replace(
+            "<DIV5",
+            '<DIV5 N="201" TYPE="PART"><HEAD>PART 201—NEW</HEAD><P>New.</P></DIV5><DIV5',
+            1,
+        )
+        # the new part comes before part 202 and its section, which only move
+        self.assertEqual(self.store(inserted), (1, 0, 2, 0))
+        after = self.stored()
+        self.assertEqual(len(after), 5)
+        self.assertEqual(
+            [row[1:] for row in after[3:]], [row[1:] for row in before[2:]]
+        )
+        self.assertEqual([row[0] for row in after], list(range(5)))
+
+        # and back, without colliding ordinals
+        self.assertEqual(self.store(TITLE_XML), (0, 0, 2, 1))
+        self.assertEqual(self.stored(), before)
+
+
+class WordCountMatrixTests(TestCase):
+    def setUp(self):
+        self.title = Title.objects.create(number=31, name="Money and Finance: Treasury")
+
+    def agency(self, slug):
+        return Agency.objects.create(
+            name=slug, display_name=slug, sortable_name=slug, slug=slug
+        )
+
+    def test_part_in_referenced_chapter(self):
+        chapter = self.agency("monetary-offices")
+        part = self.agency("mint")
+        CFRReference.objects.create(
+            agency=chapter,
+            title=self.title,
+            chapter="I",
+            node_start=1,
+            node_end=5,
+            word_count=30,
+        )
+        CFRReference.objects.create(
+            agency=part,
+            title=self.title,
+            part="50",
+            node_start=3,
+            node_end=4,
+            word_count=10,
+        )
+        matrix = rollup_word_count_matrix()
+        self.assertEqual(matrix[part.pk, 31, "I"], 10)
+        self.assertNotIn((part.pk, 31, ""), matrix)
+
+    def test_part_in_stored_chapter(self):
+        part = self.agency("fiscal-service")
+        divisions = list(stream_divisions(io.BytesIO(TITLE_XML.encode())))
+        Section.objects.store(31, "2025-02-06", divisions)
+        ref = CFRReference.objects.create(agency=part, title=self.title, part="202")
+        (extraction,) = stream_extract(io.BytesIO(TITLE_XML.encode()), [ref])
+        fields = ref.set_full_text(extraction.text, extraction.span, "2025-02-06")
+        ref.save(update_fields=fields)
+        matrix = rollup_word_count_matrix()
+        self.assertEqual(matrix[part.pk, 31, "II"], ref.word_count)
+
+
+class SectionDiffTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.title = Title.objects.create(number=31, name="Money and Finance: Treasury")
+        Section.objects.store(
+            31, "2025-01-01", stream_divisions(io.BytesIO(TITLE_XML.encode()))
+        )
+
+    def test_changed_section_and_tail(self):
+        amended = TITLE_XML.replace("may not refuse", "must not refuse").replace(
+            "follows its sections", "follows every section"
+        )
+        Section.objects.store(
+            31, "2025-02-06", stream_divisions(io.BytesIO(amended.encode()))
+        )
+        diff = diff_title(
+            31, "2025-01-31", "2025-03-01", [TITLE_31._replace(part="202")]
+        )
+        # the part is unchanged, the note is the tail of the section it follows
+        self.assertEqual(diff["unchanged"], 1)
+        (change,) = diff["changes"]
+        self.assertEqual(
+            (change["change"], change["identifier"]), ("modified", "202.1")
+        )
+        self.assertEqual(
+            [(run["removed"], run["added"]) for run in change["diff"]],
+            [("may", "must"), ("its sections.", "every section.")],
+        )
+
+    def test_unavailable_titles(self):
+        Title.objects.create(number=32, name="National Defense")
+        agency = create_agency("fiscal-service")
+        CFRReference.objects.create(agency=agency, title=self.title, part="202")
+        CFRReference.objects.create(agency=agency, title_id=32, part="1")
+
+        titles, unavailable = diff_references(
+            CFRReference.objects.all(), "2025-01-01", "2025-03-01"
+        )
+        self.assertEqual([title["title"] for title in titles], [31])
+        self.assertEqual(unavailable, [32])
+
+        response = self.client.get(
+            "/api/agency/fiscal-service/diff/?from=2025-01-01&to=2025-03-01"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["unavailable_titles"], [32])
+        # a single title without sections is still not found
+        response = self.client.get("/api/title/32/diff/?from=2025-01-01&to=2025-03-01")
+        self.assertEqual(response.status_code, 404)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.title = Title.objects.create(number=31, name="Money and Finance: Treasury")
+        self.agency = create_agency("fiscal-service")
+
+    def reference(self, text, **fields):
+        ref = CFRReference.objects.create(
+            agency=self.agency, title=self.title, **fields
+        )
+        index_references([(ref, text)])
+        return ref
+
+    def test_split_chunks(self):
+        text = "word " * 30 + "\n" + "x" * 40
+        chunks = list(split_chunks(text, size=32))
+        self.assertEqual("".join(chunks), text)
+        self.assertTrue(all(len(chunk) <= 32 for chunk in chunks))
+        # cut after a word, unless a word is longer than a chunk
+        self.assertTrue(all(chunk.endswith((" ", "\n")) for chunk in chunks[:-2]))
+
+    def test_ranking(self):
+        once = self.reference("Depositaries must report.", part="202")
+        often = self.reference(
+            "Depositaries report. Reports of depositaries are reporting.", part="203"
+        )
+        self.reference("Nothing relevant here.", part="204")
+        ranked = ranked_references("depositary reports")
+        self.assertEqual([row["reference_id"] for row in ranked], [often.pk, once.pk])
+        # every term has to match
+        self.assertFalse(ranked_references("depositaries relevant").exists())
+
+    def test_search_api(self):
+        ref = self.reference("Terms shall apply to <depositaries>.", part="202")
+        response = self.client.get("/api/search/?q=depositaries")
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["count"], 1)
+        (result,) = data["results"]
+        self.assertEqual(result["reference"], ref.pk)
+        self.assertIn("&lt;<mark>depositaries</mark>&gt;", result["snippet"])
+        self.assertEqual(data["facets"]["titles"][0]["count"], 1)
+        self.assertEqual(self.client.get("/api/search/").status_code, 400)
+
+
+class ReferenceListingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        agency = create_agency("fiscal-service")
+        for number in (32, 31):
+            title = Title.objects.create(number=number, name=f"Title {number}")
+            for chapter in ("II", None, "I"):
+                CFRReference.objects.create(
+                    agency=agency, title=title, chapter=chapter, word_count=number
+                )
+        self.url = "/api/agency/fiscal-service/references/"
+
+    def get(self, url):
+        response = self.client.get(url)
+        if response.streaming:
+            return response.status_code, json.loads(
+                b"".join(response.streaming_content)
+            )
+        return response.status_code, response.json()
+
+    def test_cursor_pages(self):
+        expected = list(
+            CFRReference.objects.order_by("title_id", "chapter", "id").values_list(
+                "title_id", "chapter"
+            )
+        )
+        # no chapter sorts first, as ""
+        expected.sort(key=lambda ref: (ref[0], ref[1] or ""))
+        listed = []
+        url = f"{self.url}?page_size=4&fields=id,chapter"
+        while url:
+            status, page = self.get(url)
+            self.assertEqual(status, 200)
+            self.assertLessEqual(len(page["references"]), 4)
+            for ref in page["references"]:
+                self.assertEqual(set(ref), {"id", "chapter"})
+            listed += page["references"]
+            url = page["next"]
+        self.assertEqual(
+            [
+                (CFRReference.objects.get(pk=ref["id"]).title_id, ref["chapter"])
+                for ref in listed
+            ],
+            expected,
+        )
+
+    def test_invalid_params(self):
+        status, data = self.get(f"{self.url}?fields=id,secret")
+        self.assertEqual((status, data["error"]), (400, "Unknown fields: secret"))
+        status, data = self.get(f"{self.url}?cursor=not-a-cursor")
+        self.assertEqual((status, data["error"]), (400, "Invalid cursor"))
+
+
+class FakeAdapter(HTTPAdapter):
+    """Answers each request with the next (status, headers, body) of `responses`"""
+
+    def __init__(self, responses):
+        super().__init__()
+        self.responses = list(responses)
+        self.requests = []
+
+    def send(self, request, **kwargs):
+        self.requests.append(request)
+        status, headers, body = self.responses.pop(0)
+        raw = HTTPResponse(
+            body=io.BytesIO(body), headers=headers, status=status, preload_content=False
+        )
+        return self.build_response(request, raw)
+
+
+class ResponseCacheTests(SimpleTestCase):
+    url = "https://www.ecfr.gov/api/versioner/v1/full/2025-02-06/title-31.xml"
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        self.cache = ResponseCache(self.root)
+
+    def session(self, *responses, offline=False):
+        session = ECFRSession(cache=self.cache, offline=offline)
+        adapter = FakeAdapter(responses)
+        session.mount("https://", adapter)
+        return session, adapter
+
+    def stored(self):
+        return sorted(os.listdir(os.path.join(self.root, "objects")))
+
+    def test_revalidation(self):
+        body = b"<DIV1>title</DIV1>" * 100
+        session, adapter = self.session(
+            (200, {"ETag": '"v1"', "Content-Type": "application/xml"}, body),
+            (304, {"ETag": '"v1"'}, b""),
+        )
+        self.assertEqual(session.get(self.url).content, body)
+        self.assertEqual(len(self.stored()), 1)
+
+        response = session.get(self.url)
+        self.assertEqual(adapter.requests[1].headers["If-None-Match"], '"v1"')
+        self.assertEqual((response.status_code, response.content), (200, body))
+        self.assertEqual(response.headers["Content-Type"], "application/xml")
+
+    def test_offline(self):
+        body = b"<DIV1>title</DIV1>"
+        session, _ = self.session((200, {"ETag": '"v1"'}, body))
+        self.assertEqual(session.get(self.url).content, body)
+
+        # the network is never used, so there are no responses to give
+        offline, adapter = self.session(offline=True)
+        self.assertEqual(offline.get(self.url).content, body)
+        with self.assertRaises(OfflineCacheMiss):
+            offline.get(self.url.replace("title-31", "title-32"))
+        self.assertEqual(adapter.requests, [])
+
+    def test_body_closed_early_is_not_cached(self):
+        session, _ = self.session((200, {}, b"x" * 10000))
+        response = session.get(self.url, stream=True)
+        response.raw.read(100)
+        response.close()
+        self.assertEqual(self.stored(), [])
+        self.assertIsNone(self.cache.lookup(self.url))
+
+    def test_stale_tmp_files(self):
+        objects = os.path.join(self.root, "objects")
+        for name in ("stale.tmp", "writing.tmp"):
+            with open(os.path.join(objects, name), "wb") as f:
+                f.write(b"x" * 100)
+        hour_ago = time.time() - 2 * 60 * 60
+        os.utime(os.path.join(objects, "stale.tmp"), (hour_ago, hour_ago))
+
+        cache = ResponseCache(self.root, max_bytes=10)
+        self.assertEqual(cache._size, 0)
+        self.assertEqual(self.stored(), ["writing.tmp"])
+
+
+class BulkWriterTests(TransactionTestCase):
+    def setUp(self):
+        self.title = Title.objects.create(number=31, name="Money and Finance: Treasury")
+
+    def write(self, on_batch, count=10):
+        writer = BulkWriter(Title, batch_size=2, max_queued=2, on_batch=on_batch)
+        for i in range(count):
+            self.title.name = f"Name {i}"
+            writer.add(self.title, ["name"], i)
+        return writer.close()
+
+    def test_database_error_fails_the_batch(self):
+        def on_batch(extras):
+            if any(extra == 4 for _, extra in extras):
+                raise DatabaseError("rejected")
+
+        results = self.write(on_batch)
+        self.assertEqual(
+            [result.ok for result in results], [True, True, False, True, True]
+        )
+        self.assertIsInstance(results[2].error, DatabaseError)
+
+    def test_other_errors_are_raised(self):
+        def on_batch(extras):
+            raise ValueError("bug")
+
+        # the producer is not left waiting on a full queue
+        with self.assertRaisesMessage(ValueError, "bug"):
+            self.write(on_batch, count=100)
+
+
+class MapBoundedTests(SimpleTestCase):
+    def test_every_error_is_the_jobs(self):
+        def job(i):
+            if i == 1:
+                raise OSError("missing file")
+            if i == 2:
+                raise KeyError("bug")
+            return i * 10
+
+        jobs = ((i, (i,)) for i in range(4))
+        with (
+            ThreadPoolExecutor(max_workers=2) as executor,
+            self.assertLogs("regulations.fetch", "ERROR") as logs,
+        ):
+            results = {
+                key: (result, error)
+                for key, result, error in map_bounded(executor, job, jobs, window=2)
+            }
+        self.assertEqual(results[0], (0, None))
+        self.assertEqual(results[3], (30, None))
+        self.assertIsInstance(results[1][1], OSError)
+        self.assertIsInstance(results[2][1], KeyError)
+        # only the unexpected error is logged, with its traceback
+        (record,) = logs.records
+        self.assertIn("job 2", record.getMessage())
+        self.assertIsNotNone(record.exc_info)
+
+
+class CompressedTextTests(TestCase):
+    def test_serialized_as_text(self):
+        title = Title.objects.create(number=31, name="Money and Finance: Treasury")
+        ref = CFRReference.objects.create(
+            agency=create_agency("fiscal-service"), title=title, full_text="Text ü."
+        )
+        data = serializers.serialize("json", CFRReference.objects.filter(pk=ref.pk))
+        self.assertEqual(json.loads(data)[0]["fields"]["full_text"], "Text ü.")
+
+        CFRReference.objects.filter(pk=ref.pk).update(full_text="Other.")
+        for obj in serializers.deserialize("json", data):
+            obj.save()
+        self.assertEqual(CFRReference.objects.get(pk=ref.pk).full_text, "Text ü.")
@@ -1,12 +1,21 @@
+from django.urls import include, path
 from rest_framework.routers import DefaultRouter
-from django.urls import path, include
-from . import views
+
+from . import async_views, views
 
 router = DefaultRouter()
 router.register(r"agency", views.AgencyResource, basename="agency")
 router.register(r"agency-name", views.AgencyNameResource, basename="agency-name")
 router.register(r"title", views.TitleResource, basename="title")
+router.register(r"reference", views.ReferenceResource, basename="reference")
+router.register(r"search", views.SearchResource, basename="search")
+router.register(r"word-counts", views.WordCountResource, basename="word-counts")
+router.register(r"analytics", views.AnalyticsResource, basename="analytics")
 
 urlpatterns = [
+    path("api/async/agency/", async_views.agency_list),
+    path("api/async/agency-name/", async_views.agency_name_list),
+    path("api/async/title/", async_views.title_list),
+    path("api/async/agency/<str:slug>/references/", async_views.agency_references),
     path("api/", include(router.urls)),
 ]
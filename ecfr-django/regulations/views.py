@@ -1,55 +1,275 @@
-from rest_framework.viewsets import ReadOnlyModelViewSet
-from rest_framework.permissions import AllowAny
+import re
+from itertools import chain
+
+from django.db.models import Q, Value
+from django.db.models.functions import Coalesce
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_date
 from rest_framework.decorators import action
+from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
-from .models import Agency, Title
-from .serializers import AgencyWordCountSerializer, TitleSerializer
+from rest_framework.viewsets import ReadOnlyModelViewSet, ViewSet
+
+from .analytics import NGRAM_SIZES, STATISTICS
+from .diff import diff_references, diff_title
+from .extraction import HIERARCHY, ReferenceSpec
+from .models import (
+    Agency,
+    AgencySnapshot,
+    AgencyStatistics,
+    AgencyWordCount,
+    CFRReference,
+    Section,
+    Title,
+)
+from .response_cache import CachedResponseMixin
+from .search import best_chunks, facets, query_terms, ranked_references, snippet
+from .serializers import (
+    AgencyWordCountSerializer,
+    CFRReferenceSerializer,
+    TitleSerializer,
+)
+from .streaming import (
+    decode_cursor,
+    dumps,
+    encode_cursor,
+    iter_byte_range,
+    iter_encoded,
+    iter_json_object,
+    iter_utf8,
+    negotiate_encoding,
+)
+
+# fields of /api/agency/<slug>/references/, and the ones returned by default
+REFERENCE_FIELD_CHOICES = [
+    "id",
+    "title",
+    "subtitle",
+    "chapter",
+    "subchapter",
+    "part",
+    "subpart",
+    "section",
+    "word_count",
+    "sentence_count",
+    "section_count",
+    "restriction_count",
+    "full_text",
+]
+# a single byte range, e.g. bytes=0-99, bytes=100- or bytes=-100
+BYTE_RANGE = re.compile(r"bytes=(\d*)-(\d*)")
+
+REFERENCE_FIELDS = [
+    "title",
+    "subtitle",
+    "chapter",
+    "subchapter",
+    "part",
+    "subpart",
+    "section",
+    "full_text",
+]
+
+
+def reference_listing(agency, params):
+    """
+    The references of an agency's /references/ listing, as (queryset, fields,
+    page size) from the ?fields=, ?cursor= and ?page_size= params. Raises
+    ValueError with a message for the client if one of them is invalid.
+    """
+    fields = REFERENCE_FIELDS
+    if params.get("fields"):
+        fields = params["fields"].split(",")
+        unknown = set(fields) - set(REFERENCE_FIELD_CHOICES)
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+
+    # references of the agency and of every agency below it, at any depth
+    references = (
+        CFRReference.objects.for_agency(agency)
+        .select_related("title")
+        .annotate(chapter_key=Coalesce("chapter", Value("")))
+        .order_by("title_id", "chapter_key", "id")
+    )
+    if "full_text" in fields:
+        # compressed text comes with each row, a few rows at a time
+        references = references.defer(None)
+    if params.get("cursor"):
+        try:
+            title_id, chapter, ref_id = decode_cursor(params["cursor"])
+        except (TypeError, ValueError):
+            raise ValueError("Invalid cursor") from None
+        references = references.filter(
+            Q(title_id__gt=title_id)
+            | Q(title_id=title_id, chapter_key__gt=chapter)
+            | Q(title_id=title_id, chapter_key=chapter, id__gt=ref_id)
+        )
+
+    page_size = None
+    if params.get("page_size"):
+        try:
+            page_size = int(params["page_size"])
+        except ValueError:
+            page_size = 0
+        if page_size < 1:
+            raise ValueError("page_size must be a positive integer")
+        references = references[: page_size + 1]
+    return references, fields, page_size
 
 
-class AgencyResource(ReadOnlyModelViewSet):
+def next_page_url(request, last):
+    """The url of the next page of a reference listing, starting after `last`"""
+    params = request.GET.copy()
+    params["cursor"] = encode_cursor([last.title_id, last.chapter_key, last.id])
+    return request.build_absolute_uri(f"{request.path}?{params.urlencode()}")
+
+
+def reference_values(ref, fields):
+    """The values of the listed fields of a reference, except full_text"""
+    values = {}
+    for field in fields:
+        if field == "title":
+            values["title"] = (
+                f"{ref.title.name} {ref.title.number}" if ref.title else None
+            )
+        elif field != "full_text":
+            values[field] = getattr(ref, field)
+    return values
+
+
+def diff_options(params):
+    """
+    The (from date, to date, words) of a diff from the ?from=, ?to= and
+    ?words= params. Raises ValueError with a message for the client if one of
+    them is invalid.
+    """
+    dates = []
+    for param in ("from", "to"):
+        try:
+            date = parse_date(params.get(param, ""))
+        except ValueError:
+            date = None
+        if date is None:
+            raise ValueError(f"{param} must be a date in YYYY-MM-DD format")
+        dates.append(date)
+    words = params.get("words", "true").lower() not in ("0", "false", "no")
+    return dates[0], dates[1], words
+
+
+def text_missing(ref):
+    """For a reference whose text read as nothing: whether it has no text, not an empty one"""
+    return ref.sections_version is None and ref.__dict__["full_text"] is None
+
+
+class AgencyResource(CachedResponseMixin, ReadOnlyModelViewSet):
     permission_classes = [AllowAny]
     serializer_class = AgencyWordCountSerializer
+    # references are streamed, and too large to cache
+    cached_actions = {"list", "retrieve", "get_timeseries", "get_diff"}
 
     def get_queryset(self):
         return Agency.objects.order_by("-cfr_word_count").distinct("cfr_word_count")
 
     @action(detail=True, methods=["get"], url_path="references")
     def get_references(self, request, pk=None):
+        """
+        References of the agency and of every agency below it, written to the
+        response as they are read.
+
+        ?fields= picks the reference fields from REFERENCE_FIELD_CHOICES
+        (default: the division and full_text, without id or any of the counts),
+        and ?page_size= pages through them with the returned "next" url.
+        """
         try:
             agency = Agency.objects.get(slug=pk)
-            # Get direct references
-            references = agency.cfr_references.all()
-
-            # Get references from all child agencies
-            for child in agency.children.all():
-                references |= child.cfr_references.all()
-                # Get references from grandchildren
-                for grandchild in child.children.all():
-                    references |= grandchild.cfr_references.all()
-            data = {
-                "agency_word_count": agency.cfr_word_count,
-                "references": [
-                    {
-                        "title": f"{ref.title.name} {ref.title.number}"
-                        if ref.title
-                        else None,
-                        "subtitle": ref.subtitle,
-                        "chapter": ref.chapter,
-                        "subchapter": ref.subchapter,
-                        "part": ref.part,
-                        "subpart": ref.subpart,
-                        "section": ref.section,
-                        "full_text": ref.full_text,
-                    }
-                    for ref in references
+        except Agency.DoesNotExist:
+            return Response({"error": "Agency not found"}, status=404)
+        try:
+            references, fields, page_size = reference_listing(
+                agency, request.query_params
+            )
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
+
+        return StreamingHttpResponse(
+            self.stream_references(request, agency, references, fields, page_size),
+            content_type="application/json",
+        )
+
+    def stream_references(self, request, agency, references, fields, page_size):
+        yield f'{{"agency_word_count": {dumps(agency.cfr_word_count)}, "references": ['
+        next_url = previous = None
+        chunk_size = 20 if "full_text" in fields else 500
+        for i, ref in enumerate(references.iterator(chunk_size=chunk_size)):
+            if i == page_size:
+                # there is another page, starting after the last reference written
+                next_url = next_page_url(request, previous)
+                break
+            if i:
+                yield ", "
+            yield from self.iter_reference(ref, fields)
+            previous = ref
+        yield "]"
+        if page_size:
+            yield f', "next": {dumps(next_url)}'
+        yield "}"
+
+    def iter_reference(self, ref, fields):
+        streamed = ()
+        if "full_text" in fields:
+            chunks = ref.iter_full_text()
+            first = next(chunks, None)
+            if first is None:
+                streamed = [("full_text", None if text_missing(ref) else ())]
+            else:
+                streamed = [("full_text", chain([first], chunks))]
+        yield from iter_json_object(reference_values(ref, fields), streamed)
+
+    @action(detail=True, methods=["get"], url_path="timeseries")
+    def get_timeseries(self, request, pk=None):
+        """Word counts of the agency over time, from the snapshots of backfill_snapshots"""
+        try:
+            agency = Agency.objects.get(slug=pk)
+        except Agency.DoesNotExist:
+            return Response({"error": "Agency not found"}, status=404)
+        snapshots = AgencySnapshot.objects.filter(agency=agency).order_by("date")
+        return Response(
+            {
+                "agency": agency.slug,
+                "series": [
+                    {"date": day, "word_count": word_count}
+                    for day, word_count in snapshots.values_list("date", "word_count")
                 ],
             }
-            return Response(data)
+        )
+
+    @action(detail=True, methods=["get"], url_path="diff")
+    def get_diff(self, request, pk=None):
+        """
+        What changed in the references of the agency and of every agency below
+        it between the stored versions of ?from= and ?to=, per title, with the
+        changed words unless ?words=false; titles without a stored version are
+        listed as unavailable_titles
+        """
+        try:
+            agency = Agency.objects.get(slug=pk)
         except Agency.DoesNotExist:
             return Response({"error": "Agency not found"}, status=404)
+        try:
+            from_date, to_date, words = diff_options(request.query_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
 
+        references = CFRReference.objects.for_agency(agency).only(
+            *(ref_attr for _, _, ref_attr in HIERARCHY)
+        )
+        titles, unavailable = diff_references(references, from_date, to_date, words)
+        return Response(
+            {"agency": agency.slug, "titles": titles, "unavailable_titles": unavailable}
+        )
 
-class AgencyNameResource(ReadOnlyModelViewSet):
+
+class AgencyNameResource(CachedResponseMixin, ReadOnlyModelViewSet):
     permission_classes = [AllowAny]
     serializer_class = AgencyWordCountSerializer
 
@@ -57,9 +277,342 @@ class AgencyNameResource(ReadOnlyModelViewSet):
         return Agency.objects.order_by("name")
 
 
-class TitleResource(ReadOnlyModelViewSet):
+class TitleResource(CachedResponseMixin, ReadOnlyModelViewSet):
     permission_classes = [AllowAny]
     serializer_class = TitleSerializer
+    cached_actions = {"list", "retrieve", "get_sections", "get_diff"}
 
     def get_queryset(self):
         return Title.objects.all()
+
+    @action(detail=True, methods=["get"], url_path="sections")
+    def get_sections(self, request, pk=None):
+        """Sections of a part (?part=) or a single section (?section=), as of ?date= or the latest stored version"""
+        part = request.query_params.get("part")
+        section = request.query_params.get("section")
+        if not part and not section:
+            return Response({"error": "part or section is required"}, status=400)
+
+        sections = Section.objects.filter(title_id=pk, type="SECTION")
+        if part:
+            sections = sections.filter(part=part)
+        if section:
+            sections = sections.filter(section=section)
+        version_date = request.query_params.get("date")
+        if not version_date:
+            latest = sections.order_by("-version_date").values("version_date").first()
+            if latest is None:
+                return Response({"error": "Sections not found"}, status=404)
+            version_date = latest["version_date"]
+        sections = sections.filter(version_date=version_date).select_related("text")
+
+        return Response(
+            {
+                "title": pk,
+                "version_date": version_date,
+                "sections": [
+                    {
+                        "part": s.part,
+                        "section": s.section,
+                        "heading": s.heading.strip(),
+                        "text": s.text.text.strip(),
+                        "content_hash": s.text_id,
+                    }
+                    for s in sections
+                ],
+            }
+        )
+
+    @action(detail=True, methods=["get"], url_path="diff")
+    def get_diff(self, request, pk=None):
+        """
+        What changed in the title, or in the division of ?subtitle=,
+        ?chapter=, ?subchapter=, ?part=, ?subpart= or ?section=, between the
+        stored versions of ?from= and ?to=, with the changed words unless
+        ?words=false
+        """
+        if not pk.isdigit():
+            return Response({"error": "Title not found"}, status=404)
+        try:
+            from_date, to_date, words = diff_options(request.query_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
+
+        division = ReferenceSpec(
+            int(pk),
+            *(request.query_params.get(ref_attr) for _, _, ref_attr in HIERARCHY[1:]),
+        )
+        try:
+            title = diff_title(division.title_id, from_date, to_date, [division], words)
+        except Section.DoesNotExist as e:
+            return Response({"error": str(e)}, status=404)
+        return Response(title)
+
+
+class ReferenceResource(ReadOnlyModelViewSet):
+    permission_classes = [AllowAny]
+    serializer_class = CFRReferenceSerializer
+
+    def get_queryset(self):
+        return CFRReference.objects.order_by("id")
+
+    @action(detail=True, methods=["get"], url_path="text")
+    def get_text(self, request, pk=None):
+        """
+        The reference's text as text/plain, streamed in chunks.
+
+        A single byte Range of the UTF-8 text is answered with 206, and the
+        ETag (the hash of the text served, see CFRReference.text_hash) is
+        honored by If-None-Match and If-Range.
+        Whole responses are brotli or gzip encoded when the client accepts it.
+        """
+        try:
+            ref = CFRReference.objects.get(pk=int(pk))
+        except (ValueError, CFRReference.DoesNotExist):
+            return Response({"error": "Reference not found"}, status=404)
+        if (
+            ref.sections_version is None
+            and not CFRReference.objects.filter(
+                pk=ref.pk, full_text__isnull=False
+            ).exists()
+        ):
+            return Response({"error": "Text not found"}, status=404)
+
+        text_hash = ref.text_hash()
+        etag = f'"{text_hash}"' if text_hash else None
+        if etag and self.etag_matches(request.headers.get("If-None-Match"), text_hash):
+            response = HttpResponse(status=304)
+            response["ETag"] = etag
+            return response
+
+        byte_range = request.headers.get("Range")
+        if request.headers.get("If-Range", etag) != etag:
+            # the client's copy is outdated, so send the whole text
+            byte_range = None
+        match = BYTE_RANGE.fullmatch(byte_range.strip()) if byte_range else None
+        if match and any(match.groups()):
+            return self.text_range(ref, etag, *match.groups())
+
+        encoding = negotiate_encoding(request.headers.get("Accept-Encoding", ""))
+        body = iter_utf8(ref.iter_full_text())
+        if encoding:
+            body = iter_encoded(body, encoding)
+        response = StreamingHttpResponse(body, content_type="text/plain; charset=utf-8")
+        if encoding:
+            response["Content-Encoding"] = encoding
+        if etag:
+            # each encoding is a different representation, with its own strong ETag
+            response["ETag"] = f'"{text_hash}-{encoding}"' if encoding else etag
+        response["Accept-Ranges"] = "bytes"
+        response["Vary"] = "Accept-Encoding"
+        return response
+
+    def etag_matches(self, if_none_match, text_hash):
+        if not if_none_match:
+            return False
+        for tag in if_none_match.split(","):
+            tag = tag.strip().removeprefix("W/").strip('"')
+            if tag == "*" or tag.split("-")[0] == text_hash:
+                return True
+        return False
+
+    def text_range(self, ref, etag, first, last):
+        length = ref.byte_count
+        if length is None:
+            # extracted before byte counts were stored, so measure the text once
+            length = sum(len(chunk) for chunk in iter_utf8(ref.iter_full_text()))
+        if first:
+            start = int(first)
+            end = min(int(last), length - 1) if last else length - 1
+        else:
+            # the last `last` bytes
+            start = max(length - int(last), 0)
+            end = length - 1
+        if start >= length or end < start:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{length}"
+            return response
+
+        response = StreamingHttpResponse(
+            iter_byte_range(iter_utf8(ref.iter_full_text()), start, end),
+            status=206,
+            content_type="text/plain; charset=utf-8",
+        )
+        response["Content-Range"] = f"bytes {start}-{end}/{length}"
+        response["Content-Length"] = str(end - start + 1)
+        response["Accept-Ranges"] = "bytes"
+        if etag:
+            response["ETag"] = etag
+        return response
+
+
+class SearchResource(CachedResponseMixin, ViewSet):
+    permission_classes = [AllowAny]
+
+    def list(self, request):
+        """
+        References whose text matches ?q= (websearch syntax: "quoted phrases",
+        or, -excluded), best first, with a highlighted snippet of each and the
+        number of matches by title and agency.
+
+        ?title= and ?agency= (including its sub-agencies) narrow the search;
+        ?page= and ?page_size= (default 20, at most 100) page through it.
+        """
+        q = request.query_params.get("q", "").strip()
+        if not q:
+            return Response({"error": "q is required"}, status=400)
+        try:
+            page = int(request.query_params.get("page", 1))
+            page_size = min(int(request.query_params.get("page_size", 20)), 100)
+        except ValueError:
+            page = page_size = 0
+        if page < 1 or page_size < 1:
+            return Response(
+                {"error": "page and page_size must be positive integers"}, status=400
+            )
+
+        references = CFRReference.objects.all()
+        title = request.query_params.get("title")
+        if title:
+            if not title.isdigit():
+                return Response({"error": "title must be a title number"}, status=400)
+            references = references.filter(title_id=title)
+        slug = request.query_params.get("agency")
+        if slug:
+            try:
+                agency = Agency.objects.get(slug=slug)
+            except Agency.DoesNotExist:
+                return Response({"error": "Agency not found"}, status=404)
+            references = references.filter(
+                agency__in=Agency.objects.descendants(agency)
+            )
+
+        matches = ranked_references(q, references if title or slug else None)
+        offset = (page - 1) * page_size
+        rows = list(matches[offset : offset + page_size])
+        ids = [row["reference_id"] for row in rows]
+        refs = CFRReference.objects.select_related("title", "agency").in_bulk(ids)
+        chunks = best_chunks(q, ids)
+        terms = query_terms(q)
+
+        return Response(
+            {
+                "query": q,
+                "count": matches.count(),
+                "page": page,
+                "results": [
+                    {
+                        "reference": row["reference_id"],
+                        "label": str(refs[row["reference_id"]]),
+                        "title": refs[row["reference_id"]].title_id,
+                        "agency": refs[row["reference_id"]].agency.slug,
+                        "rank": row["rank"],
+                        "snippet": (
+                            snippet(chunks[row["reference_id"]].text, terms)
+                            if row["reference_id"] in chunks
+                            else ""
+                        ),
+                    }
+                    for row in rows
+                ],
+                "facets": facets(matches),
+            }
+        )
+
+
+class WordCountResource(CachedResponseMixin, ViewSet):
+    permission_classes = [AllowAny]
+
+    def list(self, request):
+        """
+        Word counts of every agency (with its sub-agencies) by title, or by
+        chapter with ?by=chapter, optionally for one ?title=.
+
+        The payload is columnar: "agencies" and "titles" hold parallel lists,
+        and each cell is the same position in the lists of "cells", whose
+        "agency" and "title" are indexes into them.
+        """
+        by = request.query_params.get("by", "title")
+        if by not in ("title", "chapter"):
+            return Response({"error": "by must be title or chapter"}, status=400)
+        cells = AgencyWordCount.objects.filter(chapter__isnull=by == "title")
+        title = request.query_params.get("title")
+        if title:
+            if not title.isdigit():
+                return Response({"error": "title must be a title number"}, status=400)
+            cells = cells.filter(title_id=title)
+        cells = list(
+            cells.order_by("agency_id", "title_id", "chapter").values_list(
+                "agency_id", "title_id", "chapter", "word_count"
+            )
+        )
+
+        agencies = list(
+            Agency.objects.filter(id__in={cell[0] for cell in cells})
+            .order_by("id")
+            .values_list("id", "slug", "name")
+        )
+        titles = list(
+            Title.objects.filter(number__in={cell[1] for cell in cells})
+            .order_by("number")
+            .values_list("number", "name")
+        )
+        agency_index = {agency[0]: i for i, agency in enumerate(agencies)}
+        title_index = {title[0]: i for i, title in enumerate(titles)}
+
+        columns = {
+            "agency": [agency_index[cell[0]] for cell in cells],
+            "title": [title_index[cell[1]] for cell in cells],
+        }
+        if by == "chapter":
+            columns["chapter"] = [cell[2] for cell in cells]
+        columns["word_count"] = [cell[3] for cell in cells]
+        return Response(
+            {
+                "by": by,
+                "agencies": {
+                    "slug": [agency[1] for agency in agencies],
+                    "name": [agency[2] for agency in agencies],
+                },
+                "titles": {
+                    "number": [title[0] for title in titles],
+                    "name": [title[1] for title in titles],
+                },
+                "cells": columns,
+            }
+        )
+
+
+def statistics_values(statistics):
+    """The agency and TextStatistics of an AgencyStatistics"""
+    return {
+        "slug": statistics.agency.slug,
+        "name": statistics.agency.name,
+        **{statistic: getattr(statistics, statistic) for statistic in STATISTICS},
+    }
+
+
+class AnalyticsResource(CachedResponseMixin, ViewSet):
+    permission_classes = [AllowAny]
+
+    def list(self, request):
+        """Text statistics of every agency with its sub-agencies, the most restrictive first"""
+        statistics = AgencyStatistics.objects.select_related("agency").order_by(
+            "-restriction_count", "agency__name"
+        )
+        return Response([statistics_values(row) for row in statistics])
+
+    def retrieve(self, request, pk=None):
+        """Text statistics of an agency with its sub-agencies, and their most frequent n-grams by length"""
+        try:
+            statistics = AgencyStatistics.objects.select_related("agency").get(
+                agency__slug=pk
+            )
+        except AgencyStatistics.DoesNotExist:
+            return Response({"error": "Agency not found"}, status=404)
+        ngrams = {n: [] for n in NGRAM_SIZES}
+        for n, ngram, count in statistics.agency.ngrams.values_list(
+            "n", "ngram", "count"
+        ):
+            ngrams[n].append({"ngram": ngram, "count": count})
+        return Response({**statistics_values(statistics), "ngrams": ngrams})
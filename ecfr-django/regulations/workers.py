@@ -0,0 +1,102 @@
+"""
+Fetch-and-extract jobs for scrape_cfr_text, run on a thread or process pool
+
+Jobs carry plain ReferenceSpecs (or CFRReferences on threads) in and compact
+text results out, and never touch the database.
+"""
+
+import io
+import mmap
+import time
+from collections import namedtuple
+
+from .extraction import (
+    extract_response,
+    read_title,
+    stream_divisions,
+    stream_extract,
+    text_analytics,
+)
+from .fetch import get_session
+
+ExtractionResult = namedtuple(
+    "ExtractionResult",
+    ["extractions", "fetch_seconds", "extract_seconds", "divisions", "analytics"],
+    defaults=[None, None],
+)
+
+# the session of a worker process, see init_worker
+_session = None
+
+
+def init_worker(rate_limit=None, retries=0):
+    global _session
+    _session = get_session(pool_size=1, rate_limit=rate_limit, retries=retries)
+
+
+def fetch_and_extract(
+    url,
+    refs,
+    stream=False,
+    include_headers=True,
+    session=None,
+    sections=False,
+    analytics=False,
+):
+    """
+    Downloads, parses and extracts one job, returning an Extraction per
+    reference along with how long the download and the extraction took, with
+    `sections` every Division of the downloaded title, and with `analytics` the
+    TextAnalytics of each extracted text (None for no text)
+    """
+    # divisions are a second pass over the body, so it has to be kept
+    stream = stream and not sections
+    started = time.monotonic()
+    response = (session or _session).get(url, stream=True)
+    response.raise_for_status()
+    if not stream:
+        _ = response.content  # read the body before timing
+    fetched = time.monotonic()
+
+    extractions = extract_response(response, refs, stream, include_headers)
+    divisions = None
+    if sections:
+        divisions = list(stream_divisions(io.BytesIO(response.content)))
+    return ExtractionResult(
+        extractions,
+        fetched - started,
+        time.monotonic() - fetched,
+        divisions,
+        extractions_analytics(extractions) if analytics else None,
+    )
+
+
+def extractions_analytics(extractions):
+    """The TextAnalytics of the text of each Extraction, or None where there is none"""
+    return [
+        text_analytics(extraction.text) if extraction.text else None
+        for extraction in extractions
+    ]
+
+
+def extract_file(path, refs, sections=False):
+    """
+    Extracts the text of each reference from a local title XML file, read
+    through a memory map in a single streaming pass.
+
+    Returns the (number, name) of the title, an Extraction per reference,
+    with `sections` every Division of the title (or None), and the
+    TextAnalytics of each extracted text (None for no text).
+    """
+    with (
+        open(path, "rb") as f,
+        mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data,
+    ):
+        number, name = read_title(data)
+        data.seek(0)
+        extractions = stream_extract(data, refs)
+        divisions = None
+        if sections:
+            data.seek(0)
+            divisions = list(stream_divisions(data))
+    return number, name, extractions, divisions, extractions_analytics(extractions)
@@ -0,0 +1,121 @@
+"""
+Write-behind stage that saves scraped results in batches
+"""
+
+import queue
+import threading
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+from django.db import DatabaseError, connection, transaction
+
+_CLOSE = object()
+
+
+@dataclass
+class BatchResult:
+    """Outcome of writing one batch; `error` is None if every object was saved"""
+
+    objects: list = field(default_factory=list)
+    error: Exception | None = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class BulkWriter:
+    """
+    Buffers model instances and saves them with bulk_update on a background thread.
+
+    add() blocks once `max_queued` instances are waiting, so a writer that
+    falls behind slows the producer down instead of holding the whole scrape in
+    memory. Each batch of up to `batch_size` instances is written in its own
+    transaction, grouped by the fields that changed.
+
+    Rows that belong with the instances are written by `on_batch`, which is
+    called in the same transaction with the (instance, extra) of every
+    instance of the batch that was added with an `extra`.
+
+    A batch the database rejects is reported as a failed BatchResult. Any
+    other error stops the thread, and is raised by the next add() or close().
+    """
+
+    def __init__(self, model, batch_size=100, max_queued=None, on_batch=None):
+        self.model = model
+        self.batch_size = batch_size
+        self.on_batch = on_batch
+        self._queue = queue.Queue(maxsize=max_queued or batch_size * 2)
+        self._results = queue.Queue()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def add(self, obj, fields, extra=None):
+        self._put((obj, tuple(fields), extra))
+
+    def _put(self, item):
+        # a stopped thread takes nothing more, so never wait on a full queue for it
+        while True:
+            self._raise_error()
+            try:
+                self._queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def completed(self):
+        """Returns the results of the batches written since the last call"""
+        results = []
+        while True:
+            try:
+                results.append(self._results.get_nowait())
+            except queue.Empty:
+                return results
+
+    def close(self):
+        """Flushes what is left, stops the thread and returns the remaining results"""
+        self._put(_CLOSE)
+        self._thread.join()
+        self._raise_error()
+        return self.completed()
+
+    def _run(self):
+        batch = []
+        try:
+            while True:
+                item = self._queue.get()
+                if item is _CLOSE:
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    self._flush(batch)
+                    batch = []
+            if batch:
+                self._flush(batch)
+        except Exception as e:  # noqa: BLE001 - raised by add() and close()
+            self._error = e
+        finally:
+            # connections are per thread, so this one has to be closed here
+            connection.close()
+
+    def _flush(self, batch):
+        by_fields = defaultdict(list)
+        for obj, fields, _ in batch:
+            by_fields[fields].append(obj)
+        extras = [(obj, extra) for obj, _, extra in batch if extra is not None]
+
+        result = BatchResult(objects=[obj for obj, _, _ in batch])
+        try:
+            with transaction.atomic():
+                for fields, objs in by_fields.items():
+                    self.model.objects.bulk_update(objs, fields)
+                if self.on_batch and extras:
+                    self.on_batch(extras)
+        except DatabaseError as e:
+            result.error = e
+        self._results.put(result)